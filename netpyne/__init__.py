@@ -15,16 +15,34 @@ if nogui:  # completely disables graphics (avoids importing matplotlib)
     __gui__ = False
 
 elif not display or len(display) == 0:  # if no display env available (e.g. clusters) uses 'Agg' backend to plot
-    import matplotlib
-    matplotlib.use('Agg')
-
-from netpyne import analysis
-from netpyne import batch
-from netpyne import cell
-from netpyne import conversion
-from netpyne import metadata
-from netpyne import network
-from netpyne import sim
-from netpyne import specs
-from netpyne import support
-from netpyne import tests
+    if 'matplotlib' in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    else:  # set backend without importing matplotlib (only imported when plotting)
+        os.environ['MPLBACKEND'] = 'Agg'
+
+# subpackages are imported on first access (eg. netpyne.analysis), so importing netpyne (eg. in each job of a batch)
+# does not import the dependencies of the subpackages not used (eg. matplotlib, scipy, pandas and bokeh in analysis)
+__all__ = ['analysis', 'batch', 'cell', 'conversion', 'metadata', 'network', 'sim', 'specs', 'support', 'tests']
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in __all__:
+            import importlib
+            return importlib.import_module('netpyne.' + name)
+        raise AttributeError("module 'netpyne' has no attribute '%s'" % (name))
+
+    def __dir__():
+        return sorted(list(globals().keys()) + __all__)
+
+else:  # module __getattr__ not supported
+    from netpyne import analysis
+    from netpyne import batch
+    from netpyne import cell
+    from netpyne import conversion
+    from netpyne import metadata
+    from netpyne import network
+    from netpyne import sim
+    from netpyne import specs
+    from netpyne import support
+    from netpyne import tests
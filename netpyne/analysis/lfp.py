@@ -541,7 +541,7 @@ def plotLFP(timeRange=None, electrodes=['avg', 'all'], plots=['timeSeries', 'PSD
         cvals = [] # used to store total transfer resistance
 
         for cell in sim.net.compartCells:
-            trSegs = list(np.sum(sim.net.recXElectrode.getTransferResistance(cell.gid)*1e3, axis=0)) # convert from Mohm to kilohm
+            trSegs = list(np.asarray(sim.net.recXElectrode.getTransferResistance(cell.gid).sum(axis=0)).ravel()*1e3) # convert from Mohm to kilohm (sum of sparse matrix is 2D)
             if not includeAxon:
                 i = 0
                 for secName, sec in cell.secs.items():
@@ -214,6 +214,12 @@ def plotTraces(include=None, timeRange=None, oneFigPer='cell', rerun=False, titl
                             data = np.array(sim.allSimData[trace]['cell_'+str(gid)])[t_indexes]
                             lenData = len(data)
                             t = t[t_indexes]
+                        elif len(sim.allSimData.get('traceTimes', {}).get(trace, [])) == len(fullTrace):  # shared time vector (eg. decimated traces)
+                            tAll = np.array(sim.allSimData['traceTimes'][trace])
+                            t_indexes = (tAll >= timeRange[0]) & (tAll < timeRange[1])
+                            data = np.array(fullTrace)[t_indexes]
+                            lenData = len(data)
+                            t = tAll[t_indexes]
                         else:
                             data = np.array(fullTrace[int(timeRange[0]/recordStep):int(timeRange[1]/recordStep)])
                             lenData = len(data)
@@ -293,6 +299,12 @@ def plotTraces(include=None, timeRange=None, oneFigPer='cell', rerun=False, titl
                             data = np.array(sim.allSimData[trace]['cell_'+str(gid)])[t_indexes]
                             lenData = len(data)
                             t = t[t_indexes]
+                        elif len(sim.allSimData.get('traceTimes', {}).get(trace, [])) == len(fullTrace):  # shared time vector (eg. decimated traces)
+                            tAll = np.array(sim.allSimData['traceTimes'][trace])
+                            t_indexes = (tAll >= timeRange[0]) & (tAll < timeRange[1])
+                            data = np.array(fullTrace)[t_indexes]
+                            lenData = len(data)
+                            t = tAll[t_indexes]
                         else:
                             data = np.array(fullTrace[int(timeRange[0]/recordStep):int(timeRange[1]/recordStep)])
                             lenData = len(data)
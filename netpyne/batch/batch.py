@@ -136,10 +136,12 @@ class Batch(object):
         # make copy of batch object to save it; but skip cfg (since instance of SimConfig and can't be copied)
         odict = deepcopy({k:v for k,v in self.__dict__.items() if k != 'cfg'})  
 
-        if 'evolCfg' in odict:
-            odict['evolCfg']['fitnessFunc'] = 'removed'
-        if 'optimCfg' in odict:
-            odict['optimCfg']['fitnessFunc'] = 'removed'
+        for optCfg in ['evolCfg', 'optimCfg']:
+            if optCfg in odict:
+                odict[optCfg]['fitnessFunc'] = 'removed'
+                for key in ['pruneFunc', 'pruneMetric', 'pruner']:
+                    if key in odict[optCfg]:
+                        odict[optCfg][key] = 'removed'
 
         odict['initCfg'] = tupleToStr(odict['initCfg'])
         dataSave = {'batch': tupleToStr(odict)}
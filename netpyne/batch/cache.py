@@ -0,0 +1,203 @@
+"""
+Module with a persistent cache of batch evaluations, to avoid simulating the same candidate twice
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+import os
+import glob
+import json
+import inspect
+import hashlib
+from time import time
+
+from .scheduler import fileSignature
+
+# cfg options that do not change the simulation result (job labels and output paths)
+CACHE_IGNORE_CFG_KEYS = ['simLabel', 'saveFolder', 'filename', 'batchResult', 'resultsStore', 'backupCfgFile']
+
+
+# -------------------------------------------------------------------------------
+# Cache of evaluations
+# -------------------------------------------------------------------------------
+class EvaluationCache(object):
+    """
+    Cache of batch evaluations (fitness of optimization candidates, or completed grid jobs) keyed by a hash of the
+    netParams file, the job script, the .mod files, the fitness function (source code and args) and the cfg of the job
+    (after setting the candidate params, so seeds are included; labels and output paths are ignored). If a cache file
+    is set, entries are appended to it (JSON lines), so a batch run again, or a new batch using the same cache file,
+    does not simulate again the candidates already evaluated. Within a generation, candidates with the same key are
+    simulated only once.
+
+    Note: for grid batches, the ledger of the local scheduler (runCfg 'ledger') also skips jobs completed in a previous
+    run, but only jobs with the same name and cfg file; the cache file also skips jobs with a different name and the
+    same cfg, even if their output files were deleted.
+
+    Parameters
+    ----------
+    cacheFile : str
+        Path of the cache file
+        **Default:** ``None`` only keeps the cache in memory
+
+    netParamsFile : str
+        Path of the netParams .py file (its contents are part of the key)
+        **Default:** ``None``
+
+    scriptFile : str
+        Path of the script run by each job (its contents and those of the .mod files in the working directory and its
+        'mod' folder are part of the key)
+        **Default:** ``None``
+
+    fitnessFunc : function
+        Fitness function of the optimization (its source code is part of the key)
+        **Default:** ``None``
+
+    fitnessFuncArgs : dict
+        Arguments of the fitness function (part of the key)
+        **Default:** ``None``
+
+    tolerance : dict
+        Step to round the value of each param (label as in batch params, eg. {'weight': 0.001}) before computing
+        the key, so candidates closer than the step share the cached fitness
+        **Default:** ``None``
+
+
+    """
+
+    def __init__(self, cacheFile=None, netParamsFile=None, tolerance=None, scriptFile=None, fitnessFunc=None, fitnessFuncArgs=None):
+        self.cacheFile = cacheFile
+        self.netParamsSignature = fileSignature(netParamsFile) if netParamsFile else None
+        self.codeSignature = [fileSignature(filename) for filename in ([scriptFile] if scriptFile and os.path.exists(scriptFile) else []) +
+                              sorted(glob.glob('*.mod') + glob.glob('mod/*.mod'))]
+        self.fitnessSignature = [functionSource(fitnessFunc), json.loads(json.dumps(fitnessFuncArgs, sort_keys=True, default=str))] if fitnessFunc else None
+        self.tolerance = tolerance or {}
+        self.entries = {}  # key: cache entry
+        self.newGeneration()
+
+        if cacheFile and os.path.exists(cacheFile):
+            with open(cacheFile, 'r') as fileObj:
+                for line in fileObj:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+                    except ValueError:  # line partially written when batch was interrupted
+                        pass
+            print('Loaded %d cached evaluations from %s' % (len(self.entries), cacheFile))
+
+
+    def key(self, cfg):
+        """
+        Returns the key of the cfg (md5 hash of netParams, script, .mod files and fitness function signatures and cfg
+        options, with params rounded)
+        """
+
+        cfgDict = json.loads(json.dumps({k: v for k, v in cfg.__dict__.items() if k not in CACHE_IGNORE_CFG_KEYS}, default=str))
+        for label, step in self.tolerance.items():
+            path = list(label) if isinstance(label, (list, tuple)) else [label]
+            container = cfgDict
+            for level in path[:-1]:
+                container = container.get(level, {}) if isinstance(container, dict) else {}
+            if isinstance(container, dict) and isinstance(container.get(path[-1]), (int, float)) and step:
+                container[path[-1]] = float('%.12g' % (round(container[path[-1]] / step) * step))
+
+        return hashlib.md5(json.dumps([self.netParamsSignature, self.codeSignature, self.fitnessSignature, cfgDict], sort_keys=True).encode()).hexdigest()
+
+
+    def get(self, cfg):
+        """
+        Returns the cache entry of the cfg (dict with 'key', 'fitness' and 'job'), or None
+        """
+
+        return self.entries.get(self.key(cfg))
+
+
+    def add(self, key, fitness=None, job=None):
+        entry = {'key': key, 'fitness': fitness, 'job': job, 'time': time()}
+        self.entries[key] = entry
+        if self.cacheFile:
+            with open(self.cacheFile, 'a') as fileObj:
+                fileObj.write(json.dumps(entry) + '\n')
+
+
+    # --------------------------------------------------------------------------
+    # Evaluation of a generation of candidates (evol and asd)
+    # --------------------------------------------------------------------------
+    def newGeneration(self):
+        self.keys = {}  # candidate index: (key, job) of candidates evaluated in this generation
+        self.duplicates = {}  # candidate index: index of candidate with the same key
+        self.reused = {}  # candidate index: cached fitness
+
+
+    def check(self, index, cfg, job):
+        """
+        Returns True if the candidate (with params already set in cfg) has to be simulated; otherwise its fitness
+        is taken from the cache or from an identical candidate of the same generation
+        """
+
+        key = self.key(cfg)
+        entry = self.entries.get(key)
+        if entry and entry.get('fitness') is not None:
+            self.reused[index] = entry['fitness']
+            print('  Candidate %d: reusing cached fitness = %s (job %s)' % (index, str(entry['fitness']), entry['job']))
+            return False
+        for otherIndex, (otherKey, otherJob) in self.keys.items():
+            if otherKey == key:
+                self.duplicates[index] = otherIndex
+                print('  Candidate %d: same as candidate %d, not simulated' % (index, otherIndex))
+                return False
+        self.keys[index] = (key, job)
+        return True
+
+
+    def initialFitness(self, numCandidates):
+        """
+        Returns list of fitness of the generation with the cached values (None for candidates to be simulated)
+        """
+
+        return [self.reused.get(i) for i in range(numCandidates)]
+
+
+    def complete(self, fitness, defaultFitness=None):
+        """
+        Sets the fitness of duplicated candidates and adds the simulated candidates to the cache (except those
+        that failed, ie. with defaultFitness)
+        """
+
+        for index, otherIndex in self.duplicates.items():
+            fitness[index] = fitness[otherIndex]
+        for index, (key, job) in self.keys.items():
+            if fitness[index] is not None and fitness[index] != defaultFitness:
+                self.add(key, fitness[index], job)
+        return fitness
+
+
+# -------------------------------------------------------------------------------
+# Source code of a function
+# -------------------------------------------------------------------------------
+def functionSource(func):
+    try:
+        return inspect.getsource(func)
+    except (TypeError, IOError):  # eg. builtin or defined in interactive session
+        return getattr(func, '__module__', '') + '.' + getattr(func, '__name__', str(func))
+
+
+# -------------------------------------------------------------------------------
+# Path of the cache file of a batch
+# -------------------------------------------------------------------------------
+def batchCacheFile(batch):
+    """
+    Returns the path of the cache file set in runCfg 'cache' (True uses <saveFolder>/<batchLabel>_cache.jsonl;
+    False, the default, only keeps the cache in memory during the batch)
+    """
+
+    cache = batch.runCfg.get('cache', False)
+    if cache is True:
+        return batch.saveFolder + '/' + batch.batchLabel + '_cache.jsonl'
+    return cache or None
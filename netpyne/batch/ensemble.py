@@ -0,0 +1,294 @@
+"""
+Module for packing several parameter variants of a network as disconnected replicas in a single simulation
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+import json
+import pickle
+import numpy as np
+
+from .resident import loadNetParams
+
+REPLICA_SEP = '__r'  # separator between rule labels and replica index (eg. pop 'E' of replica 2 -> 'E__r2')
+
+# netParams rule dicts that are copied for each replica, with their labels and references to other rules renamed
+RULE_PARAMS = ['cellParams', 'popParams', 'synMechParams', 'connParams', 'subConnParams', 'stimSourceParams', 'stimTargetParams']
+
+# cfg options that can differ between replicas (all other SimConfig options must be the same, since they apply to the
+# whole simulation; custom cfg options only affect the netParams of each replica)
+REPLICA_CFG_KEYS = ['simLabel', 'filename', 'saveFolder', 'seeds', 'batchResult', 'resultsStore', 'backupCfgFile']
+
+
+def _replicaLabel(label, ireplica):
+    return '%s%s%d' % (label, REPLICA_SEP, ireplica)
+
+
+def _mapLabels(value, labels, ireplica):
+    # rename label (or list of labels) if it is one of the replica labels
+    if isinstance(value, (list, tuple)):
+        return [_replicaLabel(v, ireplica) if isinstance(v, str) and v in labels else v for v in value]
+    return _replicaLabel(value, ireplica) if isinstance(value, str) and value in labels else value
+
+
+def _mapConds(conds, pops, cellTypes, ireplica):
+    # rename pops and cellTypes in conds, and restrict conds to the pops of the replica
+    conds = dict(conds or {})
+    if 'cellType' in conds:
+        conds['cellType'] = _mapLabels(conds['cellType'], cellTypes, ireplica)
+    if 'pop' in conds:
+        conds['pop'] = _mapLabels(conds['pop'], pops, ireplica)
+    else:
+        conds['pop'] = [_replicaLabel(pop, ireplica) for pop in pops]
+    return conds
+
+
+# -------------------------------------------------------------------------------
+# Pack replicas in a single netParams and cfg
+# -------------------------------------------------------------------------------
+def packEnsemble(netParamsList, cfgList):
+    """
+    Packs the netParams of several replicas (eg. generated from the cfg of each batch job) in a single netParams,
+    with the labels of each replica's rules renamed (eg. pop 'E' of replica 2 -> 'E__r2') and all conditions
+    restricted to the pops of the replica, so replicas are disconnected. Stimulation sources and NetStim/VecStim
+    pops without a 'seed' get the cfg.seeds['stim'] of their replica; other seeds (eg. 'conn', 'loc') apply to the
+    whole simulation, so they must be the same for all replicas. Returns the packed netParams and cfg (copy of the
+    first cfg, with cell recording options renamed for all replicas), or (None, None) if the replicas can not be
+    packed (eg. SimConfig options other than REPLICA_CFG_KEYS, or seeds other than 'stim', differ).
+    """
+
+    from .. import specs
+
+    # check options that apply to the whole simulation are the same for all replicas
+    defaultCfg = specs.SimConfig()
+    for key in list(defaultCfg.__dict__.keys()):
+        if key in REPLICA_CFG_KEYS: continue
+        values = set(json.dumps(getattr(cfg, key, None), sort_keys=True, default=str) for cfg in cfgList)
+        if len(values) > 1:
+            print('Error: ensemble replicas must have the same cfg.%s' % (key))
+            return None, None
+    for seedKey in set([seedKey for cfg in cfgList for seedKey in cfg.seeds if seedKey != 'stim']):
+        if len(set(json.dumps(cfg.seeds.get(seedKey), default=str) for cfg in cfgList)) > 1:
+            print("Error: ensemble replicas must have the same cfg.seeds['%s'] (only the 'stim' seed can differ)" % (seedKey))
+            return None, None
+
+    netParamsDicts = [netParams.__dict__ for netParams in netParamsList]
+    for key, value in netParamsDicts[0].items():
+        if key in RULE_PARAMS or key in ['_labelid', 'rxdParams']: continue
+        if any(json.dumps(d.get(key), sort_keys=True, default=str) != json.dumps(value, sort_keys=True, default=str) for d in netParamsDicts[1:]):
+            print('Error: ensemble replicas must have the same netParams.%s' % (key))
+            return None, None
+    if any(len(netParams.rxdParams) > 0 for netParams in netParamsList):
+        print('Error: ensemble replicas do not support rxdParams')
+        return None, None
+
+    packed = specs.NetParams()
+    for key, value in netParamsDicts[0].items():
+        if key not in RULE_PARAMS and key != 'rxdParams':
+            setattr(packed, key, value)
+
+    for ireplica, (netParams, cfg) in enumerate(zip(netParamsList, cfgList)):
+        pops = list(netParams.popParams.keys())
+        cellTypes = set([pop['cellType'] for pop in netParams.popParams.values() if 'cellType' in pop])
+        cellTypes.update([label for label, rule in netParams.cellParams.items() if not rule.get('conds')])
+        synMechs = list(netParams.synMechParams.keys())
+        stimSources = list(netParams.stimSourceParams.keys())
+        mapConds = lambda conds: _mapConds(conds, pops, cellTypes, ireplica)
+        stimSeed = cfg.seeds['stim']
+
+        for label, rule in netParams.cellParams.items():
+            rule = dict(rule)
+            if rule.get('conds'):
+                rule['conds'] = mapConds(rule['conds'])
+                packed.cellParams[_replicaLabel(label, ireplica)] = rule
+            else:  # simplified format: label is the cellType
+                packed.cellParams[_mapLabels(label, cellTypes, ireplica)] = rule
+
+        for label, rule in netParams.popParams.items():
+            rule = dict(rule)
+            if 'cellType' in rule:
+                rule['cellType'] = _mapLabels(rule['cellType'], cellTypes, ireplica)
+            if rule.get('cellModel') in ['NetStim', 'VecStim'] and 'seed' not in rule:
+                rule['seed'] = stimSeed
+            packed.popParams[_replicaLabel(label, ireplica)] = rule
+
+        for label, rule in netParams.synMechParams.items():
+            packed.synMechParams[_replicaLabel(label, ireplica)] = dict(rule)
+
+        for label, rule in netParams.connParams.items():
+            rule = dict(rule)
+            rule['preConds'] = mapConds(rule.get('preConds'))
+            rule['postConds'] = mapConds(rule.get('postConds'))
+            if 'synMech' in rule:
+                rule['synMech'] = _mapLabels(rule['synMech'], synMechs, ireplica)
+            packed.connParams[_replicaLabel(label, ireplica)] = rule
+
+        for label, rule in netParams.subConnParams.items():
+            rule = dict(rule)
+            rule['preConds'] = mapConds(rule.get('preConds'))
+            rule['postConds'] = mapConds(rule.get('postConds'))
+            if 'groupSynMechs' in rule:
+                rule['groupSynMechs'] = _mapLabels(rule['groupSynMechs'], synMechs, ireplica)
+            packed.subConnParams[_replicaLabel(label, ireplica)] = rule
+
+        for label, rule in netParams.stimSourceParams.items():
+            rule = dict(rule)
+            if rule.get('type') in ['NetStim', 'VecStim'] and 'seed' not in rule:
+                rule['seed'] = stimSeed
+            packed.stimSourceParams[_replicaLabel(label, ireplica)] = rule
+
+        for label, rule in netParams.stimTargetParams.items():
+            rule = dict(rule)
+            rule['source'] = _mapLabels(rule['source'], stimSources, ireplica)
+            rule['conds'] = mapConds(rule.get('conds'))
+            if 'synMech' in rule:
+                rule['synMech'] = _mapLabels(rule['synMech'], synMechs, ireplica)
+            packed.stimTargetParams[_replicaLabel(label, ireplica)] = rule
+
+    # cfg of the packed simulation; analysis and saving are done for each replica after unpacking
+    cfg = specs.SimConfig(pickle.loads(pickle.dumps(cfgList[0].__dict__)))
+    cfg.analysis = {}
+    cfg.batchResult = None
+    for key in ['savePickle', 'saveJson', 'saveMat', 'saveCSV', 'saveDpk', 'saveHDF5', 'saveDat']:
+        setattr(cfg, key, False)
+
+    # cells to record from all replicas
+    pops = list(netParamsList[0].popParams.keys())
+    cellTypes = set([pop['cellType'] for pop in netParamsList[0].popParams.values() if 'cellType' in pop])
+    replicaLabels = lambda value, labels: [_mapLabels(v, labels, i) for v in (value if isinstance(value, list) else [value]) for i in range(len(cfgList))]
+    for key in ['recordCells', 'recordCellsSpikes']:
+        cells = getattr(cfg, key)
+        if isinstance(cells, list):
+            packedCells = []
+            for cell in cells:
+                if isinstance(cell, (list, tuple)) and len(cell) == 2 and isinstance(cell[0], str):  # (pop, cell index)
+                    packedCells.extend([(pop, cell[1]) for pop in replicaLabels(cell[0], pops)])
+                elif isinstance(cell, str):
+                    packedCells.extend([c for c in replicaLabels(cell, pops) if c not in packedCells])
+                else:  # gids are offset after creating the cells (see runEnsemble)
+                    packedCells.append(cell)
+            setattr(cfg, key, packedCells)
+    for trace in cfg.recordTraces.values():
+        for condKey, labels in [('pop', pops), ('cellType', cellTypes)]:
+            if condKey in trace.get('conds', {}):
+                trace['conds'][condKey] = replicaLabels(trace['conds'][condKey], labels)
+
+    return packed, cfg
+
+
+# -------------------------------------------------------------------------------
+# Split the simData of the packed simulation into the simData of each replica
+# -------------------------------------------------------------------------------
+def unpackEnsemble(simData, gidRanges, duration):
+    """
+    Splits the gathered simData of the packed simulation into a list with the simData of each replica, with gids
+    relative to the first gid of the replica (as in a separate simulation of the replica) and pop labels restored.
+    gidRanges is the list of (first gid, number of cells) of each replica. Spikes, cell traces (dict or TraceMatrix
+    format), 't', 'popRates' and 'avgRate' are split; other keys (eg. LFP) sum all replicas and are not included.
+    """
+
+    from ..specs import Dict, TraceMatrix
+
+    spkt = np.array(simData.get('spkt', []))
+    spkid = np.array(simData.get('spkid', []))
+    replicaData = []
+    skipped = set()
+
+    for ireplica, (firstGid, numCells) in enumerate(gidRanges):
+        data = Dict()
+        inReplica = (spkid >= firstGid) & (spkid < firstGid + numCells)
+        data['spkt'] = spkt[inReplica].tolist()
+        data['spkid'] = (spkid[inReplica] - firstGid).tolist()
+        suffix = '%s%d' % (REPLICA_SEP, ireplica)
+
+        for key, value in simData.items():
+            if key in ['spkt', 'spkid']:
+                continue
+            elif key == 't':
+                data[key] = value
+            elif key == 'avgRate':
+                data[key] = float(len(data['spkt'])) / numCells / duration * 1e3 if numCells > 0 else 0
+            elif key == 'popRates':
+                data[key] = {pop[:-len(suffix)]: rate for pop, rate in value.items() if pop.endswith(suffix)}
+            elif isinstance(value, TraceMatrix):
+                rows = (value.gids >= firstGid) & (value.gids < firstGid + numCells)
+                data[key] = TraceMatrix(value.data[rows], value.gids[rows] - firstGid, value.t)
+            elif isinstance(value, dict) and len(value) > 0 and all(str(k).startswith('cell_') for k in value):
+                data[key] = Dict({'cell_%d' % (int(k.split('_')[1]) - firstGid): v for k, v in value.items()
+                                  if firstGid <= int(k.split('_')[1]) < firstGid + numCells})
+            else:
+                skipped.add(key)
+        replicaData.append(data)
+
+    if skipped:
+        print('  Ensemble simData keys not split by replica (not included): %s' % (', '.join(sorted(skipped))))
+    return replicaData
+
+
+# -------------------------------------------------------------------------------
+# Run several cfgs as replicas in a single simulation
+# -------------------------------------------------------------------------------
+def runEnsemble(netParamsFile, cfgList):
+    """
+    Runs the network of the netParams .py file for each cfg as disconnected replicas (with offset gids) of a single
+    simulation (one build and one run), and saves the data of each replica according to its cfg (eg. cfg.filename,
+    cfg.saveJson, cfg.batchResult). Returns the list of simData of each replica in node 0 (list of None in other
+    nodes), or None in all nodes if the replicas can not be packed.
+    """
+
+    from .. import sim
+
+    netParamsList = [loadNetParams(netParamsFile, cfg) for cfg in cfgList]
+    netParams, cfg = packEnsemble(netParamsList, cfgList)
+    if netParams is None:
+        return None
+
+    print('\nRunning %d ensemble replicas in a single simulation...' % (len(cfgList)))
+    sim.initialize(netParams, cfg)
+    sim.net.createPops()
+    sim.net.createCells()
+
+    # gid ranges of replicas (pops of each replica are created in order, so their gids are consecutive)
+    localGids = {}
+    for label, pop in sim.net.pops.items():
+        ireplica = int(label.rsplit(REPLICA_SEP, 1)[1])
+        localGids.setdefault(ireplica, []).extend(pop.cellGids)
+    gids = {}
+    for nodeGids in sim.pc.py_allgather(localGids):
+        for ireplica, replicaGids in nodeGids.items():
+            gids.setdefault(ireplica, []).extend(replicaGids)
+    gidRanges = [(min(gids[i]), len(gids[i])) if gids.get(i) else (0, 0) for i in range(len(cfgList))]
+
+    for key in ['recordCells', 'recordCellsSpikes']:  # offset gids selected for recording
+        cells = getattr(sim.cfg, key)
+        if isinstance(cells, list) and any(isinstance(cell, int) for cell in cells):
+            setattr(sim.cfg, key, [cell for cell in cells if not isinstance(cell, int)] +
+                                  [firstGid + cell for firstGid, numCells in gidRanges for cell in cells if isinstance(cell, int) and cell < numCells])
+
+    sim.net.connectCells()
+    sim.net.addStims()
+    sim.setupRecording()
+    sim.runSim()
+    sim.gatherData()
+
+    if sim.rank != 0:
+        return [None] * len(cfgList)
+
+    replicaData = unpackEnsemble(sim.allSimData, gidRanges, sim.cfg.duration)
+
+    # save each replica with its own cfg (also saves its batch result file, if any)
+    packedCfg, packedSimData = sim.cfg, sim.allSimData
+    for replicaCfg, data in zip(cfgList, replicaData):
+        sim.cfg, sim.allSimData = replicaCfg, data
+        print('  Replica %s: %d spikes (%.2f Hz)' % (replicaCfg.simLabel, len(data['spkt']), data.get('avgRate', 0)))
+        sim.saveData(include=[key for key in replicaCfg.saveDataInclude if key in ['simConfig', 'simData']])
+    sim.cfg, sim.allSimData = packedCfg, packedSimData
+
+    return replicaData
@@ -40,6 +40,12 @@ from neuron import h
 from netpyne import specs
 from .utils import createFolder
 from .utils import bashTemplate
+from .utils import createResultSocket, closeResultSocket, waitForResults, loadResult, loadProgress, pruneJob
+from .resident import ResidentPool
+from .subworlds import initSubworlds, runSubworldJobs
+from .scheduler import LocalScheduler, fileSignature
+from .cache import EvaluationCache, batchCacheFile
+from .store import batchStoreFile, storeParams
 
 pc = h.ParallelContext() # use bulletin board master/slave
 
@@ -116,6 +122,7 @@ def evolOptim(self, pc):
         global ngen
         ngen += 1
         total_jobs = 0
+        evalCache.newGeneration()
 
         # options slurm, mpi
         type = args.get('type', 'mpi_direct')
@@ -147,6 +154,10 @@ def evolOptim(self, pc):
         fitnessFuncArgs = args.get('fitnessFuncArgs')
         defaultFitness = args.get('defaultFitness')
 
+        # early termination of jobs from their intermediate metrics (see sim.saveBatchProgress)
+        pruneFunc = args.get('pruneFunc')
+        pruneInterval = args.get('pruneInterval') if pruneFunc else None
+
         # read params or set defaults
         sleepInterval = args.get('sleepInterval', 0.2)
 
@@ -156,11 +167,13 @@ def evolOptim(self, pc):
         # remember pids and jobids in a list
         pids = []
         jobids = {}
+        residentJobs = []  # (cfg path, job path) of jobs run in-process (resident workers or MPI subworlds)
+        residentIndices = []  # candidate index of each in-process job
 
         # create a job for each candidate
         for candidate_index, candidate in enumerate(candidates):
             # required for slurm
-            sleep(sleepInterval)
+            if type not in ['resident', 'mpi_subworlds']: sleep(sleepInterval)
 
             # name and path
             jobName = "gen_" + str(ngen) + "_cand_" + str(candidate_index)
@@ -180,12 +193,34 @@ def evolOptim(self, pc):
             self.cfg.simLabel = jobName
             self.cfg.saveFolder = genFolderPath
 
+            # summary of results added by the job to the batch results store (see batch/store.py)
+            storeFile = batchStoreFile(self)
+            self.cfg.resultsStore = {'file': storeFile, 'params': storeParams(paramLabels, candidate), 'files': {'cfg': jobPath + '_cfg.json'}} if storeFile else None
+
+            # skip candidates already evaluated (previous generations or runs) or repeated in this generation
+            if not evalCache.check(candidate_index, self.cfg, jobName):
+                continue
+
+            # file where the job saves the data needed to compute its fitness (see sim.saveBatchResult)
+            self.cfg.batchResult = {'file': jobPath + '_result.pkl', 'include': args.get('fitnessFuncInputs'), 'socket': resultSocketPath} if type not in ['resident', 'mpi_subworlds'] else None
+            if self.cfg.batchResult and pruneInterval:
+                self.cfg.batchResult.update({'progressInterval': pruneInterval, 'progressFile': jobPath + '_progress.pkl', 'stopFile': jobPath + '_stop'})
+                for fileName in [jobPath + '_progress.pkl', jobPath + '_stop']:
+                    if os.path.exists(fileName): os.remove(fileName)
+
             # save cfg instance to file
             cfgSavePath = jobPath + '_cfg.json'
             self.cfg.save(cfgSavePath)
 
 
-            if type=='mpi_bulletin':
+            if type in ['resident', 'mpi_subworlds']:
+                # ----------------------------------------------------------------------
+                # run in local workers or MPI subworlds that keep the network built (see batch/resident.py)
+                # ----------------------------------------------------------------------
+                residentJobs.append((cfgSavePath, jobPath))
+                residentIndices.append(candidate_index)
+
+            elif type=='mpi_bulletin':
                 # ----------------------------------------------------------------------
                 # MPI master-slaves
                 # ----------------------------------------------------------------------
@@ -236,26 +271,51 @@ def evolOptim(self, pc):
                 with open(batchfile, 'w') as text_file:
                     text_file.write("%s" % jobString)
 
-                #with open(jobPath+'.run', 'a+') as outf, open(jobPath+'.err', 'w') as errf:
-                with open(jobPath+'.jobid', 'w') as outf, open(jobPath+'.err', 'w') as errf:
-                    pids.append(Popen([executer, batchfile], stdout=outf,  stderr=errf, preexec_fn=os.setsid).pid)
-                #proc = Popen(command.split([executer, batchfile]), stdout=PIPE, stderr=PIPE)
-                sleep(0.1)
-                #read = proc.stdout.read()
-                with open(jobPath+'.jobid', 'r') as outf:
-                    read=outf.readline()
-                print(read)
-                if len(read) > 0:
-                    jobid = int(read.split()[-1])
-                    jobids[candidate_index] = jobid
-                print('jobids', jobids)
+                if type == 'mpi_direct':
+                    # local jobs are queued until there are enough free cores (see batch/scheduler.py)
+                    scheduler.submit(jobName, [executer, batchfile], cores=numproc, outFile=jobPath+'.run', errFile=jobPath+'.err',
+                                     doneFile=jobPath+'_result.pkl', signature=fileSignature(cfgSavePath))
+                else:
+                    with open(jobPath+'.jobid', 'w') as outf, open(jobPath+'.err', 'w') as errf:
+                        pids.append(Popen([executer, batchfile], stdout=outf, stderr=errf, preexec_fn=os.setsid).pid)
+                    sleep(0.1)
+                    with open(jobPath+'.jobid', 'r') as outf:
+                        read=outf.readline()
+                    print(read)
+                    if len(read) > 0:
+                        jobid = int(read.split()[-1])
+                        jobids[candidate_index] = jobid
+                    print('jobids', jobids)
             total_jobs += 1
-            sleep(0.1)
+            if type not in ['resident', 'mpi_subworlds']: sleep(0.1)
 
 
         # ----------------------------------------------------------------------
         # gather data and compute fitness
         # ----------------------------------------------------------------------
+        fitness = evalCache.initialFitness(len(candidates))
+
+        if type == 'resident':
+            # workers send the fitness when each job completes (no polling of output files)
+            for candidate_index, value in zip(residentIndices, residentPool.run(residentJobs, fitnessFunc, fitnessFuncArgs, defaultFitness)):
+                fitness[candidate_index] = value
+            fitness = evalCache.complete(fitness, defaultFitness)
+            print("-" * 80)
+            print("  Completed a generation  ")
+            print("-" * 80)
+            return fitness
+
+        if type == 'mpi_subworlds':
+            # subworlds send the fitness over the bulletin board when each job completes
+            results = runSubworldJobs(pc, residentJobs, netParamsSavePath, fitnessFunc, fitnessFuncArgs, ensembleSize=args.get('ensembleSize', 1))
+            for candidate_index, result in zip(residentIndices, results):
+                fitness[candidate_index] = result.get('fitness', defaultFitness)
+            fitness = evalCache.complete(fitness, defaultFitness)
+            print("-" * 80)
+            print("  Completed a generation  ")
+            print("-" * 80)
+            return fitness
+
         if type == 'mpi_bulletin':
             # wait for pc bulletin board jobs to finish
             try:
@@ -265,9 +325,8 @@ def evolOptim(self, pc):
             except:
                 pass
 
-        num_iters = 0
+        waitStart = time()
         jobs_completed = 0
-        fitness = [None for cand in candidates]
         # print outfilestem
         print("Waiting for jobs from generation %d/%d ..." %(ngen, args.get('max_generations')))
         # print "PID's: %r" %(pids)
@@ -277,7 +336,12 @@ def evolOptim(self, pc):
             for candidate_index in unfinished:
                 try: # load simData and evaluate fitness
                     jobNamePath = genFolderPath + "/gen_" + str(ngen) + "_cand_" + str(candidate_index)
-                    if os.path.isfile(jobNamePath+'.json'):
+                    if os.path.isfile(jobNamePath+'_result.pkl'):  # saved atomically at the end of the job
+                        simData = loadResult(jobNamePath+'_result.pkl')
+                        fitness[candidate_index] = fitnessFunc(simData, **fitnessFuncArgs)
+                        jobs_completed += 1
+                        print('  Candidate %d fitness = %.1f' % (candidate_index, fitness[candidate_index]))
+                    elif os.path.isfile(jobNamePath+'.json'):  # output of jobs without batch result file (eg. hpc jobs run with an older init script)
                         with open('%s.json'% (jobNamePath)) as file:
                             simData = json.load(file)['simData']
                         fitness[candidate_index] = fitnessFunc(simData, **fitnessFuncArgs)
@@ -289,15 +353,21 @@ def evolOptim(self, pc):
                         fitness[candidate_index] = fitnessFunc(simData, **fitnessFuncArgs)
                         jobs_completed += 1
                         print('  Candidate %d fitness = %.1f' % (candidate_index, fitness[candidate_index]))
+                    elif pruneInterval:  # stop job early if its intermediate metrics are not promising
+                        progress = loadProgress(jobNamePath+'_progress.pkl')
+                        if progress and pruneFunc(progress):
+                            pruneJob(jobNamePath+'_stop')
+                            fitness[candidate_index] = defaultFitness
+                            jobs_completed += 1
+                            print('  Candidate %d pruned at t = %.1f ms (fitness = %s)' % (candidate_index, progress['t'], str(defaultFitness)))
                 except Exception as e:
                     # print
                     err = "There was an exception evaluating candidate %d:"%(candidate_index)
                     print(("%s \n %s"%(err,e)))
                     #pass
                     #print 'Error evaluating fitness of candidate %d'%(candidate_index)
-            num_iters += 1
             print('completed: %d' %(jobs_completed))
-            if num_iters >= args.get('maxiter_wait', 5000):
+            if time() - waitStart >= args.get('maxiter_wait', 5000) * args.get('time_sleep', 1):  # max wait time (jobs may notify before time_sleep)
                 print("Max iterations reached, the %d unfinished jobs will be canceled and set to default fitness" % (len(unfinished)))
                 for canditade_index in unfinished:
                     fitness[canditade_index] = defaultFitness
@@ -309,7 +379,14 @@ def evolOptim(self, pc):
                             os.system('scancel %d'%(jobids[candidate_index]))  # terminate unfinished job (resubmitted jobs not terminated!)
                     except:
                         pass
-            sleep(args.get('time_sleep', 1))
+            # wait until a job notifies its completion (or time_sleep)
+            if jobs_completed < total_jobs:
+                waitForResults({i: genFolderPath + '/gen_' + str(ngen) + '_cand_' + str(i) + '_result.pkl' for i, x in enumerate(fitness) if x is None},
+                               resultSocket, args.get('time_sleep', 1))
+
+        # cancel local jobs not completed (eg. max iterations reached)
+        if type == 'mpi_direct':
+            scheduler.cancel()
 
         # kill all processes
         if type=='mpi_bulletin':
@@ -333,6 +410,7 @@ def evolOptim(self, pc):
         #     except:
         #         pass
         # return
+        fitness = evalCache.complete(fitness, defaultFitness)
         print("-"*80)
         print("  Completed a generation  ")
         print("-"*80)
@@ -417,11 +495,37 @@ def evolOptim(self, pc):
     for key, value in self.runCfg.items():
         kwargs[key] = value
 
+    # socket where local jobs notify their completion
+    resultSocket, resultSocketPath = None, None
+    if self.runCfg.get('type', None) not in ['resident', 'mpi_subworlds']:
+        resultSocket, resultSocketPath = createResultSocket()
+
+    # local jobs are queued until there are enough free cores (see batch/scheduler.py)
+    scheduler = None
+    if self.runCfg.get('type', None) == 'mpi_direct':
+        scheduler = LocalScheduler(totalCores=self.runCfg.get('totalCores', None),
+                                   ledgerFile=self.saveFolder+'/'+self.batchLabel+'_ledger.jsonl' if self.runCfg.get('ledger', True) else None,
+                                   retries=self.runCfg.get('retries', 0))
+
+    # cache of evaluated candidates (see batch/cache.py); runCfg 'cache' can be the path of a cache file shared by several batches
+    evalCache = EvaluationCache(cacheFile=batchCacheFile(self), netParamsFile=self.saveFolder+'/'+self.batchLabel+'_netParams.py',
+                                tolerance=self.runCfg.get('cacheTolerance', None), scriptFile=self.runCfg.get('script', 'init.py'),
+                                fitnessFunc=self.evolCfg.get('fitnessFunc'), fitnessFuncArgs=self.evolCfg.get('fitnessFuncArgs'))
+
+    # if using resident workers, start them (kept for all the evaluations, with the network built)
+    residentPool = None
+    if self.runCfg.get('type', None) == 'resident':
+        residentPool = ResidentPool(self.saveFolder+'/'+self.batchLabel+'_netParams.py', self.runCfg.get('numWorkers'))
+
     # if using pc bulletin board, initialize all workers
     if self.runCfg.get('type', None) == 'mpi_bulletin':
         for iworker in range(int(pc.nhost())):
             pc.runworker()
 
+    # if using MPI subworlds, split ranks in groups of runCfg['ranksPerJob'] that run each job in-process
+    if self.runCfg.get('type', None) == 'mpi_subworlds':
+        initSubworlds(pc, self.runCfg.get('ranksPerJob', 1))
+
     #------------------------------------------------------------------
     # Evolutionary algorithm method
     #-------------------------------------------------------------------
@@ -492,4 +596,7 @@ def evolOptim(self, pc):
     print("-"*80)
     print("   Completed evolutionary algorithm parameter optimization   ")
     print("-"*80)
+    if residentPool: residentPool.close()
+    if self.runCfg.get('type', None) == 'mpi_subworlds': pc.done()  # release the subworld workers
+    closeResultSocket(resultSocket, resultSocketPath)
     sys.exit()
@@ -39,6 +39,10 @@ from neuron import h
 from netpyne import specs
 from .utils import createFolder
 from .utils import bashTemplate
+from .scheduler import LocalScheduler, fileSignature
+from .subworlds import initSubworlds, runSubworldJobs
+from .cache import EvaluationCache, batchCacheFile
+from .store import batchStoreFile, storeParams
 
 pc = h.ParallelContext() # use bulletin board master/slave
 
@@ -169,8 +173,27 @@ def gridSearch(self, pc):
         for iworker in range(int(pc.nhost())):
             pc.runworker()
 
-    processes = []
-    processFiles = []
+    # if using MPI subworlds, split ranks in groups of runCfg['ranksPerJob'] that run each job in-process
+    subworldJobs = []  # (cfg path, job path) of jobs run in subworlds
+    if self.runCfg.get('type', None) == 'mpi_subworlds':
+        initSubworlds(pc, self.runCfg.get('ranksPerJob', 1))
+
+    # cache of completed jobs (see batch/cache.py), to skip jobs with the same cfg as a job already run
+    evalCache = EvaluationCache(cacheFile=batchCacheFile(self), netParamsFile=netParamsSavePath, tolerance=self.runCfg.get('cacheTolerance', None),
+                                scriptFile=self.runCfg.get('script', 'init.py'))
+    cacheKeys = {}  # job name: cache key
+
+    # results store where each job adds a summary of its results (see batch/store.py)
+    storeFile = batchStoreFile(self)
+
+    processes = []  # only used by mpi_bulletin jobs (see runJob)
+
+    # local jobs are queued until there are enough free cores (see batch/scheduler.py)
+    scheduler = None
+    if self.runCfg.get('type', None) == 'mpi_direct':
+        scheduler = LocalScheduler(totalCores=self.runCfg.get('totalCores', None),
+                                   ledgerFile=self.saveFolder+'/'+self.batchLabel+'_ledger.jsonl' if self.runCfg.get('ledger', True) else None,
+                                   retries=self.runCfg.get('retries', 0))
 
     for iCombG, pCombG in zip(indexCombGroups, valueCombGroups):
         for iCombNG, pCombNG in zip(indexCombinations, valueCombinations):
@@ -200,6 +223,7 @@ def gridSearch(self, pc):
             jobName = self.saveFolder+'/'+simLabel
 
             sleepInterval = 1
+            cacheEntry = evalCache.get(self.cfg)
 
             # skip if output file already exists
             if self.runCfg.get('skip', False) and glob.glob(jobName+'.json'):
@@ -208,11 +232,15 @@ def gridSearch(self, pc):
                 print('Skipping job %s since cfg file already exists...' % (jobName))
             elif self.runCfg.get('skipCustom', None) and glob.glob(jobName+self.runCfg['skipCustom']):
                 print('Skipping job %s since %s file already exists...' % (jobName, self.runCfg['skipCustom']))
+            elif cacheEntry:
+                print('Skipping job %s since job %s was completed with the same cfg (see %s)' % (jobName, cacheEntry['job'], evalCache.cacheFile))
             else:
+                cacheKeys[jobName] = evalCache.key(self.cfg)
                 # save simConfig json to saveFolder
                 self.cfg.simLabel = simLabel
                 self.cfg.saveFolder = self.saveFolder
                 cfgSavePath = self.saveFolder+'/'+simLabel+'_cfg.json'
+                self.cfg.resultsStore = {'file': storeFile, 'params': storeParams(labelList, pComb), 'files': {'cfg': cfgSavePath}} if storeFile else None
                 self.cfg.save(cfgSavePath)
 
                 # hpc torque job submission
@@ -318,7 +346,7 @@ wait
                 # eg. usage: python batch.py
                 elif self.runCfg.get('type',None) == 'mpi_direct':
                     jobName = self.saveFolder+'/'+simLabel
-                    print('Running job ',jobName)
+                    print('Submitting job ',jobName)
                     cores = self.runCfg.get('cores', 1)
                     folder = self.runCfg.get('folder', '.')
                     script = self.runCfg.get('script', 'init.py')
@@ -327,9 +355,9 @@ wait
                     command = '%s -n %d nrniv -python -mpi %s simConfig=%s netParams=%s' % (mpiCommand, cores, script, cfgSavePath, netParamsSavePath)
 
                     print(command+'\n')
-                    proc = Popen(command.split(' '), stdout=open(jobName+'.run','w'),  stderr=open(jobName+'.err','w'))
-                    processes.append(proc)
-                    processFiles.append(jobName+'.run')
+                    scheduler.submit(jobName, command.split(' '), cores=cores, outFile=jobName+'.run', errFile=jobName+'.err',
+                                     signature=fileSignature(cfgSavePath))
+                    sleepInterval = 0  # no need to wait since the scheduler does not oversubscribe the machine
 
                 # pc bulletin board job submission (master/slave) via mpi
                 # eg. usage: mpiexec -n 4 nrniv -mpi batch.py
@@ -339,9 +367,15 @@ wait
                     # master/slave bulletin board schedulling of jobs
                     pc.submit(runJob, self.runCfg.get('script', 'init.py'), cfgSavePath, netParamsSavePath, processes)
 
+                # MPI subworlds: each group of ranks runs the simulations in-process (submitted after all cfgs are saved)
+                # eg. usage: mpiexec -n 64 nrniv -python -mpi batch.py (with runCfg ranksPerJob=4 runs 16 jobs at a time)
+                elif self.runCfg.get('type',None) == 'mpi_subworlds':
+                    subworldJobs.append((cfgSavePath, jobName))
+                    sleepInterval = 0
+
                 else:
                     print(self.runCfg)
-                    print("Error: invalid runCfg 'type' selected; valid types are 'mpi_bulletin', 'mpi_direct', 'hpc_slurm', 'hpc_torque'")
+                    print("Error: invalid runCfg 'type' selected; valid types are 'mpi_bulletin', 'mpi_direct', 'mpi_subworlds', 'hpc_slurm', 'hpc_torque'")
                     import sys
                     sys.exit(0)
 
@@ -349,25 +383,25 @@ wait
     print("-"*80)
     print("   Finished submitting jobs for grid parameter exploration   ")
     print("-" * 80)
+    if subworldJobs:
+        results = runSubworldJobs(pc, subworldJobs, netParamsSavePath, include=self.runCfg.get('resultInclude', None),
+                                  ensembleSize=self.runCfg.get('ensembleSize', 1))
+        for result in results:
+            if 'error' not in result:
+                evalCache.add(cacheKeys[result['jobPath']], job=os.path.basename(result['jobPath']))
+        if self.runCfg.get('resultInclude', None):
+            import pickle
+            with open(self.saveFolder+'/'+self.batchLabel+'_results.pkl', 'wb') as fileObj:
+                pickle.dump({os.path.basename(result['jobPath']): result for result in results}, fileObj)
+    if self.runCfg.get('type',None) == 'mpi_subworlds':
+        pc.done()  # release the subworld workers (also if all jobs were skipped)
+
     while pc.working():
         sleep(sleepInterval)
-    
-    outfiles = []
-    for procFile in processFiles:
-        outfiles.append(open(procFile, 'r'))
-        
-    while any([proc.poll() is None for proc in processes]):
-        for i, proc in enumerate(processes):
-                newline = outfiles[i].readline()
-                if len(newline) > 1:
-                    print(newline, end='')
-                
-        sleep(sleepInterval)
-    
-    # attempt to terminate completed processes
-    
-    for proc in processes:
-        try:
-            proc.terminate()
-        except:
-            pass
\ No newline at end of file
+
+    if scheduler:
+        scheduler.wait()
+        print('  Jobs status: %s' % (scheduler.status()))
+        for jobName, job in scheduler.jobs.items():
+            if job['status'] == 'done':
+                evalCache.add(cacheKeys[jobName], job=os.path.basename(jobName))
@@ -44,6 +44,11 @@ from netpyne import sim, specs
 import optuna
 from .utils import createFolder
 from .utils import bashTemplate
+from .utils import createResultSocket, closeResultSocket, waitForResults, loadResult, loadProgress, pruneJob
+from .resident import ResidentPool
+from .scheduler import LocalScheduler, fileSignature
+from .cache import EvaluationCache, batchCacheFile
+from .store import batchStoreFile, storeParams
 from .utils import dcp, sigfig
 
 pc = h.ParallelContext() # use bulletin board master/slave
@@ -156,6 +161,12 @@ def optunaOptim(self, pc):
         fitnessFuncArgs = args.get('fitnessFuncArgs')
         maxFitness = args.get('maxFitness')
 
+        # early termination of jobs from their intermediate metrics (see sim.saveBatchProgress): pruneMetric values are
+        # reported to the study pruner, pruneFunc is a user threshold
+        pruneMetric = args.get('pruneMetric')
+        pruneFunc = args.get('pruneFunc')
+        pruneInterval = args.get('pruneInterval') if (pruneMetric or pruneFunc) else None
+
         # read params or set defaults
         sleepInterval = args.get('sleepInterval', 0.2)
 
@@ -171,11 +182,12 @@ def optunaOptim(self, pc):
         # remember pids and jobids in a list
         pids = []
         jobids = {}
+        residentJobs = []  # (cfg path, job path) of jobs run in resident workers
 
         # create a job for the candidate
         candidate_index = 0
 
-        sleep(sleepInterval)  # required for slurm
+        if type != 'resident': sleep(sleepInterval)  # required for slurm
 
         # name and path
         jobName = "trial_" + str(ngen)
@@ -196,12 +208,34 @@ def optunaOptim(self, pc):
         self.cfg.simLabel = jobName
         self.cfg.saveFolder = genFolderPath
 
+        # summary of results added by the job to the batch results store (see batch/store.py)
+        storeFile = batchStoreFile(self)
+        self.cfg.resultsStore = {'file': storeFile, 'params': storeParams(paramLabels, candidate), 'files': {'cfg': jobPath + '_cfg.json'}} if storeFile else None
+
+        # skip trials already evaluated (in this or previous runs)
+        evalCache.newGeneration()
+        if not evalCache.check(candidate_index, self.cfg, jobName):
+            return evalCache.initialFitness(1)[0]
+
+        # file where the job saves the data needed to compute its fitness (see sim.saveBatchResult)
+        self.cfg.batchResult = {'file': jobPath + '_result.pkl', 'include': args.get('fitnessFuncInputs'), 'socket': resultSocketPath} if type != 'resident' else None
+        if self.cfg.batchResult and pruneInterval:
+            self.cfg.batchResult.update({'progressInterval': pruneInterval, 'progressFile': jobPath + '_progress.pkl', 'stopFile': jobPath + '_stop'})
+            for fileName in [jobPath + '_progress.pkl', jobPath + '_stop']:
+                if os.path.exists(fileName): os.remove(fileName)
+
         # save cfg instance to file
         cfgSavePath = jobPath + '_cfg.json'
         self.cfg.save(cfgSavePath)
 
 
-        if type=='mpi_bulletin':
+        if type=='resident':
+            # ----------------------------------------------------------------------
+            # run in local workers that keep the network built (see batch/resident.py)
+            # ----------------------------------------------------------------------
+            residentJobs.append((cfgSavePath, jobPath))
+
+        elif type=='mpi_bulletin':
             # ----------------------------------------------------------------------
             # MPI master-slaves
             # ----------------------------------------------------------------------
@@ -253,20 +287,13 @@ def optunaOptim(self, pc):
                 text_file.write("%s" % jobString)
 
             if type == 'mpi_direct':
-                with open(jobPath+'.run', 'a+') as outf, open(jobPath+'.err', 'w') as errf:
-                    pids.append(Popen([executer, batchfile], stdout=outf, stderr=errf, preexec_fn=os.setsid).pid)
+                # local jobs are queued until there are enough free cores (see batch/scheduler.py)
+                scheduler.submit(jobName, [executer, batchfile], cores=numproc, outFile=jobPath+'.run', errFile=jobPath+'.err',
+                                 doneFile=jobPath+'_result.pkl', signature=fileSignature(cfgSavePath))
             else:
                 with open(jobPath+'.jobid', 'w') as outf, open(jobPath+'.err', 'w') as errf:
                     pids.append(Popen([executer, batchfile], stdout=outf, stderr=errf, preexec_fn=os.setsid).pid)
-
-            #proc = Popen(command.split([executer, batchfile]), stdout=PIPE, stderr=PIPE)
-            sleep(0.1)
-            #read = proc.stdout.read()
-
-            if type == 'mpi_direct':
-                with open('./pids.pid', 'a') as file:
-                    file.write(str(pids))
-            else:
+                sleep(0.1)
                 with open(jobPath+'.jobid', 'r') as outf:
                     read=outf.readline()
                 print(read)
@@ -275,12 +302,20 @@ def optunaOptim(self, pc):
                     jobids[candidate_index] = jobid
                 print('jobids', jobids)
         total_jobs += 1
-        sleep(0.1)
+        if type != 'resident': sleep(0.1)
 
 
         # ----------------------------------------------------------------------
         # gather data and compute fitness
         # ----------------------------------------------------------------------
+        if type == 'resident':
+            # workers send the fitness when each job completes (no polling of output files)
+            fitness = evalCache.complete(residentPool.run(residentJobs, fitnessFunc, fitnessFuncArgs, maxFitness), maxFitness)
+            print("-" * 80)
+            print("  Completed a generation  ")
+            print("-" * 80)
+            return fitness[0]
+
         if type == 'mpi_bulletin':
             # wait for pc bulletin board jobs to finish
             try:
@@ -290,9 +325,10 @@ def optunaOptim(self, pc):
             except:
                 pass
 
-        num_iters = 0
+        waitStart = time()
         jobs_completed = 0
         fitness = [None]  # just 1 candidate
+        lastProgressTime = 0
         # print outfilestem
         print("Waiting for jobs from generation %d/%d ..." %(ngen, args.get('maxiters')))
         # print "PID's: %r" %(pids)
@@ -302,7 +338,12 @@ def optunaOptim(self, pc):
             for candidate_index in unfinished:
                 try: # load simData and evaluate fitness
                     jobNamePath = genFolderPath + "/trial_" + str(ngen)
-                    if os.path.isfile(jobNamePath+'.json'):
+                    if os.path.isfile(jobNamePath+'_result.pkl'):  # saved atomically at the end of the job
+                        simData = loadResult(jobNamePath+'_result.pkl')
+                        fitness[candidate_index] = fitnessFunc(simData, **fitnessFuncArgs)
+                        jobs_completed += 1
+                        print('  Candidate %d fitness = %.1f' % (candidate_index, fitness[candidate_index]))
+                    elif os.path.isfile(jobNamePath+'.json'):  # output of jobs without batch result file (eg. hpc jobs run with an older init script)
                         with open('%s.json'% (jobNamePath)) as file:
                             simData = json.load(file)['simData']
                         fitness[candidate_index] = fitnessFunc(simData, **fitnessFuncArgs)
@@ -314,12 +355,23 @@ def optunaOptim(self, pc):
                         fitness[candidate_index] = fitnessFunc(simData, **fitnessFuncArgs)
                         jobs_completed += 1
                         print('  Candidate %d fitness = %.1f' % (candidate_index, fitness[candidate_index]))
+                    elif pruneInterval:  # stop job early if its intermediate metrics are not promising
+                        progress = loadProgress(jobNamePath+'_progress.pkl')
+                        if progress and progress['t'] > lastProgressTime:
+                            lastProgressTime = progress['t']
+                            if pruneMetric:
+                                trial.report(pruneMetric(progress), step=int(progress['t']))
+                            if (pruneMetric and trial.should_prune()) or (pruneFunc and pruneFunc(progress)):
+                                pruneJob(jobNamePath+'_stop')
+                                print('  Candidate %d pruned at t = %.1f ms' % (candidate_index, progress['t']))
+                                raise optuna.TrialPruned()
+                except optuna.TrialPruned:
+                    raise
                 except Exception as e:
                     err = "There was an exception evaluating candidate %d:"%(candidate_index)
                     print(("%s \n %s"%(err,e)))
-            num_iters += 1
             print('completed: %d' %(jobs_completed))
-            if num_iters >= args.get('maxiter_wait', 5000):
+            if time() - waitStart >= args.get('maxiter_wait', 5000) * args.get('time_sleep', 1):  # max wait time (jobs may notify before time_sleep)
                 print("Max iterations reached, the %d unfinished jobs will be canceled and set to default fitness" % (len(unfinished)))
                 for canditade_index in unfinished:
                     fitness[canditade_index] = maxFitness # rerun those that didn't complete;
@@ -331,7 +383,14 @@ def optunaOptim(self, pc):
                             os.system('scancel %d' % (jobids[candidate_index]))  # terminate unfinished job (resubmitted jobs not terminated!)
                     except:
                         pass
-            sleep(args.get('time_sleep', 1))
+            # wait until a job notifies its completion (or time_sleep)
+            if jobs_completed < total_jobs:
+                waitForResults({i: genFolderPath + '/trial_' + str(ngen) + '_result.pkl' for i, x in enumerate(fitness) if x is None},
+                               resultSocket, args.get('time_sleep', 1))
+
+        # cancel local jobs not completed (eg. max iterations reached)
+        if type == 'mpi_direct':
+            scheduler.cancel()
 
         # kill all processes
         if type == 'mpi_bulletin':
@@ -349,22 +408,9 @@ def optunaOptim(self, pc):
             except:
                 pass
 
-        elif type == 'mpi_direct':
-
-            import psutil
-
-            PROCNAME = "nrniv"
-
-            for proc in psutil.process_iter():
-                # check whether the process name matches
-                try:
-                    if proc.name() == PROCNAME:
-                        proc.kill()
-                except:
-                    pass
-
         # don't want to to this for hpcs since jobs are running on compute nodes not master
 
+        fitness = evalCache.complete(fitness, maxFitness)
         print("-" * 80)
         print("  Completed a generation  ")
         print("-" * 80)
@@ -420,6 +466,28 @@ def optunaOptim(self, pc):
         args[key] = value
 
 
+    # socket where local jobs notify their completion
+    resultSocket, resultSocketPath = None, None
+    if self.runCfg.get('type', None) != 'resident':
+        resultSocket, resultSocketPath = createResultSocket()
+
+    # local jobs are queued until there are enough free cores (see batch/scheduler.py)
+    scheduler = None
+    if self.runCfg.get('type', None) == 'mpi_direct':
+        scheduler = LocalScheduler(totalCores=self.runCfg.get('totalCores', None),
+                                   ledgerFile=self.saveFolder+'/'+self.batchLabel+'_ledger.jsonl' if self.runCfg.get('ledger', True) else None,
+                                   retries=self.runCfg.get('retries', 0))
+
+    # cache of evaluated trials (see batch/cache.py); runCfg 'cache' can be the path of a cache file shared by several batches
+    evalCache = EvaluationCache(cacheFile=batchCacheFile(self), netParamsFile=self.saveFolder+'/'+self.batchLabel+'_netParams.py',
+                                tolerance=self.runCfg.get('cacheTolerance', None), scriptFile=self.runCfg.get('script', 'init.py'),
+                                fitnessFunc=self.optimCfg.get('fitnessFunc'), fitnessFuncArgs=self.optimCfg.get('fitnessFuncArgs'))
+
+    # if using resident workers, start them (kept for all the evaluations, with the network built)
+    residentPool = None
+    if self.runCfg.get('type', None) == 'resident':
+        residentPool = ResidentPool(self.saveFolder+'/'+self.batchLabel+'_netParams.py', self.runCfg.get('numWorkers', 1))
+
     # if using pc bulletin board, initialize all workers
     if self.runCfg.get('type', None) == 'mpi_bulletin':
         for iworker in range(int(pc.nhost())):
@@ -431,7 +499,7 @@ def optunaOptim(self, pc):
 
     sleep(rank) # each process wiats a different time to avoid saturating sqlite database
     study = optuna.create_study(study_name=self.batchLabel, storage='sqlite:///%s/%s_storage.db' % (self.saveFolder, self.batchLabel),
-                                load_if_exists=True, direction=args['direction'])
+                                load_if_exists=True, direction=args['direction'], pruner=args.get('pruner'))
     try:
         study.optimize(lambda trial: objective(trial, args), n_trials=args['maxiters'], timeout=args['maxtime'])
     except Exception as e:
@@ -460,4 +528,6 @@ def optunaOptim(self, pc):
         print("-" * 80)
 
 
+    if residentPool: residentPool.close()
+    closeResultSocket(resultSocket, resultSocketPath)
     sys.exit()
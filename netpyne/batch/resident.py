@@ -0,0 +1,245 @@
+"""
+Module for running batch jobs in resident local workers that keep the network built between jobs
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+import os
+import sys
+import pickle
+import traceback
+import contextlib
+import multiprocessing
+
+# cfg options that can change between jobs without rebuilding the network (only affect running, recording and saving;
+# not duration, used to create the inputs, or saveCellSecs/saveCellConns, which remove the cell secs/conns when gathering)
+RESIDENT_CFG_KEYS = ['tstop', 'dt', 'hParams', 'cache_efficient', 'cvode_active', 'cvode_atol', 'rand123GlobalIndex',
+                     'gatherOnlySimData', 'timing', 'saveTiming', 'printRunTime', 'printPopAvgRates',
+                     'verbose', 'recordCells', 'recordTraces', 'processTracesInterval', 'recordCellsSpikes', 'recordStim',
+                     'flushSpikesInterval', 'spikesRingBufferSize', 'recordWeights', 'recordWeightsStep', 'recordWeightsBufferSize',
+                     'recordStep', 'recordTime', 'simLabel', 'saveFolder', 'filename', 'saveDataInclude', 'timestampFilename',
+                     'savePickle', 'saveJson', 'saveMat', 'saveCSV', 'saveDpk', 'saveHDF5', 'saveDat', 'backupCfgFile',
+                     'batchResult', 'resultsStore', 'checkErrors', 'checkErrorsVerbose', 'analysis']
+
+
+# -------------------------------------------------------------------------------
+# Pool of resident workers
+# -------------------------------------------------------------------------------
+class ResidentPool(object):
+    """
+    Pool of long-lived local worker processes (forked from the batch process, so NEURON, NetPyNE and the mod files
+    are only loaded once) that run batch jobs. Each worker keeps its network built between jobs: for each job it
+    loads the cfg, re-runs the netParams file and, if the network structure did not change (same netParams and only
+    cfg options in RESIDENT_CFG_KEYS changed) and the previous job kept the cell secs and conns (cfg.saveCellSecs and
+    cfg.saveCellConns), resets the recording and runs the existing network again; otherwise it rebuilds the network. Workers return the fitness computed from the gathered simData, instead of the full data.
+
+    Parameters
+    ----------
+    netParamsFile : str
+        Path to the netParams .py file (imports cfg from __main__ or from a cfg module, as in the job scripts)
+        **Default:** *required*
+
+    numWorkers : int
+        Number of worker processes
+        **Default:** ``None`` uses the number of CPUs
+
+
+    """
+
+    def __init__(self, netParamsFile, numWorkers=None):
+        self.netParamsFile = netParamsFile
+        self.numWorkers = int(numWorkers or multiprocessing.cpu_count() or 1)
+        # workers are forked (default start method in Linux in Python 2, which has no get_context)
+        self.context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        self.workers = [self._startWorker() for i in range(self.numWorkers)]
+
+
+    def _startWorker(self):
+        conn, workerConn = self.context.Pipe()
+        process = self.context.Process(target=residentWorker, args=(workerConn, self.netParamsFile))
+        process.daemon = True
+        process.start()
+        workerConn.close()
+        return {'process': process, 'conn': conn}
+
+
+    def run(self, jobs, fitnessFunc, fitnessFuncArgs=None, defaultFitness=None):
+        """
+        Runs the jobs (list of (cfgSavePath, jobPath) tuples) in the workers and returns the list of fitness values,
+        in the same order as the jobs. Waits for completion events of the workers (no polling of output files);
+        jobs that fail, or whose worker dies, get defaultFitness.
+        """
+
+        fitnessFuncArgs = fitnessFuncArgs or {}
+        fitness = [None for job in jobs]
+        pending = list(range(len(jobs)))[::-1]
+        running = {}  # worker index: job index
+
+        while pending or running:
+            for iworker, worker in enumerate(self.workers):
+                if pending and iworker not in running:
+                    ijob = pending.pop()
+                    cfgSavePath, jobPath = jobs[ijob]
+                    worker['conn'].send({'cfgSavePath': cfgSavePath, 'jobPath': jobPath,
+                                         'fitnessFunc': fitnessFunc, 'fitnessFuncArgs': fitnessFuncArgs})
+                    running[iworker] = ijob
+
+            readyConns = _waitConns([self.workers[iworker]['conn'] for iworker in running])
+            for iworker in [i for i in running if self.workers[i]['conn'] in readyConns]:
+                ijob = running.pop(iworker)
+                try:
+                    result = self.workers[iworker]['conn'].recv()
+                except (EOFError, OSError):
+                    result = {'error': 'worker process terminated'}
+                    self.workers[iworker] = self._startWorker()
+                if 'error' in result:
+                    print('  Job %s failed (%s); set to default fitness' % (jobs[ijob][1], result['error']))
+                    fitness[ijob] = defaultFitness
+                else:
+                    fitness[ijob] = result['fitness']
+                    print('  Job %s fitness = %s' % (jobs[ijob][1], str(fitness[ijob])))
+
+        return fitness
+
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker['conn'].send(None)
+            except (EOFError, OSError):
+                pass
+        for worker in self.workers:
+            worker['process'].join(5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        self.workers = []
+
+
+def _waitConns(conns):
+    # wait until at least one of the connections has data (or was closed by its worker)
+    try:
+        from multiprocessing.connection import wait
+    except ImportError:  # Python 2
+        from time import sleep
+        while True:
+            ready = [conn for conn in conns if conn.poll()]
+            if ready:
+                return ready
+            sleep(0.01)
+    return wait(conns)
+
+
+# -------------------------------------------------------------------------------
+# Resident worker main loop
+# -------------------------------------------------------------------------------
+def residentWorker(conn, netParamsFile):
+    """
+    Main loop of a resident worker: receives jobs from the pool connection until it gets None or the connection
+    is closed, and sends back a dict with the 'fitness' or the 'error' of each job. The output of each job is
+    written to <jobPath>.run, as for jobs run in a separate process.
+    """
+
+    resident = {}
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        with redirectOutput(job['jobPath'] + '.run'):
+            try:
+                simData = runResidentJob(job, netParamsFile, resident)
+                result = {'fitness': job['fitnessFunc'](simData, **job['fitnessFuncArgs'])}
+            except Exception as e:
+                traceback.print_exc(file=sys.stdout)
+                result = {'error': str(e)}
+                resident.pop('structure', None)  # rebuild network in next job
+        conn.send(result)
+
+
+@contextlib.contextmanager
+def redirectOutput(fileName):
+    """
+    Context manager that redirects both python and NEURON output (file descriptor 1) to fileName
+    """
+
+    sys.stdout.flush()
+    stdout = os.dup(1)
+    try:
+        with open(fileName, 'w') as outf:
+            os.dup2(outf.fileno(), 1)
+            try:
+                yield
+            finally:
+                sys.stdout.flush()
+                os.dup2(stdout, 1)
+    finally:
+        os.close(stdout)
+
+
+def loadNetParams(netParamsFile, cfg):
+    """
+    Runs the netParams .py file with the given cfg (netParams files import cfg from __main__) and returns its netParams
+    """
+
+    import __main__
+
+    __main__.cfg = cfg
+    moduleName = os.path.basename(netParamsFile).split('.')[0]
+    try:
+        import importlib.machinery, types
+        loader = importlib.machinery.SourceFileLoader(moduleName, netParamsFile)
+        netParamsModule = types.ModuleType(loader.name)
+        loader.exec_module(netParamsModule)
+    except ImportError:  # Python 2
+        import imp
+        netParamsModule = imp.load_source(moduleName, netParamsFile)
+    return netParamsModule.netParams
+
+
+def runResidentJob(job, netParamsFile, resident):
+    """
+    Runs a single job in a resident worker, reusing the network already built in the worker (stored in the
+    resident dict) if the structure did not change, and returns the gathered simData (None in nodes other than 0).
+    """
+
+    from netpyne import sim
+    from netpyne.specs import Dict
+
+    cfg = sim.loadSimCfg(job['cfgSavePath'], setLoaded=False)
+    netParams = loadNetParams(netParamsFile, cfg)
+
+    try:  # copy (via pickle, since specs Dicts can not be deep copied) so the network creation does not modify it
+        structure = pickle.loads(pickle.dumps((netParams.todict(), {k: v for k, v in cfg.__dict__.items() if k not in RESIDENT_CFG_KEYS})))
+        reuse = 'structure' in resident and resident['structure'] == structure
+    except Exception:  # eg. params with functions that can not be pickled or compared
+        structure = None
+        reuse = False
+
+    if reuse:
+        print('\nReusing resident network (only run, recording or saving options changed)...')
+        sim.setSimCfg(cfg)
+        sim.simData = Dict()
+        sim.fih = []
+        sim.setupRecording()
+        sim.simulate()
+    else:
+        if resident.pop('built', False):
+            sim.clearAll()
+        resident.pop('structure', None)
+        resident['built'] = True
+        sim.createSimulate(netParams, cfg)
+        if structure is not None and cfg.saveCellSecs and cfg.saveCellConns:  # otherwise secs/conns removed when gathering
+            resident['structure'] = structure
+
+    sim.saveData()  # only saves in the formats selected in cfg (eg. cfg.saveJson)
+    return sim.allSimData if sim.rank == 0 else None
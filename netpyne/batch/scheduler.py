@@ -0,0 +1,232 @@
+"""
+Module with a bounded scheduler of local batch jobs
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+import os
+import json
+import multiprocessing
+import signal
+import hashlib
+import threading
+from time import sleep, time
+from collections import OrderedDict
+from subprocess import Popen
+
+
+# -------------------------------------------------------------------------------
+# function to get signature of job input file (eg. cfg), used to resume jobs from ledger
+# -------------------------------------------------------------------------------
+def fileSignature(filename):
+    """
+    Returns the md5 hash of the file contents
+    """
+
+    with open(filename, 'rb') as fileObj:
+        return hashlib.md5(fileObj.read()).hexdigest()
+
+
+# -------------------------------------------------------------------------------
+# Local job scheduler
+# -------------------------------------------------------------------------------
+class LocalScheduler(object):
+    """
+    Scheduler of batch jobs run in the local machine. Jobs are queued and launched (from a background thread) as soon
+    as there are enough free cores for them, so the machine is kept full without oversubscribing it (jobs that need
+    more cores than available run alone). Jobs that fail (missing doneFile or non-zero exit code) are retried up to
+    `retries` times. The final status of each job is appended to a ledger file (JSON lines), so a batch run again
+    skips the jobs already completed with the same signature (eg. hash of the cfg file).
+
+    Parameters
+    ----------
+    totalCores : int
+        Number of cores available for jobs
+        **Default:** ``None`` uses the number of CPUs
+
+    ledgerFile : str
+        Path of the job ledger file
+        **Default:** ``None`` does not use a ledger
+
+    retries : int
+        Max number of times a failed job is run again
+        **Default:** ``0``
+
+    pollInterval : float
+        Interval (s) to check running jobs
+        **Default:** ``0.1``
+
+
+    """
+
+    def __init__(self, totalCores=None, ledgerFile=None, retries=0, pollInterval=0.1):
+        self.totalCores = int(totalCores or multiprocessing.cpu_count() or 1)
+        self.ledgerFile = ledgerFile
+        self.retries = int(retries)
+        self.pollInterval = pollInterval
+        self.jobs = OrderedDict()  # jobName: job dict
+        self.queue = []
+        self.running = []
+        self.usedCores = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+        self.ledger = {}  # jobName: last ledger entry
+        if ledgerFile and os.path.exists(ledgerFile):
+            with open(ledgerFile, 'r') as fileObj:
+                for line in fileObj:
+                    try:
+                        entry = json.loads(line)
+                        self.ledger[entry['job']] = entry
+                    except ValueError:  # line partially written when batch was interrupted
+                        pass
+
+
+    def submit(self, jobName, command, cores=1, outFile=None, errFile=None, doneFile=None, signature=None):
+        """
+        Queues a job (command as list of args). The job is considered successful if doneFile exists (if given; a doneFile
+        from a previous run is removed before running the job) or otherwise if it exits with code 0. If signature is
+        given and the ledger has the job completed with the same signature (and doneFile exists), the job is skipped.
+        Returns False if the job was skipped.
+        """
+
+        entry = self.ledger.get(jobName)
+        if (signature is not None and entry and entry.get('status') == 'done' and entry.get('signature') == signature
+                and (doneFile is None or os.path.exists(doneFile))):
+            print('Skipping job %s since it was completed in a previous run (see %s)' % (jobName, self.ledgerFile))
+            return False
+
+        if doneFile and os.path.exists(doneFile):
+            os.remove(doneFile)
+
+        job = {'name': jobName, 'command': command, 'cores': int(cores), 'outFile': outFile, 'errFile': errFile,
+               'doneFile': doneFile, 'signature': signature, 'attempts': 0, 'status': 'queued', 'proc': None}
+        with self.lock:
+            self.jobs[jobName] = job
+            self.queue.append(job)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+        return True
+
+
+    def _run(self):
+        while True:
+            with self.lock:
+                for job in [job for job in self.running if job['proc'].poll() is not None]:
+                    self._finish(job)
+                for job in list(self.queue):
+                    if job['cores'] <= self.totalCores - self.usedCores or not self.running:
+                        self._launch(job)
+                if not self.queue and not self.running:
+                    self.thread = None
+                    return
+            sleep(self.pollInterval)
+
+
+    def _launch(self, job):
+        self.queue.remove(job)
+        job['attempts'] += 1
+        job['status'] = 'running'
+        outf = open(job['outFile'], 'a+' if job['attempts'] > 1 else 'w') if job['outFile'] else None
+        errf = open(job['errFile'], 'a+' if job['attempts'] > 1 else 'w') if job['errFile'] else None
+        job['proc'] = Popen(job['command'], stdout=outf, stderr=errf, preexec_fn=os.setsid)
+        for fileObj in [outf, errf]:
+            if fileObj: fileObj.close()
+        self.running.append(job)
+        self.usedCores += job['cores']
+        print('Running job %s (%d cores; %d/%d cores used; %d jobs queued)' % (job['name'], job['cores'], self.usedCores, self.totalCores, len(self.queue)))
+
+
+    def _finish(self, job):
+        self.running.remove(job)
+        self.usedCores -= job['cores']
+        returncode = job['proc'].returncode
+        if (os.path.exists(job['doneFile']) if job['doneFile'] else returncode == 0):
+            job['status'] = 'done'
+        elif job['attempts'] <= self.retries:
+            print('Job %s failed (exit code %s); retrying (attempt %d of %d)' % (job['name'], returncode, job['attempts']+1, self.retries+1))
+            job['status'] = 'queued'
+            self.queue.insert(0, job)
+            return
+        else:
+            job['status'] = 'failed'
+            print('Job %s failed (exit code %s)' % (job['name'], returncode))
+        self._writeLedger(job, returncode)
+
+
+    def _writeLedger(self, job, returncode=None):
+        entry = {'job': job['name'], 'status': job['status'], 'returncode': returncode, 'attempts': job['attempts'],
+                 'signature': job['signature'], 'time': time()}
+        self.ledger[job['name']] = entry
+        if self.ledgerFile:
+            with open(self.ledgerFile, 'a') as fileObj:
+                fileObj.write(json.dumps(entry) + '\n')
+
+
+    def wait(self):
+        """
+        Waits until all the submitted jobs have finished
+        """
+
+        thread = self.thread
+        while thread is not None:
+            thread.join()
+            thread = self.thread
+
+
+    def cancel(self, killTimeout=5):
+        """
+        Removes queued jobs and terminates running jobs (eg. jobs not completed when optimization stops waiting);
+        running jobs that already saved their doneFile are left to finish. Terminated jobs are waited for (and killed if
+        they do not exit within killTimeout seconds), so they do not remain as zombie processes
+        """
+
+        terminated = []
+        with self.lock:
+            for job in self.queue:
+                job['status'] = 'canceled'
+            self.queue = []
+            for job in list(self.running):
+                if job['doneFile'] and os.path.exists(job['doneFile']):
+                    continue
+                try:
+                    os.killpg(os.getpgid(job['proc'].pid), signal.SIGTERM)
+                except OSError:
+                    pass
+                self.running.remove(job)
+                self.usedCores -= job['cores']
+                job['status'] = 'canceled'
+                self._writeLedger(job)
+                terminated.append(job['proc'])
+
+        for proc in terminated:
+            waitStart = time()
+            while proc.poll() is None and time() - waitStart < killTimeout:
+                sleep(self.pollInterval)
+            if proc.poll() is None:
+                try:
+                    os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
+                except OSError:
+                    pass
+                proc.wait()
+
+
+    def status(self):
+        """
+        Returns dict with the number of jobs in each status
+        """
+
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
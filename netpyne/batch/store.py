@@ -0,0 +1,132 @@
+"""
+Module with a results store (SQLite database) where batch jobs save a summary of their results
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+import json
+import numbers
+import sqlite3
+from time import time
+
+# prefix of the columns of each type of value
+COLUMN_PREFIXES = {'params': 'param.', 'metrics': 'metric.', 'files': 'file.'}
+
+
+def _columnValue(value):
+    # numbers are stored as they are (untyped columns, so ints are not converted to floats); anything else as JSON text
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+# -------------------------------------------------------------------------------
+# Add job result to store
+# -------------------------------------------------------------------------------
+def addResult(storeFile, simLabel, params=None, metrics=None, files=None, timeout=60):
+    """
+    Adds (or replaces) the row of a job to the results store: one column for each param ('param.<label>'), scalar
+    metric ('metric.<name>') and output file ('file.<format>', path of the file with the bulk data). Columns are added
+    as new params or metrics appear. The database is locked during the write, so many jobs can add their results
+    concurrently (waiting up to timeout seconds).
+    """
+
+    row = {'simLabel': simLabel, 'time': time()}
+    for key, values in [('params', params), ('metrics', metrics), ('files', files)]:
+        for label, value in (values or {}).items():
+            row[COLUMN_PREFIXES[key] + paramLabel(label)] = _columnValue(value)
+
+    conn = sqlite3.connect(storeFile, timeout=timeout, isolation_level=None)
+    inTransaction = False  # (Connection.in_transaction is not available in Python 2)
+    try:
+        conn.execute('BEGIN IMMEDIATE')  # lock the database until commit
+        inTransaction = True
+        conn.execute('CREATE TABLE IF NOT EXISTS results (simLabel TEXT PRIMARY KEY, time REAL)')
+        columns = [info[1] for info in conn.execute('PRAGMA table_info(results)')]
+        for column, value in row.items():
+            if column not in columns:  # no type affinity, so values keep their type (eg. int params)
+                conn.execute('ALTER TABLE results ADD COLUMN "%s"' % (column.replace('"', '""')))
+        conn.execute('INSERT OR REPLACE INTO results (%s) VALUES (%s)' % (', '.join(['"%s"' % (column.replace('"', '""')) for column in row]),
+                                                                           ', '.join(['?'] * len(row))), list(row.values()))
+        conn.execute('COMMIT')
+        inTransaction = False
+    except Exception:
+        if inTransaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+# -------------------------------------------------------------------------------
+# Load results from store
+# -------------------------------------------------------------------------------
+def loadResults(storeFile, indexByParams=True):
+    """
+    Loads the results store of a batch as a pandas DataFrame with one row per job, indexed by the param values
+    (MultiIndex with a level per param, if indexByParams) and with a column per metric and output file (plus 'simLabel'
+    and 'time'). Only the summary saved by the jobs is read, so it is fast even for very large batches.
+    """
+
+    import pandas as pd
+
+    conn = sqlite3.connect(storeFile)
+    try:
+        df = pd.read_sql_query('SELECT * FROM results ORDER BY simLabel', conn)
+    finally:
+        conn.close()
+
+    params = [column for column in df.columns if column.startswith(COLUMN_PREFIXES['params'])]
+    df = df.rename(columns={column: column.split('.', 1)[1] for column in df.columns if column.startswith(COLUMN_PREFIXES['metrics'])})
+    if indexByParams and params:
+        df = df.set_index(params)
+        df.index.names = [param.split('.', 1)[1] for param in params]
+    return df
+
+
+# -------------------------------------------------------------------------------
+# Label of a batch param in the results store
+# -------------------------------------------------------------------------------
+def paramLabel(label):
+    """
+    Returns the label of a batch param as a string (nested params joined with '.', eg. ('seeds', 'conn') -> 'seeds.conn')
+    """
+
+    return '.'.join([str(x) for x in label]) if isinstance(label, (list, tuple)) else str(label)
+
+
+def storeParams(labels, values):
+    """
+    Returns dict with the values of the batch params of a job, with string labels (so the cfg can be saved as JSON)
+    """
+
+    return {paramLabel(label): value for label, value in zip(labels, values)}
+
+
+# -------------------------------------------------------------------------------
+# Path of the results store of a batch
+# -------------------------------------------------------------------------------
+def batchStoreFile(batch):
+    """
+    Returns the path of the results store set in runCfg 'resultsStore' (True uses <saveFolder>/<batchLabel>_results.db;
+    False, the default, does not use a results store). The database is locked while each job writes its row, so it
+    should be in a local filesystem (SQLite locking is not reliable on NFS, eg. in some HPC clusters).
+    """
+
+    store = batch.runCfg.get('resultsStore', False)
+    if store is True:
+        return batch.saveFolder + '/' + batch.batchLabel + '_results.db'
+    return store or None
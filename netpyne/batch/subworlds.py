@@ -0,0 +1,134 @@
+"""
+Module for running batch jobs in-process in MPI subworlds (groups of ranks of a single MPI allocation)
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from future import standard_library
+standard_library.install_aliases()
+
+import os
+import sys
+import traceback
+
+from neuron import h
+from .resident import runResidentJob, redirectOutput
+
+_resident = {}  # network kept built in each subworld between jobs (see batch/resident.py)
+
+
+# -------------------------------------------------------------------------------
+# Split MPI ranks into subworlds and start the bulletin board workers
+# -------------------------------------------------------------------------------
+def initSubworlds(pc, ranksPerJob=1):
+    """
+    Splits the MPI ranks in subworlds of ranksPerJob ranks (see ParallelContext.subworlds) and starts the bulletin
+    board workers; jobs submitted by the master are run by all the ranks of a subworld, which see only the ranks of
+    their subworld (eg. sim.nhost == ranksPerJob). The master also works on jobs, so the ranks of its subworld are
+    not left idle. Must be called by all ranks; only the master returns.
+    """
+
+    ranksPerJob = int(ranksPerJob)
+    if pc.nhost_world() % ranksPerJob != 0:
+        print('Warning: number of MPI ranks (%d) is not a multiple of runCfg ranksPerJob (%d); the last subworld will have fewer ranks' % (pc.nhost_world(), ranksPerJob))
+    pc.subworlds(ranksPerJob)
+    if pc.id_world() == 0:
+        pc.master_works_on_jobs(1)
+        print('Running jobs in %d subworlds of %d ranks' % (max(1, pc.nhost_world() // ranksPerJob), ranksPerJob))
+    pc.runworker()
+
+
+# -------------------------------------------------------------------------------
+# Job run by all the ranks of a subworld
+# -------------------------------------------------------------------------------
+def runSubworldJob(job, netParamsFile):
+    """
+    Runs a batch job (dict with 'cfgSavePath', 'jobPath' and optionally 'fitnessFunc', 'fitnessFuncArgs' and
+    'include') in-process in all the ranks of the subworld that received it, reusing the network built by the
+    previous job of the subworld if its structure did not change. The output of the job is written to <jobPath>.run.
+    Rank 0 of the subworld returns (over the bulletin board) a dict with the 'jobPath' and either the 'error' or the
+    'fitness' (if fitnessFunc is given) and the 'simData' keys in include (if given); other ranks return None.
+    If the job has an 'ensemble' list of (cfgSavePath, jobPath) tuples, they are run as replicas of a single
+    simulation (see batch/ensemble.py), or one by one if they can not be packed, and a list with the result of each
+    replica is returned.
+    """
+
+    from netpyne import sim
+    from .ensemble import runEnsemble
+
+    jobs = job.get('ensemble') or [(job['cfgSavePath'], job['jobPath'])]
+    fitnessFunc = job.get('fitnessFunc')
+    include = job.get('include')
+    results = [{'jobPath': jobPath} for cfgSavePath, jobPath in jobs]
+    rank = int(h.ParallelContext().id())  # rank within the subworld
+    with redirectOutput(jobs[0][1] + '.run' if rank == 0 else os.devnull):
+        try:
+            if 'ensemble' in job:
+                if _resident.pop('built', False):
+                    sim.clearAll()
+                _resident.pop('structure', None)
+                _resident['built'] = True
+                simDataList = runEnsemble(netParamsFile, [sim.loadSimCfg(cfgSavePath, setLoaded=False) for cfgSavePath, jobPath in jobs])
+                if simDataList is None:  # replicas can not be packed (eg. different cfg.seeds['conn']): run jobs one by one
+                    print('Ensemble replicas could not be packed; running the jobs one by one')
+                    _resident.pop('built', None)  # network already cleared
+                    simDataList = [runResidentJob({'cfgSavePath': cfgSavePath, 'jobPath': jobPath}, netParamsFile, _resident)
+                                   for cfgSavePath, jobPath in jobs]
+            else:
+                simDataList = [runResidentJob(job, netParamsFile, _resident)]
+            for result, simData in zip(results, simDataList or []):
+                if simData is not None:
+                    if fitnessFunc:
+                        result['fitness'] = fitnessFunc(simData, **(job.get('fitnessFuncArgs') or {}))
+                    if include:
+                        result['simData'] = {key: simData[key] for key in include if key in simData}
+        except Exception as e:
+            traceback.print_exc(file=sys.stdout)
+            for result in results:
+                result['error'] = str(e)
+            _resident.pop('structure', None)  # rebuild network in next job
+    if rank != 0:
+        return None
+    return results if 'ensemble' in job else results[0]
+
+
+# -------------------------------------------------------------------------------
+# Submit jobs to subworlds and collect results
+# -------------------------------------------------------------------------------
+def runSubworldJobs(pc, jobs, netParamsFile, fitnessFunc=None, fitnessFuncArgs=None, include=None, ensembleSize=1):
+    """
+    Submits the jobs (list of (cfgSavePath, jobPath) tuples) to the subworlds and returns the list of their results
+    (see runSubworldJob), in the same order as the jobs. Results are collected from the bulletin board as each job
+    completes (no output files are polled). If ensembleSize > 1, each submitted job runs groups of ensembleSize jobs as
+    replicas of a single simulation (see batch/ensemble.py).
+    """
+
+    ensembleSize = int(ensembleSize or 1)
+    for ijob in range(0, len(jobs), ensembleSize):
+        # job args packed in a dict since the bulletin board can not pass None args to subworlds
+        cfgSavePath, jobPath = jobs[ijob]
+        job = {'cfgSavePath': cfgSavePath, 'jobPath': jobPath, 'fitnessFunc': fitnessFunc, 'fitnessFuncArgs': fitnessFuncArgs, 'include': include}
+        if ensembleSize > 1:
+            job['ensemble'] = jobs[ijob:ijob+ensembleSize]
+            print('Submitting ensemble of jobs ', ', '.join([jobPath for cfgSavePath, jobPath in job['ensemble']]))
+        else:
+            print('Submitting job ', jobPath)
+        pc.submit(runSubworldJob, job, netParamsFile)
+
+    results = {}
+    while pc.working():
+        jobResults = pc.pyret()
+        for result in (jobResults if isinstance(jobResults, list) else [jobResults] if jobResults else []):
+            results[result['jobPath']] = result
+            if 'error' in result:
+                print('  Job %s failed (%s)' % (result['jobPath'], result['error']))
+            elif 'fitness' in result:
+                print('  Job %s fitness = %s' % (result['jobPath'], str(result['fitness'])))
+            else:
+                print('  Job %s completed' % (result['jobPath']))
+
+    return [results.get(jobPath, {'jobPath': jobPath, 'error': 'no result received'}) for cfgSavePath, jobPath in jobs]
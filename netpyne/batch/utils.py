@@ -93,6 +93,105 @@ echo $PBS_O_WORKDIR
 %s
         """
 
+# -------------------------------------------------------------------------------
+# functions to receive the results of batch optimization jobs
+# -------------------------------------------------------------------------------
+def createResultSocket():
+    """
+    Creates the Unix datagram socket where jobs notify their completion (see sim.saveBatchResult).
+    Returns the socket and its path, or (None, None) if not available in this platform.
+    """
+
+    import os, socket, tempfile
+
+    if not hasattr(socket, 'AF_UNIX'):
+        return None, None
+    socketPath = os.path.join(tempfile.gettempdir(), 'netpyne_batch_%d.sock' % (os.getpid()))
+    if os.path.exists(socketPath):
+        os.remove(socketPath)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(socketPath)
+    sock.setblocking(False)
+    return sock, socketPath
+
+
+def closeResultSocket(sock, socketPath):
+    """
+    Closes and removes the socket created with createResultSocket()
+    """
+
+    import os
+
+    if sock is not None:
+        sock.close()
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+
+
+def waitForResults(resultFiles, sock=None, timeout=1.0):
+    """
+    Waits until at least one of the result files (dict with any keys and file paths as values) exists, or until the timeout.
+    Wakes up as soon as a job notifies its completion through the socket, so there is no need for short polling intervals
+    (jobs running in other machines, which can not reach the socket, are found when the timeout expires).
+    Returns the list of keys of the existing result files.
+    """
+
+    import os, select
+    from time import sleep
+
+    ready = [key for key, resultFile in resultFiles.items() if os.path.isfile(resultFile)]
+    if ready or not resultFiles:
+        return ready
+
+    if sock is not None:
+        if select.select([sock], [], [], timeout)[0]:
+            try:
+                while sock.recv(4096): pass  # drain notifications
+            except (IOError, OSError):  # no more notifications (BlockingIOError in Python 3, socket.error in Python 2)
+                pass
+    else:
+        sleep(timeout)
+
+    return [key for key, resultFile in resultFiles.items() if os.path.isfile(resultFile)]
+
+
+def loadResult(resultFile):
+    """
+    Loads the simData saved by a job with sim.saveBatchResult()
+    """
+
+    import pickle
+
+    with open(resultFile, 'rb') as fileObj:
+        return pickle.load(fileObj)['simData']
+
+
+def loadProgress(progressFile):
+    """
+    Loads the intermediate metrics saved by a running job with sim.saveBatchProgress() (dict with 't', 'popRates'
+    and 'avgRate'), or returns None if not available yet
+    """
+
+    import os, pickle
+
+    if not os.path.isfile(progressFile):
+        return None
+    try:
+        with open(progressFile, 'rb') as fileObj:
+            return pickle.load(fileObj)
+    except (EOFError, OSError, pickle.UnpicklingError):
+        return None
+
+
+def pruneJob(stopFile):
+    """
+    Requests a running job to stop early, by creating its stop file (see sim.saveBatchProgress)
+    """
+
+    with open(stopFile, 'w') as fileObj:
+        fileObj.write('')
+
+
 def cp(obj, verbose=True, die=True):
     '''
     Function for/to <short description of `netpyne.batch.utils.cp`>
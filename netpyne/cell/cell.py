@@ -20,6 +20,7 @@ from future import standard_library
 standard_library.install_aliases()
 from numbers import Number
 from copy import deepcopy
+import numpy as np
 from neuron import h # Import NEURON
 from ..specs import Dict
 
@@ -138,6 +139,13 @@ class Cell (object):
             if sim.cfg.verbose: print(('  Created %s NetStim for cell gid=%d'% (params['source'], self.gid)))
 
         if sim.cfg.createNEURONObj:
+            # pooled NetStims: connect to one of a bounded pool of sources shared by all synapses of this stim source
+            if params.get('poolSize') and not isinstance(params['rate'], basestring):
+                if stimContainer.get('poolIndex') is None:
+                    stimContainer['poolIndex'] = sim.hashStr('%s_%d_%d' % (params['source'], self.gid, len(self.stims)-1)) % int(params['poolSize'])
+                stimContainer['hObj'] = sim.net._getPoolNetStim(params, stimContainer['poolIndex'])
+                return stimContainer['hObj']
+
             rand = h.Random()
             stimContainer['hRandom'] = rand  # add netcon object to dict in conns list
 
@@ -284,7 +292,7 @@ class Cell (object):
                                     h.pop_section()
                                 else:
 
-                                    sim.simData[key]['cell_'+str(self.gid)][secLoc] = h.Vector(sim.cfg.duration/recordStep+1).resize(0)
+                                    sim.simData[key]['cell_'+str(self.gid)][secLoc] = self._traceVector(key, params, recordStep, secLoc)
                                     sim.simData[key]['cell_'+str(self.gid)][secLoc].record(ptrItem, recordStep)
                         else:
                             if hasattr(sim.cfg,'use_local_dt') and sim.cfg.use_local_dt:
@@ -299,7 +307,7 @@ class Cell (object):
                                                      sim.simData['t'], 1)
                                 h.pop_section()
                             else:                                
-                                sim.simData[key]['cell_'+str(self.gid)] = h.Vector(sim.cfg.duration/sim.cfg.recordStep+1).resize(0)
+                                sim.simData[key]['cell_'+str(self.gid)] = self._traceVector(key, params, sim.cfg.recordStep)
                                 sim.simData[key]['cell_'+str(self.gid)].record(ptr, sim.cfg.recordStep)
                         if sim.cfg.verbose:
                             print('  Recording ', key, 'from cell ', self.gid, ' with parameters: ',str(params))
@@ -313,6 +321,21 @@ class Cell (object):
 
 
 
+    def _traceVector (self, key, params, recordStep, secLoc=None):
+        """Create vector to record trace; traces with recording options (processed at intervals) only hold the samples of one interval"""
+        from .. import sim
+
+        if sim._traceHasOptions(params) and recordStep == sim.cfg.recordStep and getattr(sim, 'tracesProcess', None) is not None:
+            if key not in sim.simData['traceTimes']:
+                sim.simData['traceTimes'][key] = sim._traceTimes(params, recordStep)  # sample times shared by all cells
+            vec = h.Vector(sim.cfg.processTracesInterval/recordStep+2).resize(0)
+            sim.tracesProcess.append({'key': key, 'gid': self.gid, 'secLoc': secLoc, 'vec': vec, 'params': params, 'carry': np.array([]),
+                                      'carryStart': 0, 'chunks': [], 'lastCrossing': -1, 'snippetTimes': []})
+            return vec
+
+        return h.Vector(sim.cfg.duration/recordStep+1).resize(0)
+
+
     def __getstate__ (self):
         """
         Removes non-picklable h objects so can be pickled and sent via py_alltoall
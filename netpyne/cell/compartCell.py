@@ -971,7 +971,7 @@ class CompartCell (Cell):
 
                 if conditionsMet:  # if all conditions are met, set values for this cell
                     if stim['type'] == 'NetStim':  # for netstims, find associated netcon
-                        conn = next((conn for conn in self.conns if conn['source'] == stim['source']), None)
+                        conn = next((conn for conn in self.conns if conn.get('preLabel') == stim['source']), None)
                     if sim.cfg.createPyStruct:
                         for paramName, paramValue in {k: v for k,v in params.items() if k not in ['conds','cellConds']}.items():
                             if stim['type'] == 'NetStim' and paramName in ['weight', 'delay']:
@@ -1039,6 +1039,7 @@ class CompartCell (Cell):
                 'number': params['number'],
                 'start': params['start'],
                 'seed': params['seed'] if 'seed' in params else sim.cfg.seeds['stim']}
+            if params.get('poolSize'): netStimParams['poolSize'] = params['poolSize']
 
             self.addConn(connParams, netStimParams)
 
@@ -1300,6 +1301,7 @@ class CompartCell (Cell):
                 plastMech = getattr(h, plasticity['mech'], None)(0, sec=sec['hObj'])  # create plasticity mechanism (eg. h.STDP)
                 for plastParamName,plastParamValue in plasticity['params'].items():  # add params of the plasticity mechanism
                     setattr(plastMech, plastParamName, plastParamValue)
+                self.conns[-1]['hPlast'] = plastMech
                 if plasticity['mech'] == 'STDP':  # specific implementation steps required for the STDP mech
                     precon = sim.pc.gid_connect(params['preGid'], plastMech); precon.weight[0] = 1 # Send presynaptic spikes to the STDP adjuster
                     pstcon = sim.pc.gid_connect(self.gid, plastMech); pstcon.weight[0] = -1 # Send postsynaptic spikes to the STDP adjuster
@@ -1363,23 +1365,29 @@ class CompartCell (Cell):
             self._segCoords['p0'] = p3dsoma 
             self._segCoords['p1'] = p3dsoma
 
-    def setImembPtr(self):
-        """Set PtrVector to point to the i_membrane_"""
-        jseg = 0
+    def setImembPtr(self, imembPtr=None, offset=0):
+        """Set PtrVector (by default the node LFP PtrVector, at the cell columns) to point to the i_membrane_, starting at index offset"""
+        from .. import sim
+        if imembPtr is None:
+            imembPtr = sim.net._lfpImembPtr
+            offset = sim.net.recXElectrode.segRanges[self.gid][0]
+        jseg = offset
         for sec in list(self.secs.values()):
             hSec = sec['hObj']
             for iseg, seg in enumerate(hSec):
                 try:
-                    self.imembPtr.pset(jseg, seg._ref_i_membrane_)  # notice the underscore at the end (in nA)
+                    imembPtr.pset(jseg, seg._ref_i_membrane_)  # notice the underscore at the end (in nA)
                 except:
                     '  Error setting Vector to point to i_membrane_'
                 jseg += 1
 
 
     def getImemb(self):
-        """Gather membrane currents from PtrVector into imVec (does not need a loop!)"""
-        self.imembPtr.gather(self.imembVec)
-        return self.imembVec.as_numpy()  # (nA)
+        """Gather membrane currents from the node LFP PtrVector and return those of the cell segments (does not need a loop!)"""
+        from .. import sim
+        start, end = sim.net.recXElectrode.segRanges[self.gid]
+        sim.net._lfpImembPtr.gather(sim.net._lfpImembVec)
+        return sim.net._lfpImembVec.as_numpy()[start:end]  # (nA)
 
 
     def updateShape(self):
@@ -66,7 +66,7 @@ def createRhythmicPattern(params, rand):
             stdvec = h.Vector(int(len(isi_array_repeat)))
             rand.normal(0, freqStd*freqStd)
             stdvec.setrand(rand)
-            t_array = np.array([mean+std for (mean,std) in zip(list(stdvec), isi_array_repeat)])
+            t_array = isi_array_repeat + stdvec.as_numpy()
         else:
             t_array = isi_array
         if eventsPerCycle == 2: # spikes/burst in GUI
@@ -150,13 +150,16 @@ def createPoissonPattern(params, rand):
     # start the initial value
     val_pois = np.array([])
     if lamtha > 0.:
+        # first interval is drawn separately and not included in the output (same sequence as drawing one value at a time)
         t_gen = t0 + (-1000. * np.log(1. - rand.uniform(0,1)) / lamtha)
-        if t_gen < T: np.append(val_pois, t_gen)
-        # vals are guaranteed to be monotonically increasing, no need to sort
+        # draw intervals in chunks until reaching T; vals are guaranteed to be monotonically increasing, no need to sort
+        chunkSize = int(1.2 * lamtha * max(T - t0, 0) / 1000.) + 10
         while t_gen < T:
-            # so as to not clobber confusingly base off of t_gen ...
-            t_gen += (-1000. * np.log(1. - rand.uniform(0,1)) / lamtha)
-            if t_gen < T: val_pois = np.append(val_pois, t_gen)
+            vec = h.Vector(chunkSize)
+            vec.setrand(rand)
+            t_chunk = t_gen + np.cumsum(-1000. * np.log(1. - vec.as_numpy()) / lamtha)
+            val_pois = np.append(val_pois, t_chunk[t_chunk < T])
+            t_gen = t_chunk[-1]
 
     return val_pois
 
@@ -185,3 +188,187 @@ def createGaussPattern(params, rand):
     val_gauss = np.sort(val_gauss)
 
     return val_gauss
+
+
+# Philox4x32-10 constants (same counter-based generator family used by NEURON's Random123)
+_PHILOX_M0, _PHILOX_M1 = np.uint64(0xD2511F53), np.uint64(0xCD9E8D57)
+_PHILOX_W0, _PHILOX_W1 = np.uint64(0x9E3779B9), np.uint64(0xBB67AE85)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+
+def philox4x32(counters, keys, rounds=10):
+    """
+    Vectorized Philox4x32 counter-based random number generator (Random123)
+    input params:
+    - counters: array of shape (..., 4) with 32-bit counter words
+    - keys: array of shape (..., 2) with 32-bit key words (broadcast against counters)
+    returns array of shape (..., 4) of uint32 random words; each output only depends on its (counter, key) pair
+    """
+
+    ctr = np.asarray(counters, dtype=np.uint64) & _MASK32
+    key = np.asarray(keys, dtype=np.uint64) & _MASK32
+    c0, c1, c2, c3 = ctr[..., 0], ctr[..., 1], ctr[..., 2], ctr[..., 3]
+    k0, k1 = key[..., 0], key[..., 1]
+    for i in range(rounds):
+        if i > 0:
+            k0 = (k0 + _PHILOX_W0) & _MASK32
+            k1 = (k1 + _PHILOX_W1) & _MASK32
+        p0 = _PHILOX_M0 * c0
+        p1 = _PHILOX_M1 * c2
+        c0, c1, c2, c3 = (p1 >> np.uint64(32)) ^ c1 ^ k0, p1 & _MASK32, (p0 >> np.uint64(32)) ^ c3 ^ k1, p0 & _MASK32
+    return np.stack(np.broadcast_arrays(c0, c1, c2, c3), axis=-1).astype(np.uint32)
+
+
+def counterUniforms(gids, seed, streamId, firstIndex, num, globalIndex=0):
+    """
+    Uniform random values in (0,1) for a population of cells from counter-based Random123 streams
+    input params:
+    - gids: array of cell gids (one stream per gid)
+    - seed: seed of the streams (eg. cfg.seeds['stim']); scalar or array with one value per gid
+    - streamId: 32-bit integer identifying the type of stream (eg. sim.hashStr('vecstim_spkt'))
+    - firstIndex: index of first value of each stream
+    - num: number of values per stream
+    - globalIndex: global Random123 index (eg. cfg.rand123GlobalIndex)
+    returns array of shape (len(gids), num); value j of stream gid is always the same irrespective of firstIndex, num or the other gids
+    """
+
+    gids = np.asarray(gids, dtype=np.uint64)
+    seeds = np.broadcast_to(np.asarray(seed, dtype=np.uint64), gids.shape)
+    firstBlock, lastBlock = firstIndex // 4, (firstIndex + num - 1) // 4 + 1  # each block provides 4 values
+
+    # counter = (block, streamId, globalIndex, 0); key = (gid, seed)
+    counters = np.zeros((1, lastBlock - firstBlock, 4), dtype=np.uint64)
+    counters[..., 0] = np.arange(firstBlock, lastBlock)
+    counters[..., 1] = streamId
+    counters[..., 2] = globalIndex
+    keys = np.stack([gids, seeds], axis=-1)[:, np.newaxis, :]
+    words = philox4x32(counters, keys).reshape(len(gids), -1)
+    words = words[:, firstIndex - firstBlock*4 : firstIndex - firstBlock*4 + num]
+    return (words.astype(np.float64) + 0.5) * 2.0**-32
+
+
+def createIntervalPatterns(gids, interval, start, noise, stop, seed, streamId, globalIndex=0, maxValuesPerBatch=int(1e7)):
+    """
+    Creates VecStim spike trains with mean interval for a population of cells in bulk
+    Each inter-spike interval is (1-noise)*interval plus a negexp interval of mean noise*interval,
+    drawn from a counter-based stream indexed by (gid, spike index), so trains are reproducible
+    for any duration, number of hosts or cell distribution and there is no maximum number of spikes.
+    input params:
+    - gids: list of cell gids
+    - interval, start, noise, seed: scalar or array with one value per gid (ms)
+    - stop: maximum time of spikes (ms)
+    - streamId: 32-bit integer identifying the type of stream (eg. sim.hashStr('vecstim_spkt'))
+    - maxValuesPerBatch: max num of random values generated at once (limits memory)
+    returns list of arrays of spike times (one per gid)
+    """
+
+    gids = np.asarray(gids, dtype=np.int64)
+    numCells = len(gids)
+    interval, start, noise, seed = [np.broadcast_to(np.asarray(x, dtype=float), (numCells,)) for x in [interval, start, noise, seed]]
+    fixedInterval = (1.0 - noise) * interval
+    offset = start - interval * (1.0 - noise)  # randomize first spike so on average it occurs at start + noise*interval
+    numSpks = np.maximum(((1 + 1.5*noise) * (stop - offset) / interval).astype(int), 1)  # generate 1+1.5*noise spikes to account for noise
+
+    spkTimes = [None] * numCells
+    batchSize = max(1, int(maxValuesPerBatch // max(numSpks.max(), 1))) if numCells else 1
+    for ibatch in range(0, numCells, batchSize):
+        inds = np.arange(ibatch, min(ibatch + batchSize, numCells))
+        times = [np.zeros(0) for i in inds]
+        lastTime = offset[inds].copy()
+        numDrawn = 0
+        pending = np.ones(len(inds), dtype=bool)
+        while pending.any():
+            # draw more intervals only for cells whose train has not reached stop yet
+            p = inds[pending]
+            num = int(numSpks[p].max()) if numDrawn == 0 else max(int(numSpks[p].max() // 4), 16)
+            negexp = -np.log(counterUniforms(gids[p], seed[p].astype(np.uint64), streamId, numDrawn, num, globalIndex)) * (noise[p] * interval[p])[:, np.newaxis]
+            chunk = lastTime[pending][:, np.newaxis] + np.cumsum(fixedInterval[p][:, np.newaxis] + negexp, axis=1)
+            for j, i in enumerate(np.flatnonzero(pending)):
+                times[i] = np.append(times[i], chunk[j][chunk[j] <= stop])
+            lastTime[pending] = chunk[:, -1]
+            numDrawn += num
+            pending = lastTime <= stop
+        for i, t in zip(inds, times):
+            spkTimes[i] = t
+
+    return spkTimes
+
+
+def loadSpkTimesFile(fileParams, cellInds, chunkSize=int(1e7)):
+    """
+    Loads the spike trains of a subset of cells from a file, without reading the full file into memory
+    input params:
+    - fileParams: dict with the file info; either
+        {'type': 'npy', 'times': <.npy file>, 'offsets': <.npy file>} (CSR format; spike times of cell i are times[offsets[i]:offsets[i+1]]; files are memory-mapped)
+        {'type': 'sonata', 'file': <.h5 file>, 'population': <node population name> (optional)} (SONATA spikes file; read in chunks of chunkSize)
+    - cellInds: list of cell indices (row of the CSR offsets or SONATA node_id)
+    returns list of arrays of spike times (one per cell index)
+    """
+
+    fileType = fileParams.get('type', 'npy')
+
+    # CSR pair of .npy files: only pages with the requested trains are read
+    if fileType == 'npy':
+        times = np.load(fileParams['times'], mmap_mode='r')
+        offsets = np.load(fileParams['offsets'], mmap_mode='r')
+        return [np.array(times[offsets[i]:offsets[i+1]], dtype=float) if 0 <= i < len(offsets)-1 else np.zeros(0) for i in cellInds]
+
+    # SONATA spikes file: stream over node ids and keep only spikes of requested cells
+    elif fileType == 'sonata':
+        try:
+            import h5py
+        except ImportError:
+            print('Error: loading SONATA spikes files requires the "h5py" Python package')
+            return [np.zeros(0) for i in cellInds]
+
+        cellIndex = {int(i): j for j, i in enumerate(cellInds)}
+        selInds = np.array(sorted(cellIndex), dtype=np.int64)
+        trains = [[] for i in cellInds]
+        with h5py.File(fileParams['file'], 'r') as f:
+            spikes = f['spikes']
+            population = fileParams.get('population')
+            if not population and 'timestamps' not in spikes and len(spikes) == 1:
+                population = list(spikes.keys())[0]  # single node population
+            if population or 'timestamps' not in spikes:
+                if not population or population not in spikes:
+                    raise Exception("%s in SONATA spikes file %s; set the spkTimesFile 'population' to one of: %s"
+                                    % ('Node population %s not found' % (population) if population else 'Multiple node populations',
+                                       fileParams['file'], ', '.join(sorted(spikes.keys()))))
+                spikes = spikes[population]
+            nodeIds = spikes['node_ids'] if 'node_ids' in spikes else spikes['gids']
+            timestamps = spikes['timestamps']
+            sorting = spikes.attrs.get('sorting', b'')
+            sortedById = (sorting.decode() if isinstance(sorting, bytes) else str(sorting)) == 'by_id'
+
+            for start in range(0, len(nodeIds), chunkSize):
+                ids = nodeIds[start:start+chunkSize]
+                if len(selInds) == 0 or (sortedById and (ids[-1] < selInds[0] or ids[0] > selInds[-1])):
+                    continue  # no spikes of requested cells in this chunk
+                mask = np.isin(ids, selInds)
+                if not mask.any():
+                    continue
+                chunkTimes = timestamps[start:start+chunkSize][mask]
+                chunkIds = ids[mask]
+                order = np.argsort(chunkIds, kind='stable')
+                uniqueIds, splits = np.unique(chunkIds[order], return_index=True)
+                for cellId, cellTimes in zip(uniqueIds, np.split(chunkTimes[order], splits[1:])):
+                    trains[cellIndex[int(cellId)]].append(cellTimes)
+
+        return [np.sort(np.concatenate(train)).astype(float) if train else np.zeros(0) for train in trains]
+
+    else:
+        print('Error: unknown spkTimesFile type %s' % (fileType))
+        return [np.zeros(0) for i in cellInds]
+
+
+def saveSpkTimesFile(spkTimes, timesFilename, offsetsFilename):
+    """
+    Saves a list of spike trains (one per cell) in CSR format as a pair of .npy files (spike times and offsets),
+    which can be used as the 'spkTimesFile' of a VecStim population
+    """
+
+    lengths = np.array([len(train) for train in spkTimes], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    times = np.concatenate([np.asarray(train, dtype=float) for train in spkTimes]) if len(spkTimes) else np.zeros(0)
+    np.save(timesFilename, times)
+    np.save(offsetsFilename, offsets)
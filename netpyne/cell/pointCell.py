@@ -120,8 +120,14 @@ class PointCell (Cell):
             if 'rate' in self.params:
                 self.params['interval'] = 1000.0/self.params['rate']
 
+            # if interval and bulk generation, spike times are generated for all the pop cells at once (see Pop._createBulkVecStimTrains)
+            # if spkTimesFile, spike times are loaded for all the pop cells in this node at once (see Pop._loadSpkTimesFile)
+            bulkTrain = (sim.cfg.bulkVecStimTrains and 'interval' in self.params) or 'spkTimesFile' in self.params
+            if bulkTrain:
+                spkTimes = np.array([])
+
             # if interval
-            if 'interval' in self.params:
+            elif 'interval' in self.params:
                 # set interval, start and noise params
                 interval = self.params['interval']
                 start = self.params['start'] if 'start' in self.params else 0.0
@@ -289,11 +295,22 @@ class PointCell (Cell):
                             pulseSpikes[pulseSpikes < start] = start
                             spkTimes = np.append(spkTimes, pulseSpikes[pulseSpikes <= end])
 
-            spkTimes[spkTimes < 0] = 0
-            spkTimes = np.sort(spkTimes)
-            spkTimes = spkTimes[spkTimes <= sim.cfg.duration]
-            self.hSpkTimes = vec  # store the vector containins spikes to avoid seg fault
-            self.hPointp.play(self.hSpkTimes.from_python(spkTimes))
+            if bulkTrain:
+                self._pulseSpkTimes = spkTimes  # added to spike times once generated/loaded for the whole pop
+            else:
+                self.playSpkTimes(spkTimes)
+
+
+    def playSpkTimes (self, spkTimes):
+        """Set spike times (ms) of VecStim, removing values outside [0, duration]"""
+        from .. import sim
+
+        spkTimes = np.array(spkTimes, dtype=float)
+        spkTimes[spkTimes < 0] = 0
+        spkTimes = np.sort(spkTimes)
+        spkTimes = spkTimes[spkTimes <= sim.cfg.duration]
+        self.hSpkTimes = h.Vector(len(spkTimes))  # store the vector containins spikes to avoid seg fault
+        self.hPointp.play(self.hSpkTimes.from_python(spkTimes))
 
 
     def associateGid (self, threshold = None):
@@ -239,7 +239,24 @@ def _delete_module(modname):
         except:
             pass
 
-def importCell(fileName, cellName, cellArgs = None, cellInstance = False):
+def _importCellCacheFile(cacheDir, fileName, cellName, cellArgs, cellInstance, varList, origGlob):
+    # path of the cache file of an imported cell: md5 of template file contents, cellName, cellArgs, mechanisms loaded
+    # (with their params and original globals) and NetPyNE version; v_init is left out since it is only defined once
+    # stdrun is loaded (eg. by the first import), which would change the key of later imports
+    import json, hashlib
+    from netpyne import __version__
+
+    origGlob = {k: v for k, v in origGlob.items() if k != 'v_init'}
+
+    md5 = hashlib.md5()
+    with open(fileName, 'rb') as fileObj:
+        md5.update(fileObj.read())
+    md5.update(json.dumps([os.path.splitext(fileName)[1], cellName, cellArgs, cellInstance, varList, origGlob, __version__],
+                          sort_keys=True, default=str).encode())
+    return os.path.join(cacheDir, 'importCell_%s_%s.pkl' % (cellName, md5.hexdigest()))
+
+
+def importCell(fileName, cellName, cellArgs = None, cellInstance = False, cacheDir = None):
     """
     Function for/to <short description of `netpyne.conversion.neuronPyHoc.importCell`>
 
@@ -263,16 +280,36 @@ def importCell(fileName, cellName, cellArgs = None, cellInstance = False):
         **Default:** ``False``
         **Options:** ``<option>`` <description of option>
 
+    cacheDir : str
+        Folder where the imported cell params are cached, keyed by the template file contents, cellName, cellArgs,
+        mechanisms loaded and NetPyNE version; if found, they are returned without instantiating the cell (files loaded
+        by the template are not part of the key)
+        **Default:** ``None`` does not use a cache
+
 """
 
+    import pickle
+
+    if cellArgs is None: cellArgs = [] # Define as empty list if not otherwise defined
+
+    cacheFile = None
+    if cacheDir and (fileName.endswith('.hoc') or fileName.endswith('.tem') or fileName.endswith('.py') or fileName.endswith('.swc')):
+        varList = mechVarList()
+        origGlob = getGlobals(list(varList['mechs'].keys())+list(varList['pointps'].keys()))
+        cacheFile = _importCellCacheFile(cacheDir, fileName, cellName, cellArgs, cellInstance, varList, origGlob)
+        if os.path.exists(cacheFile):
+            try:
+                with open(cacheFile, 'rb') as fileObj:
+                    return pickle.load(fileObj)
+            except Exception as e:
+                print('  Could not load cached cell params from %s (%s); importing cell again' % (cacheFile, e))
+
     h.initnrn()
 
     varList = mechVarList()  # list of properties for all density mechanisms and point processes
     origGlob = getGlobals(list(varList['mechs'].keys())+list(varList['pointps'].keys()))
     origGlob['v_init'] = -65  # add by hand since won't be set unless load h.load_file('stdrun')
 
-    if cellArgs is None: cellArgs = [] # Define as empty list if not otherwise defined
-
     if fileName.endswith('.hoc') or fileName.endswith('.tem'):
         h.load_file(fileName)
         if not cellInstance:
@@ -325,6 +362,18 @@ def importCell(fileName, cellName, cellArgs = None, cellInstance = False):
 
     setGlobals(origGlob)  # restore original globals
 
+    # save to cache (written to a temporary file and renamed, since jobs may import the same cell concurrently)
+    if cacheFile:
+        try:
+            if not os.path.exists(cacheDir):
+                os.makedirs(cacheDir)
+            tmpFile = '%s.%d.tmp' % (cacheFile, os.getpid())
+            with open(tmpFile, 'wb') as fileObj:
+                pickle.dump((secDic, secListDic, synMechs, globs), fileObj, protocol=pickle.HIGHEST_PROTOCOL)
+            getattr(os, 'replace', os.rename)(tmpFile, cacheFile)  # os.rename in Python 2 (also replaces it in POSIX systems)
+        except Exception as e:
+            print('  Could not save cell params to cache %s (%s)' % (cacheFile, e))
+
     return secDic, secListDic, synMechs, globs
 
 
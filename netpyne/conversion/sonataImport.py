@@ -208,12 +208,13 @@ class SONATAImporter():
     # ------------------------------------------------------------------------------------------------------------
     # Import a network by reading all the SONATA files and creating the NetPyNE structures
     # ------------------------------------------------------------------------------------------------------------
-    def importNet(self, configFile, replaceAxon=True, setdLNseg=True, swapSomaXY=True):
+    def importNet(self, configFile, replaceAxon=True, setdLNseg=True, swapSomaXY=True, replaySpkTimesFile=False):
 
         self.configFile = configFile
         self.replaceAxon = replaceAxon
         self.setdLNseg = setdLNseg
         self.swapSomaXY = swapSomaXY
+        self.replaySpkTimesFile = replaySpkTimesFile  # load input spikes of each node's cells from file instead of storing them in pop tags
 
         # read config files
         filename = os.path.abspath(configFile)
@@ -480,6 +481,8 @@ class SONATAImporter():
             numCells = len(self.cell_info[sonata_pop]['types'])
 
             self.cell_info[sonata_pop]['gid_from_id'] = {} # keep track of gid as func of cell id
+            firstGid = sim.net.lastGid
+            replayCells = {}  # cells with spike times loaded from file, by pop
 
             for icell in _distributeCells(numCells)[sim.rank]:
                 # set gid
@@ -518,7 +521,11 @@ class SONATAImporter():
 
                 elif model_type in ['virtual', 'VecStim', 'NetStim']:
 
-                    if 'spkTimes' in pop.tags:  # if VecStim, copy spike times to params
+                    if 'spkTimesFile' in pop.tags:  # if replaying from file, spike times are loaded after creating cells
+                        cellTags['params'] = {'spkTimesFile': pop.tags['spkTimesFile']}
+                        replayCells.setdefault(pop_id, [])
+
+                    elif 'spkTimes' in pop.tags:  # if VecStim, copy spike times to params
                         cellTags['params'] = {}
                         if isinstance(pop.tags['spkTimes'][0], list):
                             try:
@@ -529,8 +536,13 @@ class SONATAImporter():
                             cellTags['params']['spkTimes'] = pop.tags['spkTimes'] # 1D list (same for all)
 
                 sim.net.cells.append(pop.cellModelClass(gid, cellTags)) # instantiate Cell object
+                if pop_id in replayCells: replayCells[pop_id].append(sim.net.cells[-1])
                 print(('Cell %d/%d (gid=%d) of pop %s, on node %d, ' % (icell, numCells, gid, pop_id, sim.rank)))
 
+            # load spike times of the replay cells in this node (SONATA node_id = cell index within sonata pop)
+            for pop_id, cells in replayCells.items():
+                sim.net.pops[pop_id]._loadSpkTimesFile(cells, firstGid)
+
             sim.net.lastGid = sim.net.lastGid + numCells
 
 
@@ -656,6 +668,11 @@ class SONATAImporter():
                 cellType = self.cell_info[node_set]['types'][0]
                 pop_id = self.pop_id_from_type[(node_set, cellType)]
 
+                # replay spikes from file (each node only loads the spike times of its cells)
+                if self.replaySpkTimesFile:
+                    sim.net.pops[pop_id].tags['spkTimesFile'] = {'type': 'sonata', 'file': self.subs(info['input_file'])}
+                    continue
+
                 # get stpikes
                 from pyneuroml.plot.PlotSpikes import read_sonata_spikes_hdf5_file
                 from pyneuroml.plot.PlotSpikes import POP_NAME_SPIKEFILE_WITH_GIDS
@@ -9,12 +9,15 @@ from __future__ import unicode_literals
 from __future__ import division
 from __future__ import absolute_import
 
+from future import standard_library
+standard_library.install_aliases()
+import numpy as np
+from neuron import h
+
 
 # -----------------------------------------------------------------------------
 # Modify cell params
 # -----------------------------------------------------------------------------
-from future import standard_library
-standard_library.install_aliases()
 def modifyCells(self, params, updateMasterAllCells=False):
     """
     Function for/to <short description of `netpyne.network.modify.modifyCells`>
@@ -182,3 +185,131 @@ def modifyStims(self, params, updateMasterAllCells=False):
 
     sim.timing('stop', 'modifyStimsTime')
     if sim.rank == 0 and sim.cfg.timing: print(('  Done; stims modification time = %0.2f s.' % sim.timingData['modifyStimsTime']))
+
+
+# -----------------------------------------------------------------------------
+# Select conns to read/update params as vectors
+# -----------------------------------------------------------------------------
+def selectConns(self, label, params):
+    """
+    Precomputes a selection of connections in this node, stored in ``net.connSelections[label]``, so their weights,
+    delays and synMech params can then be read or updated as numpy vectors with ``getConnsParam`` and
+    ``setConnsParam`` without re-evaluating conditions over all cells and conns.
+
+    Parameters
+    ----------
+    label : str
+        Label of the selection.
+        **Default:** *required*
+
+    params : dict
+        Conditions to select connections: 'conds' (conn tags, eg. ``{'label': 'E->I', 'synMech': 'AMPA'}``),
+        'postConds' and 'preConds' (cell tags, eg. ``{'pop': 'E'}``); matched as the preConds/postConds of connParams
+        (list of allowed values, or [min, max) range for 'x', 'y', 'z', 'xnorm', 'ynorm' and 'znorm'). Should be
+        called on all nodes (gathers cell tags if 'preConds' and several nodes).
+        **Default:** *required*
+
+    Returns
+    -------
+    Array with postGid and index in cell conns of each selected connection (order of values in this node)
+
+    """
+
+    from .. import sim
+
+    # cells and conns matching conditions (see network/conn.py)
+    localTags = {cell.gid: cell.tags for cell in self.cells}
+    postGids = set((self._findPrePostCellsCondition(localTags, {}, params.get('postConds', {}))[1] or {}).keys())
+    preGids = None
+    if params.get('preConds'):
+        allTags = sim._gatherAllCellTags() if sim.nhosts > 1 else localTags
+        preGids = set(self._findPrePostCellsCondition(allTags, params['preConds'], {})[0].keys())
+
+    conns, index = [], []
+    for cell in self.cells:
+        if cell.gid not in postGids:
+            continue
+        connTags = {iconn: dict(conn, postGid=cell.gid) for iconn, conn in enumerate(cell.conns) if 'hObj' in conn}
+        matched = self._findPrePostCellsCondition(connTags, params.get('conds', {}), {})[0]
+        for iconn in sorted(matched.keys()):
+            conn = cell.conns[iconn]
+            if preGids is not None and conn.get('preGid') not in preGids:
+                continue
+            conns.append(conn)
+            index.append((cell.gid, iconn))
+
+    self.connSelections[label] = {'conns': conns, 'index': np.array(index, dtype=int).reshape(-1, 2),
+                                  'vec': h.Vector(len(conns)), 'ptrs': {}}
+
+    return self.connSelections[label]['index']
+
+
+# -----------------------------------------------------------------------------
+# Get param values of selected conns
+# -----------------------------------------------------------------------------
+def getConnsParam(self, label, param='weight'):
+    """
+    Returns a numpy array with the value of a param for each connection in selection ``label`` (see ``selectConns``):
+    'weight' (NetCon weight), 'delay' (NetCon delay) or a param of the target synMech (eg. 'tau2' or 'e').
+    Weights and synMech params are read with a single PtrVector gather.
+    """
+
+    selection = self.connSelections[label]
+    if len(selection['conns']) == 0:  # eg. no selected conns in this node
+        return np.array([])
+    if param == 'delay':
+        return np.array([conn['hObj'].delay for conn in selection['conns']])
+
+    ptrVec = _getSelectionPtrs(selection, param)
+    ptrVec.gather(selection['vec'])
+    return selection['vec'].as_numpy().copy()
+
+
+# -----------------------------------------------------------------------------
+# Set param values of selected conns
+# -----------------------------------------------------------------------------
+def setConnsParam(self, label, param, values, updateConns=False):
+    """
+    Sets a param of each connection in selection ``label`` (see ``selectConns``) from a numpy array (same order as
+    returned by ``selectConns``) or a single value: 'weight', 'delay' or a param of the target synMech (eg. 'e';
+    synMechs targeted by several selected conns take the last value). Weights and synMech params are written with a
+    single PtrVector scatter. If ``updateConns``, also updates the value in the conn dicts (eg. to save them).
+    """
+
+    selection = self.connSelections[label]
+    numConns = len(selection['conns'])
+    values = np.broadcast_to(np.asarray(values, dtype=float), (numConns,))
+
+    if param == 'delay':
+        for conn, value in zip(selection['conns'], values):
+            conn['hObj'].delay = value
+    elif numConns > 0:
+        ptrVec = _getSelectionPtrs(selection, param)
+        selection['vec'].from_python(values)
+        ptrVec.scatter(selection['vec'])
+
+    if updateConns and param in ['weight', 'delay']:
+        for conn, value in zip(selection['conns'], values.tolist()):
+            conn[param] = value
+
+
+# -----------------------------------------------------------------------------
+# Get (or create) PtrVector pointing to param of selected conns
+# -----------------------------------------------------------------------------
+def _getSelectionPtrs(selection, param):
+    if param not in selection['ptrs']:
+        ptrVec = h.PtrVector(len(selection['conns']))
+        setPtrs = lambda: _setSelectionPtrs(selection, param, ptrVec)
+        ptrVec.ptr_update_callback(setPtrs)  # reset pointers if NEURON reallocates memory
+        selection['ptrs'][param] = (ptrVec, setPtrs)
+        setPtrs()
+    return selection['ptrs'][param][0]
+
+
+def _setSelectionPtrs(selection, param, ptrVec):
+    for i, conn in enumerate(selection['conns']):
+        if param == 'weight':
+            ptrVec.pset(i, conn['hObj']._ref_weight[0])
+        else:
+            ptrVec.pset(i, getattr(conn['hObj'].syn(), '_ref_'+param))
+
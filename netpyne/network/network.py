@@ -50,6 +50,8 @@ class Network(object):
         self.gid2lid = {} # Empty dict for storing GID -> local index (key = gid; value = local id) -- ~x6 faster than .index()
         self.lastGid = 0  # keep track of last cell gid
         self.lastGapId = 0  # keep track of last gap junction gid
+        self.stimPools = {}  # pools of NetStims shared across synapses (key = stim source params; value = dict of NetStims by pool index)
+        self.connSelections = {}  # precomputed selections of conns to read/update params as vectors (see selectConns)
 
 
     # -----------------------------------------------------------------------------
@@ -125,7 +127,7 @@ class Network(object):
     # -----------------------------------------------------------------------------
     # Import stim methods
     # -----------------------------------------------------------------------------
-    from .stim import addStims, _addCellStim, _stimStrToFunc
+    from .stim import addStims, _addCellStim, _stimStrToFunc, _getPoolNetStim, _printStimPoolsInfo
 
     # -----------------------------------------------------------------------------
     # Import conn methods
@@ -137,7 +139,8 @@ class Network(object):
     # -----------------------------------------------------------------------------
     # Import subconn methods
     # -----------------------------------------------------------------------------
-    from .subconn import fromtodistance, _posFromLoc, _interpolateSegmentSigma, subcellularConn
+    from .subconn import fromtodistance, _posFromLoc, _segCoordsFromSecs, _segmentSigma, _interpolateSegmentSigma, \
+        _distributeSynsDensityMap, subcellularConn
 
     # -----------------------------------------------------------------------------
     # Import rxd methods
@@ -153,4 +156,4 @@ class Network(object):
     # -----------------------------------------------------------------------------
     # Import modify methods
     # -----------------------------------------------------------------------------
-    from .modify import modifyCells, modifySynMechs, modifyConns, modifyStims
+    from .modify import modifyCells, modifySynMechs, modifyConns, modifyStims, selectConns, getConnsParam, setConnsParam
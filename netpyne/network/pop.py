@@ -70,6 +70,10 @@ class Pop (object):
         Function to instantiate Cell objects based on the characteristics of this population
         """
 
+        from .. import sim
+
+        firstGid = sim.net.lastGid
+
         # add individual cells
         if 'cellsList' in self.tags:
             cells = self.createCellsList()
@@ -92,9 +96,74 @@ class Pop (object):
             print('Warninig: number or density of cells not specified for population %s; defaulting to numCells = 1' % (self.tags['pop']))
             cells = self.createCellsFixedNum()
 
+        # generate or load VecStim spike trains for all cells of the pop at once
+        if cells:
+            self._createVecStimTrains(cells, firstGid)
+
         return cells
 
 
+    def _createVecStimTrains(self, cells, firstGid):
+        """
+        Set the VecStim spike trains deferred at cell creation (see PointCell.createNEURONObj) for all cells of the pop
+        in this node at once; used after creating cells or reinstantiating them with sim.loadNet
+        """
+
+        from .. import sim
+
+        # generate VecStim spike trains for all cells of the pop at once
+        if sim.cfg.bulkVecStimTrains:
+            self._createBulkVecStimTrains(cells)
+
+        # load VecStim spike trains of cells in this node from file
+        self._loadSpkTimesFile(cells, firstGid)
+
+
+    def _createBulkVecStimTrains(self, cells):
+        """
+        Generate interval-based VecStim spike trains of all cells in this node using counter-based Random123 streams
+        """
+
+        from .. import sim
+        from ..cell.inputs import createIntervalPatterns
+
+        bulkCells = [cell for cell in cells if hasattr(cell, '_pulseSpkTimes') and 'interval' in cell.params]
+        if not bulkCells:
+            return
+
+        params = [cell.params for cell in bulkCells]
+        spkTimes = createIntervalPatterns(gids=[cell.gid for cell in bulkCells],
+                                          interval=[p['interval'] for p in params],
+                                          start=[p.get('start', 0.0) for p in params],
+                                          noise=[p.get('noise', 0.0) for p in params],
+                                          stop=sim.cfg.duration,
+                                          seed=[p['seed'] for p in params],
+                                          streamId=sim.hashStr('vecstim_spkt'),
+                                          globalIndex=sim.cfg.rand123GlobalIndex or 0)
+
+        for cell, cellSpkTimes in zip(bulkCells, spkTimes):
+            cell.playSpkTimes(np.append(cellSpkTimes, cell._pulseSpkTimes))
+            del cell._pulseSpkTimes
+
+
+    def _loadSpkTimesFile(self, cells, firstGid):
+        """
+        Load spike trains of the cells in this node from the pop spkTimesFile directly into the VecStim vectors
+        (cell index within pop is used as row of the file; spike times are not stored in pop or cell tags)
+        """
+
+        from ..cell.inputs import loadSpkTimesFile
+
+        fileCells = [cell for cell in cells if hasattr(cell, '_pulseSpkTimes') and 'spkTimesFile' in cell.params]
+        if not fileCells:
+            return
+
+        spkTimes = loadSpkTimesFile(fileCells[0].params['spkTimesFile'], [cell.gid - firstGid for cell in fileCells])
+        for cell, cellSpkTimes in zip(fileCells, spkTimes):
+            cell.playSpkTimes(np.append(cellSpkTimes, cell._pulseSpkTimes))
+            del cell._pulseSpkTimes
+
+
     def createCellsFixedNum (self):
         """
         Create population cells based on fixed number of cells
@@ -16,6 +16,7 @@ try:
     basestring
 except NameError:
     basestring = str
+from neuron import h
 
 
 # -----------------------------------------------------------------------------
@@ -116,6 +117,7 @@ def addStims(self):
                         postCell.addStim(params)  # call cell method to add connection
 
     print(('  Number of stims on node %i: %i ' % (sim.rank, sum([len(cell.stims) for cell in self.cells]))))
+    if self.stimPools: self._printStimPoolsInfo()
     sim.pc.barrier()
     sim.timing('stop', 'stimsTime')
     if sim.rank == 0 and sim.cfg.timing: print(('  Done; cell stims creation time = %0.2f s.' % sim.timingData['stimsTime']))
@@ -157,6 +159,44 @@ def _addCellStim(self, stimParam, postCell):
 
 
 
+# -----------------------------------------------------------------------------
+# Get (or create) NetStim from pool of sources shared across synapses
+# -----------------------------------------------------------------------------
+def _getPoolNetStim(self, params, poolIndex):
+    """
+    Returns the NetStim with index poolIndex from the pool of the stim source.
+    Each pool source is seeded based on the source label and pool index (not the post cell gid), so the same
+    index produces the same spike train in any node, and only sources used by cells in this node are created.
+    """
+
+    poolKey = (params['source'], params['rate'], params['noise'], params['start'], params['number'], params['seed'], int(params['poolSize']))
+    pool = self.stimPools.setdefault(poolKey, {'source': params['source'], 'seed': params['seed'], 'numSyns': 0, 'netStims': {}})
+    pool['numSyns'] += 1
+
+    if poolIndex not in pool['netStims']:
+        netstim = h.NetStim()
+        netstim.interval = params['rate']**-1*1e3 # inverse of the frequency and then convert from Hz^-1 to ms
+        netstim.noise = params['noise'] # note: random number generator initialized via Random123() from sim.preRun()
+        netstim.start = params['start']
+        netstim.number = params['number']
+        pool['netStims'][poolIndex] = {'hObj': netstim, 'hRandom': h.Random()}
+
+    return pool['netStims'][poolIndex]['hObj']
+
+
+# -----------------------------------------------------------------------------
+# Print number of pooled NetStims and synapses sharing them
+# -----------------------------------------------------------------------------
+def _printStimPoolsInfo(self):
+
+    from .. import sim
+
+    for pool in self.stimPools.values():
+        numNetStims = len(pool['netStims'])
+        print(('  Stim source %s pool on node %i: %i NetStims shared by %i synapses (sharing ratio = %.1f)' %
+            (pool['source'], sim.rank, numNetStims, pool['numSyns'], float(pool['numSyns'])/numNetStims if numNetStims else 0.0)))
+
+
 # -----------------------------------------------------------------------------
 # Convert stim param string to function
 # -----------------------------------------------------------------------------
@@ -76,54 +76,130 @@ def _posFromLoc(self, sec, x):
     return x, y, z
 
 
+# -----------------------------------------------------------------------------
+# Calculate 3d coords of all segments in a list of sections
+# -----------------------------------------------------------------------------
+def _segCoordsFromSecs(self, cell, secList):
+    """Returns dict with section index, normalized location, length and 3d position (nseg x 3 array) of each segment in secList"""
+
+    secInds, segXs, segLens, segPos = [], [], [], []
+    for isec, secName in enumerate(secList):
+        hSec = cell.secs[secName]['hObj']
+        n3d = int(h.n3d(sec=hSec))
+        xs = np.array([seg.x for seg in hSec])
+        if n3d == 0:
+            print("an error occurred in _segCoordsFromSecs, no 3d points in section %s" % (secName))
+            pos = np.zeros((len(xs), 3))
+        else:
+            arc = np.array([h.arc3d(i, sec=hSec) for i in range(n3d)])
+            pts = np.array([[h.x3d(i, sec=hSec), h.y3d(i, sec=hSec), h.z3d(i, sec=hSec)] for i in range(n3d)])
+            s = xs * hSec.L
+            pos = np.column_stack([np.interp(s, arc, pts[:, k]) for k in range(3)])  # linear interpolation along arc length
+        secInds.append(np.full(len(xs), isec, dtype=int))
+        segXs.append(xs)
+        segLens.append(np.full(len(xs), hSec.L / hSec.nseg))
+        segPos.append(pos)
+
+    return {'secInds': np.concatenate(secInds) if secInds else np.zeros(0, dtype=int),
+            'x': np.concatenate(segXs) if segXs else np.zeros(0),
+            'len': np.concatenate(segLens) if segLens else np.zeros(0),
+            'pos': np.concatenate(segPos) if segPos else np.zeros((0, 3))}
+
+
+# -----------------------------------------------------------------------------
+# Calculate syn density (vectorized) for an array of segment positions from grid
+# -----------------------------------------------------------------------------
+def _segmentSigma(self, segPos, gridX, gridY, gridSigma):
+    """Returns array with syn density of each segment, using bilinear (2D map) or linear (1D map) interpolation between the 2 closest grid points"""
+
+    gridSigma = np.array(gridSigma, dtype=float)
+    gridY = np.array(gridY, dtype=float)
+    y = segPos[:, 1]
+
+    # 2 closest grid points along y (same criteria as argsort of distances per segment)
+    jys = np.argsort(np.abs(gridY[np.newaxis, :] - y[:, np.newaxis]), axis=1, kind='stable')[:, :2]
+    j1, j2 = jys.min(axis=1), jys.max(axis=1)
+    y1, y2 = gridY[j1], gridY[j2]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if gridX:  # 2D
+            gridX = np.array(gridX, dtype=float)
+            x = segPos[:, 0]
+            ixs = np.argsort(np.abs(gridX[np.newaxis, :] - x[:, np.newaxis]), axis=1, kind='stable')[:, :2]
+            i1, i2 = ixs.min(axis=1), ixs.max(axis=1)
+            x1, x2 = gridX[i1], gridX[i2]
+            invalid = (x1 == x2) | (y1 == y2)
+            # bilinear interpolation, see http://en.wikipedia.org/wiki/Bilinear_interpolation (fixed bug from Ben Suter's code)
+            sigma = ((gridSigma[i1, j1]*np.abs(x2-x)*np.abs(y2-y) + gridSigma[i2, j1]*np.abs(x-x1)*np.abs(y2-y) +
+                      gridSigma[i1, j2]*np.abs(x2-x)*np.abs(y-y1) + gridSigma[i2, j2]*np.abs(x-x1)*np.abs(y-y1)) /
+                     (np.abs(x2-x1)*np.abs(y2-y1)))
+        else:  # 1d = radial
+            invalid = (y1 == y2)
+            # linear interpolation, see http://en.wikipedia.org/wiki/Bilinear_interpolation
+            sigma = (gridSigma[j1]*np.abs(y2-y) + gridSigma[j2]*np.abs(y-y1)) / np.abs(y2-y1)
+
+    if invalid.any():
+        print("ERROR in closest grid points for %d segments; setting their syn density to 0" % (np.count_nonzero(invalid)))
+        sigma[invalid] = 0.0
+
+    return sigma
+
+
 # -----------------------------------------------------------------------------
 # Calculate syn density for each segment from grid
 # -----------------------------------------------------------------------------
 def _interpolateSegmentSigma(self, cell, secList, gridX, gridY, gridSigma):
-    segNumSyn = {}  #
-    for secName in secList:
-        sec = cell.secs[secName]
-        segNumSyn[secName] = []
-        for seg in sec['hObj']:
-            x, y, z = self._posFromLoc(sec['hObj'], seg.x)
-            if gridX and gridY: # 2D
-                distX = [abs(gx-x) for gx in gridX]
-                distY = [abs(gy-y) for gy in gridY]
-                ixs = np.array(distX).argsort()[:2]
-                jys = np.array(distY).argsort()[:2]
-                i1,i2,j1,j2 = min(ixs), max(ixs), min(jys), max(jys)
-                x1,x2,y1,y2 = gridX[i1], gridX[i2], gridY[j1], gridY[j2]
-                sigma_x1_y1 = gridSigma[i1][j1]
-                sigma_x1_y2 = gridSigma[i1][j2]
-                sigma_x2_y1 = gridSigma[i2][j1]
-                sigma_x2_y2 = gridSigma[i2][j2]
-
-                if x1 == x2 or y1 == y2:
-                    print("ERROR in closest grid points: ", secName, x1, x2, y1, y2)
-                else:
-                   # bilinear interpolation, see http://en.wikipedia.org/wiki/Bilinear_interpolation (fixed bug from Ben Suter's code)
-                   sigma = ((sigma_x1_y1*abs(x2-x)*abs(y2-y) + sigma_x2_y1*abs(x-x1)*abs(y2-y) + sigma_x1_y2*abs(x2-x)*abs(y-y1) + sigma_x2_y2*abs(x-x1)*abs(y-y1))/(abs(x2-x1)*abs(y2-y1)))
-                   #sigma = ((sigma_x1_y1*abs(x2-x)*abs(y2-y) + sigma_x2_y1*abs(x-x1)*abs(y2-y) + sigma_x1_y2*abs(x2-x)*abs(y-y1) + sigma_x2_y2*abs(x-x1)*abs(y-y1))/((x2-x1)*(y2-y1)))
-
-            elif gridY:  # 1d = radial
-                distY = [abs(gy-y) for gy in gridY]
-                jys = np.array(distY).argsort()[:2]
-                sigma = np.zeros((1,2))
-                j1,j2 = min(jys), max(jys)
-                y1, y2 = gridY[j1], gridY[j2]
-                sigma_y1 = gridSigma[j1]
-                sigma_y2 = gridSigma[j2]
-
-                if y1 == y2:
-                    print("ERROR in closest grid points: ", secName, y1, y2)
-                else:
-                   # linear interpolation, see http://en.wikipedia.org/wiki/Bilinear_interpolation
-                   sigma = ((sigma_y1*abs(y2-y) + sigma_y2*abs(y-y1)) / abs(y2-y1))
-
-            numSyn = sigma * sec['hObj'].L / sec['hObj'].nseg  # return num syns
-            segNumSyn[secName].append(numSyn)
-
-    return segNumSyn
+    segCoords = self._segCoordsFromSecs(cell, secList)
+    segNumSyn = self._segmentSigma(segCoords['pos'], gridX, gridY, gridSigma) * segCoords['len']  # num syns
+    return {secName: list(segNumSyn[segCoords['secInds'] == isec]) for isec, secName in enumerate(secList)}
+
+
+# -----------------------------------------------------------------------------
+# Distribute syns across segments based on density map (shared across cells with same morphology)
+# -----------------------------------------------------------------------------
+def _distributeSynsDensityMap(self, postCell, secList, subConnLabel, density, numSyns, morphCache):
+    """Returns lists of new secs and locs for numSyns synapses distributed based on a 2D or 1D density map"""
+
+    # seg coords relative to soma, calculated once per morphology (cell rule labels + sections + rotation)
+    somaPos = np.array(self._posFromLoc(postCell.secs['soma']['hObj'], 0.5))  # get cell pos move method to Cell!
+    morphKey = (tuple(postCell.tags.get('label', [postCell.tags.get('cellType')])), tuple(secList),
+                getattr(postCell, 'randRotationAngle', None))
+    if morphKey not in morphCache['coords']:
+        segCoords = self._segCoordsFromSecs(postCell, secList)
+        segCoords['pos'] = segCoords['pos'] - somaPos
+        morphCache['coords'][morphKey] = segCoords
+    segCoords = morphCache['coords'][morphKey]
+
+    # syn density per segment, shared across cells with same morphology and soma position
+    densityKey = (subConnLabel, morphKey, tuple(somaPos))
+    if densityKey not in morphCache['density']:
+        somaX, somaY = somaPos[0], somaPos[1]
+        gridY = density['gridY']
+        if 'fixedSomaY' in density:  # is fixed cell soma y, adjust y grid accordingly
+            fixedSomaY = density.get('fixedSomaY')
+            gridY = [y+(somaY-fixedSomaY) for y in gridY] # adjust grid so cell soma is at fixedSomaY
+        gridX = [x - somaX for x in density['gridX']] if density['type'] == '2Dmap' else None  # center x at cell soma
+        segPos = segCoords['pos'] + somaPos
+        morphCache['density'][densityKey] = self._segmentSigma(segPos, gridX, gridY, density['gridValues']) * segCoords['len']
+    segNumSyn = morphCache['density'][densityKey]
+
+    # rescale to number of syns, rounding to integers
+    totSyn = segNumSyn.sum()  # summed density
+    scaleNumSyn = float(numSyns)/float(totSyn) if totSyn>0 else 0.0
+    orig = segNumSyn * scaleNumSyn
+    scaled = np.round(orig).astype(int)
+    diff = orig - scaled
+
+    # if missing syns due to rescaling to 0, find top values which were rounded to 0 and make 1
+    extraSyns = numSyns - scaled.sum()
+    if extraSyns > 0:
+        candidates = np.flatnonzero(diff > 0)
+        candidates = candidates[np.argsort(-diff[candidates], kind='stable')]
+        scaled[candidates[:extraSyns]] += 1
+
+    newSecs = np.repeat(np.array(secList, dtype=object)[segCoords['secInds']], scaled).tolist()
+    newLocs = np.repeat(segCoords['x'], scaled).tolist()
+    return newSecs, newLocs
 
 
 # -----------------------------------------------------------------------------
@@ -156,39 +232,51 @@ def subcellularConn(self, allCellTags, allPopTags):
     sim.timing('start', 'subConnectTime')
     print('  Distributing synapses based on subcellular connectivity rules...')
 
-    for subConnParamTemp in list(self.params.subConnParams.values()):  # for each conn rule or parameter set
+    morphCache = {'coords': {}, 'density': {}}  # seg coords and syn densities shared across cells with same morphology
+
+    for subConnLabel, subConnParamTemp in self.params.subConnParams.items():  # for each conn rule or parameter set
         subConnParam = subConnParamTemp.copy()
 
         # find list of pre and post cell
         preCellsTags, postCellsTags = self._findPrePostCellsCondition(allCellTags, subConnParam['preConds'], subConnParam['postConds'])
 
         if preCellsTags and postCellsTags:
+            includeNetStim = 'NetStim' in [x['cellModel'] for x in list(preCellsTags.values())] # temporary fix to include netstim conns
+            groupSynMechs = subConnParam.get('groupSynMechs', None) if len(subConnParam.get('groupSynMechs', [])) > 1 else None
+
+            if isinstance(subConnParam.get('density', None), dict) and subConnParam['density']['type'] in ['2Dmap', '1Dmap']:
+                # convert to list so can serialize and save
+                subConnParam['density']['gridY'] = list(subConnParam['density']['gridY'])
+                subConnParam['density']['gridValues'] = list(subConnParam['density']['gridValues'])
+
             # iterate over postsyn cells to redistribute synapses
             for postCellGid in postCellsTags:  # for each postsyn cell
                 if postCellGid in self.gid2lid:
                     postCell = self.cells[self.gid2lid[postCellGid]]
-                    allConns = [conn for conn in postCell.conns if conn['preGid'] in preCellsTags]
-                    if 'NetStim' in [x['cellModel'] for x in list(preCellsTags.values())]: # temporary fix to include netstim conns
-                        allConns.extend([conn for conn in postCell.conns if conn['preGid'] == 'NetStim'])
+                    allConns = [conn for conn in postCell.conns if conn['preGid'] in preCellsTags or (includeNetStim and conn['preGid'] == 'NetStim')]
 
                     # group synMechs so they are not distributed separately
-                    if 'groupSynMechs' in subConnParam and len(subConnParam['groupSynMechs']) > 1:
+                    connsGroup = {}
+                    if groupSynMechs:
+                        # index conns by (preGid, sec, loc, synMech) to find grouped conns without nested search
+                        connsIndex = {}
+                        for conn in allConns:
+                            connsIndex.setdefault((conn['preGid'], conn['sec'], conn['loc'], conn['synMech']), []).append(conn)
+
                         conns = []
-                        connsGroup = {}
-                        #iConn = -1
                         for conn in allConns:
                             if not conn['synMech'].startswith('__grouped__'):
                                 conns.append(conn)
-                                #iConn = iConn + 1
-                                connGroupLabel = '%d_%s_%.4f' % (conn['preGid'], conn['sec'], conn['loc'])
-                                if conn['synMech'] in subConnParam['groupSynMechs']:
-                                    for synMech in [s for s in subConnParam['groupSynMechs'] if s != conn['synMech']]:
-                                        connGroup = next((c for c in allConns if c['synMech'] == synMech and c['sec']==conn['sec'] and c['loc']==conn['loc']), None)
-                                        try:
+                                connGroupLabel = (conn['preGid'], conn['sec'], conn['loc'])
+                                if conn['synMech'] in groupSynMechs:
+                                    for synMech in [s for s in groupSynMechs if s != conn['synMech']]:
+                                        sameLocConns = connsIndex.get(connGroupLabel + (synMech,))
+                                        if sameLocConns:
+                                            connGroup = sameLocConns.pop(0)
                                             connGroup['synMech'] = '__grouped__'+connGroup['synMech']
-                                            connsGroup[connGroupLabel] = connGroup
-                                        except:
-                                            print('  Warning: Grouped synMechs %s not found' % (str(connGroup)))
+                                            connsGroup.setdefault(id(conn), []).append(connGroup)
+                                        else:
+                                            print('  Warning: Grouped synMech %s not found for conn %s' % (synMech, str(connGroupLabel)))
                     else:
                         conns = allConns
 
@@ -206,54 +294,8 @@ def subcellularConn(self, allCellTags, allPopTags):
 
                     # 2D map and 1D map (radial)
                     elif isinstance(subConnParam.get('density', None), dict) and subConnParam['density']['type'] in ['2Dmap', '1Dmap']:
-
-                        gridY = subConnParam['density']['gridY']
-                        gridSigma = subConnParam['density']['gridValues']
-                        somaX, somaY, _ = self._posFromLoc(postCell.secs['soma']['hObj'], 0.5) # get cell pos move method to Cell!
-                        if 'fixedSomaY' in subConnParam['density']:  # is fixed cell soma y, adjust y grid accordingly
-                            fixedSomaY = subConnParam['density'].get('fixedSomaY')
-                            gridY = [y+(somaY-fixedSomaY) for y in gridY] # adjust grid so cell soma is at fixedSomaY
-
-                        if subConnParam['density']['type'] == '2Dmap': # 2D
-                            gridX = [x - somaX for x in subConnParam['density']['gridX']] # center x at cell soma
-                            segNumSyn = self._interpolateSegmentSigma(postCell, secList, gridX, gridY, gridSigma) # move method to Cell!
-                        elif subConnParam['density']['type'] == '1Dmap': # 1D
-                            segNumSyn = self._interpolateSegmentSigma(postCell, secList, None, gridY, gridSigma) # move method to Cell!
-
-                        totSyn = sum([sum(nsyn) for nsyn in list(segNumSyn.values())])  # summed density
-                        scaleNumSyn = float(len(conns))/float(totSyn) if totSyn>0 else 0.0
-                        diffList = []
-                        for sec in segNumSyn:
-                            for seg,x in enumerate(segNumSyn[sec]):
-                                orig = float(x*scaleNumSyn)
-                                scaled = int(round(x * scaleNumSyn))
-                                segNumSyn[sec][seg] = scaled
-                                diff = orig - scaled
-                                if diff > 0:
-                                    diffList.append([diff,sec,seg])
-
-                        totSynRescale = sum([sum(nsyn) for nsyn in list(segNumSyn.values())])
-
-                        # if missing syns due to rescaling to 0, find top values which were rounded to 0 and make 1
-                        if totSynRescale < len(conns):
-                            extraSyns = len(conns)-totSynRescale
-                            diffList = sorted(diffList, key=lambda l:l[0], reverse=True)
-                            for i in range(min(extraSyns, len(diffList))):
-                                sec = diffList[i][1]
-                                seg = diffList[i][2]
-                                segNumSyn[sec][seg] += 1
-
-                        # convert to list so can serialize and save
-                        subConnParam['density']['gridY'] = list(subConnParam['density']['gridY'])
-                        subConnParam['density']['gridValues'] = list(subConnParam['density']['gridValues'])
-
-                        newSecs, newLocs = [], []
-                        for sec, nsyns in segNumSyn.items():
-                            for i, seg in enumerate(postCell.secs[sec]['hObj']):
-                                for isyn in range(nsyns[i]):
-                                    newSecs.append(sec)
-                                    newLocs.append(seg.x)
-
+                        secList = list(dict.fromkeys(secList))  # remove duplicate sections
+                        newSecs, newLocs = self._distributeSynsDensityMap(postCell, secList, subConnLabel, subConnParam['density'], len(conns), morphCache)
 
                     # Distance-based
                     elif subConnParam.get('density', None) == 'distance':
@@ -276,9 +318,6 @@ def subcellularConn(self, allCellTags, allPopTags):
 
                     for i,(conn, newSec, newLoc) in enumerate(zip(conns, newSecs, newLocs)):
 
-                        # get conn group label before updating params
-                        connGroupLabel = '%d_%s_%.4f' % (conn['preGid'], conn['sec'], conn['loc'])
-
                         # update weight if weightNorm present
                         newWeightNorm = None
                         if 'weightNorm' in postCell.secs[conn['sec']] and isinstance(postCell.secs[conn['sec']]['weightNorm'], list):
@@ -297,16 +336,15 @@ def subcellularConn(self, allCellTags, allPopTags):
                         conn['loc'] = newLoc
 
                         # find grouped conns
-                        if subConnParam.get('groupSynMechs', None) \
-                            and len(subConnParam['groupSynMechs']) > 1 \
-                            and conn['synMech'] in subConnParam['groupSynMechs']:
+                        if groupSynMechs and conn['synMech'] in groupSynMechs:
+                            for connGroup in connsGroup.get(id(conn), []):  # get grouped conns from previously stored dict
+                                connGroup['synMech'] = connGroup['synMech'].split('__grouped__')[1]  # remove '__grouped__' label
 
-                            connGroup = connsGroup[connGroupLabel]  # get grouped conn from previously stored dict
-                            connGroup['synMech'] = connGroup['synMech'].split('__grouped__')[1]  # remove '__grouped__' label
-
-                            connGroup['sec'] = newSec
-                            connGroup['loc'] = newLoc
-                            if newWeightNorm: connGroup['weight'] = connGroup['weight'] / oldWeightNorm * newWeightNorm
+                                connGroup['sec'] = newSec
+                                connGroup['loc'] = newLoc
+                                if newWeightNorm: connGroup['weight'] = connGroup['weight'] / oldWeightNorm * newWeightNorm
 
 
         sim.pc.barrier()
+
+    sim.timing('stop', 'subConnectTime')
@@ -25,19 +25,19 @@ from neuron import h
 #------------------------------------------------------------------------------
 
 # import setup functions
-from .setup import initialize, setNet, setNetParams, setSimCfg, createParallelContext, readCmdLineArgs, setupRecording, setupRecordLFP, setGlobals
+from .setup import initialize, setNet, setNetParams, setSimCfg, createParallelContext, readCmdLineArgs, setupRecording, setupRecordLFP, setupRecordWeights, setWeightsPtrs, setGlobals
 
 # import run functions
-from .run import preRun, runSim, runSimWithIntervalFunc, loadBalance, calculateLFP
+from .run import preRun, runSim, runSimWithIntervalFunc, runBranches, loadBalance, calculateLFP, flushSpikes, processTraces, recordWeights, flushWeights, _traceTimes, _traceHasOptions
 
 # import gather functions
-from .gather import gatherData, _gatherAllCellTags, _gatherAllCellConnPreGids, _gatherCells, gatherDataFromFiles
+from .gather import gatherData, _gatherAllCellTags, _gatherAllCellConnPreGids, _gatherCells, gatherDataFromFiles, gatherIntervalData, _restoreFlushedSpikes
 
 # import saving functions
-from .save import saveJSON, saveData, distributedSaveHDF5, compactConnFormat, intervalSave, saveDataInNodes
+from .save import saveJSON, saveData, saveBatchResult, saveBatchProgress, saveResultsStore, distributedSaveHDF5, compactConnFormat, intervalSave, intervalSaveAsync, checkpoint, stopIntervalSaveAsync, saveDataInNodes
 
 # import loading functions
-from .load import loadSimCfg, loadNetParams, loadNet, loadSimData, loadAll, loadHDF5, ijsonLoad
+from .load import loadSimCfg, loadNetParams, loadNet, loadSimData, loadWeights, resume, loadAll, loadHDF5, ijsonLoad
 
 # import utils functions (general)
 from .utils import cellByGid, getCellsList, timing, version, gitChangeset, hashStr, hashList, _init_stim_randomizer, unique, checkMemory
@@ -59,9 +59,6 @@ from ..cell import CompartCell, PointCell, NML2Cell, NML2SpikeSource
 # import Network and Pop classes
 from ..network import Network, Pop
 
-# import analysis-related module
-from .. import analysis
-
 # import testing related functions
 from .. import tests
 from ..tests.checks import checkOutput
@@ -70,3 +67,17 @@ from ..tests.tests import SimTestObj
 # import export/import-related functions
 from .. import conversion
 from ..conversion.neuromlFormat import *
+
+
+#------------------------------------------------------------------------------
+# Import analysis-related module on first use (sim.analysis), since it imports the plotting dependencies
+#------------------------------------------------------------------------------
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name == 'analysis':
+            from .. import analysis
+            return analysis
+        raise AttributeError("module 'netpyne.sim' has no attribute '%s'" % (name))
+
+else:  # module __getattr__ not supported
+    from .. import analysis
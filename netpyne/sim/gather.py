@@ -13,7 +13,7 @@ from builtins import zip
 from future import standard_library
 standard_library.install_aliases()
 import numpy as np
-from ..specs import Dict, ODict
+from ..specs import Dict, ODict, TraceMatrix
 
 
 #------------------------------------------------------------------------------
@@ -41,6 +41,13 @@ def gatherData(gatherLFP=True):
     if sim.rank==0:
         print('\nGathering data...')
 
+    # recover spikes moved to node file or ring buffer during the run
+    _restoreFlushedSpikes()
+
+    # store traces recorded with options (dtype, decimate, envelope, timeWindows, snippets)
+    sim.processTraces(final=True)
+    sim.flushWeights(final=True)  # write remaining weight snapshots to node file
+
     # flag to avoid saving sections data for each cell (saves gather time and space; cannot inspect cell secs or re-simulate)
     if not sim.cfg.saveCellSecs:
         for cell in sim.net.cells:
@@ -60,11 +67,14 @@ def gatherData(gatherLFP=True):
     if gatherLFP and sim.cfg.recordLFP and hasattr(sim.net, 'compartCells') and sim.cfg.createNEURONObj:
         for cell in sim.net.compartCells:
             try:
-                del cell.imembVec
-                del cell.imembPtr
                 del cell._segCoords
             except:
                 pass
+        for attr in ['_lfpImembPtr', '_lfpImembVec', '_lfpGroupRanges', '_lfpCSDSpacing']:
+            try:
+                delattr(sim.net, attr)
+            except:
+                pass
         for pop in list(sim.net.pops.values()):
             try:
                 del pop._morphSegCoords
@@ -95,8 +105,8 @@ def gatherData(gatherLFP=True):
                 print('  Gathering only sim data...')
                 sim.allSimData = Dict()
                 for k in list(gather[0]['simData'].keys()):  # initialize all keys of allSimData dict
-                    if gatherLFP and k == 'LFP':
-                        sim.allSimData[k] = np.zeros((gather[0]['simData']['LFP'].shape))
+                    if gatherLFP and k in ['LFP', 'LFPCSD']:
+                        sim.allSimData[k] = np.zeros((gather[0]['simData'][k].shape))
                     elif sim.cfg.recordDipoles and k == 'dipole':
                         for dk in sim.cfg.recordDipoles:
                             sim.allSimData[k][dk] = np.zeros(len(gather[0]['simData']['dipole'][dk]))
@@ -115,15 +125,18 @@ def gatherData(gatherLFP=True):
                                     if isinstance(val2,dict):
                                         sim.allSimData[key].update(Dict({key2:Dict()}))
                                         for stim,val3 in val2.items():
-                                            sim.allSimData[key][key2].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                            sim.allSimData[key][key2].update({stim:_vecToList(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
                                     elif key == 'dipole':
                                         sim.allSimData[key][key2] = np.add(sim.allSimData[key][key2],val2.as_numpy()) # add together dipole values from each node
                                     else:
-                                        sim.allSimData[key].update({key2:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                                        sim.allSimData[key].update({key2:_vecToArray(val2) if sim.cfg.traceMatrix else _vecToList(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
                             else:
                                 sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                        elif gatherLFP and key == 'LFP':
+                        elif gatherLFP and key in ['LFP', 'LFPCSD']:
                             sim.allSimData[key] += np.array(val)
+                        elif gatherLFP and key == 'LFPPops':  # add contributions of each population/group from each node
+                            for groupLabel, groupLFP in val.items():
+                                sim.allSimData[key][groupLabel] = np.add(sim.allSimData[key].get(groupLabel, 0), groupLFP)
                         elif key not in singleNodeVecs:
                             sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
 
@@ -155,8 +168,8 @@ def gatherData(gatherLFP=True):
                 sim.allSimData = Dict()
 
                 for k in list(gather[0]['simData'].keys()):  # initialize all keys of allSimData dict
-                    if gatherLFP and k == 'LFP':
-                        sim.allSimData[k] = np.zeros((gather[0]['simData']['LFP'].shape))
+                    if gatherLFP and k in ['LFP', 'LFPCSD']:
+                        sim.allSimData[k] = np.zeros((gather[0]['simData'][k].shape))
                     elif sim.cfg.recordDipoles and k == 'dipole':
                         for dk in sim.cfg.recordDipoles:
                             sim.allSimData[k][dk] = np.zeros(len(gather[0]['simData']['dipole'][dk]))
@@ -179,15 +192,18 @@ def gatherData(gatherLFP=True):
                                     if isinstance(val2,dict):
                                         sim.allSimData[key].update(Dict({key2:Dict()}))
                                         for stim,val3 in val2.items():
-                                            sim.allSimData[key][key2].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                            sim.allSimData[key][key2].update({stim:_vecToList(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
                                     elif key == 'dipole':
                                         sim.allSimData[key][key2] = np.add(sim.allSimData[key][key2],val2.as_numpy()) # add together dipole values from each node
                                     else:
-                                        sim.allSimData[key].update({key2:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                                        sim.allSimData[key].update({key2:_vecToArray(val2) if sim.cfg.traceMatrix else _vecToList(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
                             else:
                                 sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                        elif gatherLFP and key == 'LFP':
+                        elif gatherLFP and key in ['LFP', 'LFPCSD']:
                             sim.allSimData[key] += np.array(val)
+                        elif gatherLFP and key == 'LFPPops':  # add contributions of each population/group from each node
+                            for groupLabel, groupLFP in val.items():
+                                sim.allSimData[key][groupLabel] = np.add(sim.allSimData[key].get(groupLabel, 0), groupLFP)
                         elif key not in singleNodeVecs:
                             sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
 
@@ -229,14 +245,18 @@ def gatherData(gatherLFP=True):
                             if isinstance(val2,dict):
                                 sim.allSimData[key].update(Dict({cell:Dict()}))
                                 for stim,val3 in val2.items():
-                                    sim.allSimData[key][cell].update({stim:list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                    sim.allSimData[key][cell].update({stim:_vecToList(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
                             else:
-                                sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                                sim.allSimData[key].update({cell:_vecToArray(val2) if sim.cfg.traceMatrix else _vecToList(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
                     else:
                         sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
                 else:
                     sim.allSimData[key] = val           # update simData dicts which are not Vectors
 
+    # store traces of each variable as a matrix (cells x samples)
+    if sim.rank == 0 and sim.cfg.traceMatrix:
+        _tracesToMatrices(sim.allSimData, sim.cfg.recordTraces)
+
     ## Print statistics
     sim.pc.barrier()
     if sim.rank == 0:
@@ -373,16 +393,19 @@ def gatherDataFromFiles(gatherLFP=True, dataDir=None, fileName=None, sim=None):
                                     if isinstance(value2, dict):
                                         allSimData[key].update(Dict({key2: Dict()}))
                                         for stim, value3 in value2.items():
-                                            allSimData[key][key2].update({stim: list(value3)}) 
+                                            allSimData[key][key2].update({stim: _vecToList(value3)}) 
                                     elif key == 'dipole':
                                         allSimData[key][key2] = np.add(allSimData[key][key2], value2.as_numpy()) 
                                     else:
-                                        allSimData[key].update({key2: list(value2)})  
+                                        allSimData[key].update({key2: _vecToArray(value2) if sim.cfg.traceMatrix else _vecToList(value2)})  
                             else:
                                 allSimData[key] = list(allSimData[key]) + list(value)
 
-                        elif gatherLFP and key == 'LFP':
+                        elif gatherLFP and key in ['LFP', 'LFPCSD']:
                             allSimData[key] += np.array(value)
+                        elif gatherLFP and key == 'LFPPops':  # add contributions of each population/group from each node
+                            for groupLabel, groupLFP in value.items():
+                                allSimData[key][groupLabel] = np.add(allSimData[key].get(groupLabel, 0), groupLFP)
                         elif key not in singleNodeVecs:
                             allSimData[key].update(value)
 
@@ -399,6 +422,8 @@ def gatherDataFromFiles(gatherLFP=True, dataDir=None, fileName=None, sim=None):
                 allSimData['spkt'], allSimData['spkid'] = list(allSimData['spkt']), list(allSimData['spkid'])
 
             sim.allSimData = allSimData
+            if sim.cfg.traceMatrix:
+                _tracesToMatrices(sim.allSimData, sim.cfg.recordTraces)
             sim.net.allCells =  sorted(allCells, key=lambda k: k['gid'])
             for popLabel, pop in allPops.items():
                 pop['cellGids'] = sorted(allPopsCellGids[popLabel])
@@ -458,6 +483,92 @@ def gatherDataFromFiles(gatherLFP=True, dataDir=None, fileName=None, sim=None):
             sim.allSimData['avgRate'] = sim.firingRate 
 
 
+#------------------------------------------------------------------------------
+# Gather data saved asynchronously at intervals
+#------------------------------------------------------------------------------
+def gatherIntervalData(dataDir=None):
+    """
+    Function to gather the data saved by ``sim.intervalSaveAsync`` into ``sim.allSimData``
+
+    Reads the chunks appended to each node file listed in ``index.json`` and concatenates them in time order:
+    spikes are sorted, traces and stim spikes are joined per cell, and ``allWeights`` (if saved) are stored in
+    ``sim.allSimData['allWeights']``. Call after ``sim.gatherData()`` (which gathers the cells and any data
+    recorded after the last interval) to replace the recorded data with that of the full simulation.
+
+    Parameters
+    ----------
+    dataDir : str
+        Name of the directory where the interval data files are located.
+        **Default:** ``None`` uses ``cfg.intervalFolder`` if set, or ``<cfg.filename>_interval_data``.
+
+    """
+
+    from .. import sim
+    import json
+
+    if not dataDir:
+        dataDir = sim.cfg.intervalFolder if hasattr(sim.cfg, 'intervalFolder') else sim.cfg.filename + '_interval_data'
+
+    with open(os.path.join(dataDir, 'index.json'), 'r') as fileObj:
+        index = json.load(fileObj)
+
+    chunks = []
+    for fileName in index['files']:
+        with open(os.path.join(dataDir, fileName), 'rb') as fileObj:
+            while True:
+                try:
+                    chunks.append(pickle.load(fileObj))
+                except EOFError:
+                    break
+    chunks.sort(key=lambda chunk: (chunk['t'], chunk['rank']))
+
+    # include data recorded after the last interval (if already gathered)
+    if hasattr(sim, 'allSimData'):
+        chunks.append({'simData': {k: v for k, v in sim.allSimData.items()}})
+    else:
+        sim.allSimData = Dict()
+
+    arrays = {}
+    allWeights = []
+    for chunk in chunks:
+        for key, val in chunk['simData'].items():
+            if key in ['spkt', 'spkid', 't']:
+                arrays.setdefault(key, []).append(_vecToArray(val))
+            elif key == 'stims' or key in sim.cfg.recordTraces:
+                for cellLabel, cellVal in val.items():
+                    if isinstance(cellVal, dict):
+                        for k, v in cellVal.items():
+                            arrays.setdefault((key, cellLabel, k), []).append(_vecToArray(v))
+                    else:
+                        arrays.setdefault((key, cellLabel), []).append(_vecToArray(cellVal))
+        allWeights.extend(chunk.get('allWeights', []))
+
+    for key in set(key[0] for key in arrays if isinstance(key, tuple)):
+        sim.allSimData[key] = Dict()
+    for key, arrayList in arrays.items():
+        data = np.concatenate(arrayList)
+        if isinstance(key, tuple):
+            target = sim.allSimData[key[0]]
+            for k in key[1:-1]:
+                target = target.setdefault(k, Dict())
+            keepArray = sim.cfg.traceMatrix or sim._traceHasOptions(sim.cfg.recordTraces.get(key[0], {}))  # as gatherData
+            target[key[-1]] = data if keepArray else data.tolist()
+        else:
+            sim.allSimData[key] = data
+
+    if 'spkt' in arrays:
+        order = np.argsort(sim.allSimData['spkt'], kind='stable')
+        sim.allSimData['spkt'] = sim.allSimData['spkt'][order].tolist()
+        sim.allSimData['spkid'] = sim.allSimData['spkid'][order].tolist()
+    if allWeights:
+        sim.allSimData['allWeights'] = allWeights
+
+    if sim.cfg.traceMatrix:
+        _tracesToMatrices(sim.allSimData, sim.cfg.recordTraces)
+
+    return sim.allSimData
+
+
 #------------------------------------------------------------------------------
 # Gather tags from cells
 #------------------------------------------------------------------------------
@@ -567,3 +678,71 @@ def _aggregateDipoles ():
             for k, v in sim.cfg.recordDipoles.items():
                 if cell.tags['pop'] in v:
                     sim.simData['dipole'][k].add(cell.dipole['hRec'])
+
+
+#------------------------------------------------------------------------------
+# Restore spikes flushed to node file or ring buffer during the run
+#------------------------------------------------------------------------------
+def _restoreFlushedSpikes():
+    from .. import sim
+
+    if not getattr(sim, 'spikesFlush', None):
+        return
+
+    sim.flushSpikes()  # move remaining spikes
+    if 'buffer' in sim.spikesFlush:
+        buffer = sim.spikesFlush['buffer']
+        numSpikes = min(sim.spikesFlush['numSpikes'], len(buffer))
+        spikes = np.roll(buffer, -(sim.spikesFlush['numSpikes'] % len(buffer)), axis=0)[len(buffer)-numSpikes:]  # oldest first
+    else:
+        sim.spikesFlush['file'].close()
+        spikes = np.fromfile(sim.spikesFlush['fileName']).reshape(-1, 2)  # concatenated segments of this node
+
+    sim.simData['spkt'].from_python(spikes[:, 0])
+    sim.simData['spkid'].from_python(spikes[:, 1])
+    sim.spikesFlush = None
+
+
+#------------------------------------------------------------------------------
+# Convert recorded vector to list (processed traces are kept as numpy arrays)
+#------------------------------------------------------------------------------
+def _vecToList(vec):
+    return vec if isinstance(vec, np.ndarray) else list(vec)
+
+
+#------------------------------------------------------------------------------
+# Convert recorded trace vector to numpy array
+#------------------------------------------------------------------------------
+def _vecToArray(vec):
+    if isinstance(vec, np.ndarray):
+        return vec
+    return vec.as_numpy().copy() if hasattr(vec, 'as_numpy') else np.array(vec)
+
+
+#------------------------------------------------------------------------------
+# Convert dicts of cell traces to trace matrices (cells x samples)
+#------------------------------------------------------------------------------
+def _tracesToMatrices(allSimData, traceKeys):
+    """
+    Replaces the dict of traces ('cell_<gid>': trace) of each key in traceKeys with a TraceMatrix, if all cells
+    have a single 1D trace of the same length (eg. not for multiple synMechs per cell, adaptive time or snippets)
+    """
+
+    for key in traceKeys:
+        traces = allSimData.get(key)
+        if not traces or isinstance(traces, TraceMatrix):
+            continue
+        if not all(label.startswith('cell_') and label[5:].isdigit() for label in traces):
+            continue
+        rows = [np.asarray(trace) if not isinstance(trace, dict) else None for trace in traces.values()]
+        if any(row is None or row.ndim != 1 for row in rows) or len(set(len(row) for row in rows)) > 1:
+            continue
+
+        gids = sorted(int(label[5:]) for label in traces)
+        data = np.array([traces['cell_'+str(gid)] for gid in gids])
+        if 'traceTimes' in allSimData and key in allSimData['traceTimes']:
+            t = allSimData['traceTimes'][key]
+        else:
+            t = allSimData.get('t')
+            t = t if t is not None and len(t) == data.shape[1] else None
+        allSimData[key] = TraceMatrix(data, gids, t)
@@ -24,11 +24,13 @@ except NameError:
 from future import standard_library
 standard_library.install_aliases()
 import sys
+import numpy as np
 from collections import OrderedDict
 from ..specs import Dict, ODict
 from .. import specs
 from . import utils
 from . import setup
+from . import gather
 
 #------------------------------------------------------------------------------
 # Load data from file
@@ -269,8 +271,16 @@ def loadNet(filename, data=None, instantiate=True, compactConnFormat=False):
                     pop.cellGids = popLoad['cellGids']
                     sim.net.pops[popLoadLabel] = pop
                 for cellLoad in cellsNode:
+                    # create new PointCell (eg. VecStim, NetStim) with its params
+                    if 'params' in cellLoad and not cellLoad.get('secs'):
+                        tags = dict(cellLoad['tags'], params=dict(cellLoad['params']))
+                        cell = sim.PointCell(gid=cellLoad['gid'], tags=tags, create=False, associateGid=False)
+                        cell.conns = [Dict(conn) for conn in cellLoad.get('conns', [])]
+                        cell.stims = [Dict(stim) for stim in cellLoad.get('stims', [])]
+                        sim.net.cells.append(cell)
+                        continue
+
                     # create new CompartCell object and add attributes, but don't create sections or associate gid yet
-                    # TO DO: assumes CompartCell -- add condition to load PointCell
                     cell = sim.CompartCell(gid=cellLoad['gid'], tags=cellLoad['tags'], create=False, associateGid=False)
                     try:
                         if sim.cfg.saveCellSecs:
@@ -303,9 +313,18 @@ def loadNet(filename, data=None, instantiate=True, compactConnFormat=False):
                     if sim.cfg.verbose: print("  Adding NEURON objects...")
                     # create NEURON sections, mechs, syns, etc; and associate gid
                     for cell in sim.net.cells:
-                        prop = {'secs': cell.secs}
-                        cell.createNEURONObj(prop)  # use same syntax as when creating based on high-level specs
+                        if isinstance(cell, sim.PointCell):
+                            cell.createNEURONObj()
+                        else:
+                            prop = {'secs': cell.secs}
+                            cell.createNEURONObj(prop)  # use same syntax as when creating based on high-level specs
                         cell.associateGid()  # can only associate once the hSection obj has been created
+                    # generate or load VecStim spike trains for all cells of each pop at once (see Pop.createCells)
+                    for pop in sim.net.pops.values():
+                        popGids = set(pop.cellGids)
+                        popCells = [cell for cell in sim.net.cells if cell.gid in popGids]
+                        if popCells:
+                            pop._createVecStimTrains(popCells, min(popGids))
                     # create all NEURON Netcons, NetStims, etc
                     sim.pc.barrier()
                     for cell in sim.net.cells:
@@ -352,12 +371,297 @@ def loadSimData(filename, data=None):
     print('Loading simData...')
     if 'simData' in data:
         sim.allSimData = data['simData']
+        cfg = data['simConfig'] if 'simConfig' in data else getattr(getattr(sim, 'cfg', None), '__dict__', {})
+        if cfg.get('traceMatrix', False):
+            gather._tracesToMatrices(sim.allSimData, cfg.get('recordTraces', {}))  # files saved in JSON format
     else:
         print(('  simData not found in file %s'%(filename)))
 
     pass
 
 
+#------------------------------------------------------------------------------
+# Load weights recorded during the simulation
+#------------------------------------------------------------------------------
+def loadWeights(dataDir=None, mmap=False):
+    """
+    Function to load the synaptic weights recorded during the simulation (see ``cfg.recordWeights``)
+
+    Parameters
+    ----------
+    dataDir : str
+        Name of the directory with the per-node weights files.
+        **Default:** ``None`` uses ``<cfg.filename>_weights``.
+
+    mmap : bool
+        Whether to memory-map the node files instead of reading them (weights of each node are then kept separately
+        in a list, in the same order as ``'conns'``).
+        **Default:** ``False``
+
+    Returns
+    -------
+    Dict with ``'t'`` (snapshot times), ``'conns'`` (array with postGid, index in cell conns and preGid of each
+    column, sorted by postGid) and ``'weights'`` (float32 array of snapshots x connections)
+
+    """
+
+    import os
+    import numpy as np
+    from .. import sim
+
+    if not dataDir:
+        dataDir = sim.cfg.filename + '_weights'
+
+    nodeFiles = sorted([f for f in os.listdir(dataDir) if f.startswith('node_') and f.endswith('.bin')], key=lambda f: int(f[5:-4]))
+    times, conns, weights = None, [], []
+    for fileName in nodeFiles:
+        nodeConns = np.load(os.path.join(dataDir, fileName.replace('.bin', '_conns.npy')))
+        if times is None:
+            times = np.load(os.path.join(dataDir, fileName.replace('.bin', '_times.npy')))
+        if len(nodeConns) == 0:
+            continue
+        if mmap:
+            nodeWeights = np.memmap(os.path.join(dataDir, fileName), dtype=np.float32, mode='r').reshape(-1, len(nodeConns))
+        else:
+            nodeWeights = np.fromfile(os.path.join(dataDir, fileName), dtype=np.float32).reshape(-1, len(nodeConns))
+        conns.append(nodeConns)
+        weights.append(nodeWeights)
+
+    data = Dict({'t': times if times is not None else np.array([])})
+    if mmap:
+        data['conns'] = np.concatenate(conns) if conns else np.zeros((0, 3), dtype=np.int64)
+        data['weights'] = weights
+    elif conns:
+        allConns = np.concatenate(conns)
+        order = np.lexsort((allConns[:, 1], allConns[:, 0]))  # sort by postGid so independent of number of nodes
+        data['conns'] = allConns[order]
+        data['weights'] = np.concatenate(weights, axis=1)[:, order]
+    else:
+        data['conns'] = np.zeros((0, 3), dtype=np.int64)
+        data['weights'] = np.zeros((len(data['t']), 0), dtype=np.float32)
+
+    return data
+
+
+#------------------------------------------------------------------------------
+# Resume simulation from checkpoint
+#------------------------------------------------------------------------------
+def resume(path):
+    """
+    Function to restore the state of the simulation saved with ``sim.checkpoint(path)``
+
+    Must be called after creating the network identically (eg. ``sim.create(netParams, cfg)`` with the same
+    parameters; the number of nodes can differ). Initializes the simulation, restores the NEURON state of the
+    cells, the data recorded so far, stim randomizer positions and interval saving bookkeeping. The next call to
+    ``sim.runSim()`` or ``sim.runSimWithIntervalFunc()`` then continues from the checkpoint time until
+    ``cfg.duration``.
+
+    Parameters
+    ----------
+    path : str
+        Folder with the checkpoint files.
+        **Default:** *required*
+
+    """
+
+    import os, json, pickle
+    import numpy as np
+    from neuron import h
+    from .. import sim
+
+    with open(os.path.join(path, 'checkpoint.json'), 'r') as fileObj:
+        info = json.load(fileObj)
+
+    sim.preRun()
+    h.finitialize(float(sim.cfg.hParams['v_init']))
+
+    # NEURON state
+    if info['nhosts'] == sim.nhosts:
+        stateFile = os.path.join(path, 'state_%d.dat' % (sim.rank))
+    else:
+        stateFile = _composeStateFile(path, info['nhosts'])
+    h.BBSaveState().restore(stateFile)
+    h.frecord_init()  # restart recording vectors from the restored time
+
+    # restart periodic events (removed from the event queue on restore)
+    for enabled, handler in [(sim.rank == 0 and sim.cfg.printRunTime, 'printRunTime'), (sim.cfg.flushSpikesInterval, 'flushSpikesHandler'),
+                             (getattr(sim, 'tracesProcess', None), 'processTracesHandler'),
+                             (getattr(sim, 'weightsRecord', None), 'recordWeightsHandler'), (sim.cfg.recordLFP, 'recordLFPHandler')]:
+        if enabled:
+            getattr(sim, handler)()
+
+    # NetPyNE state (all node files if different number of nodes, keeping data of cells in this node)
+    ranks = [sim.rank] if info['nhosts'] == sim.nhosts else range(info['nhosts'])
+    states = []
+    for rank in ranks:
+        with open(os.path.join(path, 'netpyne_%d.pkl' % (rank)), 'rb') as fileObj:
+            states.append(pickle.load(fileObj))
+
+    # recording restarts with a sample at the restored time, which may already be the last saved sample
+    savedT = states[0]['simData'].get('t')
+    dropLast = abs(savedT[-1] - h.t) < sim.cfg.recordStep / 2.0 if savedT is not None and len(savedT) > 0 else None
+    recordKeys = ['t'] + list(sim.cfg.recordTraces.keys())
+
+    processedVecs = {(trace['key'], trace['gid'], trace['secLoc']): trace for trace in (getattr(sim, 'tracesProcess', None) or [])}
+    skipVecs = set(id(trace['vec']) for trace in processedVecs.values())
+    sumKeys = ['LFP', 'LFPCSD', 'LFPPops']  # partial sums of each node
+    for i, state in enumerate(states):
+        for key, val in state['simData'].items():
+            if key not in sim.simData:
+                sim.simData[key] = val
+            elif key in sumKeys and len(states) > 1:
+                if sim.rank == 0:
+                    _restoreCheckpointData(sim.simData, key, val, skipVecs, add=i > 0)
+            elif key in ['spkt', 'spkid']:
+                continue
+            elif key == 't' or not isinstance(val, dict) or key in sumKeys:
+                if i == 0:
+                    _restoreCheckpointData(sim.simData, key, val, skipVecs, dropLast=dropLast if key in recordKeys else False)
+            else:
+                for cellLabel, cellVal in val.items():
+                    if cellLabel in sim.simData[key]:  # only cells in this node
+                        _restoreCheckpointData(sim.simData[key], cellLabel, cellVal, skipVecs, dropLast=dropLast if key in recordKeys else False)
+
+        spikes = np.column_stack((state['simData']['spkt'], state['simData']['spkid']))
+        if 'spikesFlush' in state and 'spikes' in state['spikesFlush']:
+            spikes = np.concatenate((state['spikesFlush']['spikes'], spikes))
+        spikes = spikes[[int(gid) in sim.net.gid2lid for gid in spikes[:, 1]]]
+        if getattr(sim, 'spikesFlush', None) and 'buffer' in sim.spikesFlush and 'spikesFlush' in state and 'buffer' in state['spikesFlush']:
+            if info['nhosts'] == sim.nhosts:
+                sim.spikesFlush['buffer'][:] = state['spikesFlush']['buffer']
+                sim.spikesFlush['numSpikes'] = state['spikesFlush']['numSpikes']
+        if getattr(sim, 'spikesFlush', None) and sim.spikesFlush.get('file'):
+            spikes.tofile(sim.spikesFlush['file'])
+            sim.spikesFlush['numSpikes'] += len(spikes)
+        else:
+            for name, col in [('spkt', 0), ('spkid', 1)]:
+                sim.simData[name].from_python(np.concatenate((sim.simData[name].as_numpy(), spikes[:, col])))
+
+        for traceKey, traceState in state['tracesProcess'].items():
+            if traceKey in processedVecs:
+                trace = processedVecs[traceKey]
+                trace.update({k: v for k, v in traceState.items() if k != 'vec'})
+                trace['vec'].from_python(np.concatenate((traceState['vec'], trace['vec'].as_numpy())))
+                numSamples = trace['carryStart'] + len(trace['carry']) + len(traceState['vec'])
+                trace['skipFirst'] = numSamples > int(round(h.t / sim.cfg.recordStep))  # sample at restored time already processed
+
+        for randKey, seq in state['randomizers'].items():
+            rand = _getStimRandomizer(randKey)
+            if rand is not None:
+                rand.seq(seq)
+
+        if 'weightsRecord' in state and getattr(sim, 'weightsRecord', None) and state['weightsRecord']['weights'] is not None:
+            record = sim.weightsRecord
+            columns = {(gid, iconn): icol for icol, (gid, iconn, preGid) in enumerate(record['conns'])}
+            saved = [(icol, columns.get((gid, iconn))) for icol, (gid, iconn, preGid) in enumerate(state['weightsRecord']['conns'])]
+            saved = [(icol, newcol) for icol, newcol in saved if newcol is not None]
+            if i == 0:
+                record['times'] = list(state['weightsRecord']['times'])
+                record['restored'] = np.zeros((len(record['times']), len(record['conns'])), dtype=np.float32)
+            if saved:
+                savedCols, newCols = zip(*saved)
+                record['restored'][:, list(newCols)] = state['weightsRecord']['weights'][:, list(savedCols)]
+
+        if 'intervalSaveInfo' in state and state['rank'] == 0:
+            sim.intervalSaveInfo = state['intervalSaveInfo']
+        if 'allWeights' in state and info['nhosts'] == sim.nhosts:
+            sim.allWeights = state['allWeights']
+
+    if len(states) > 1 and not (getattr(sim, 'spikesFlush', None) and sim.spikesFlush.get('file')):
+        order = np.argsort(sim.simData['spkt'].as_numpy(), kind='stable')
+        for name in ['spkt', 'spkid']:
+            sim.simData[name].from_python(sim.simData[name].as_numpy()[order])
+
+    if getattr(sim, 'weightsRecord', None) and 'restored' in sim.weightsRecord:
+        sim.weightsRecord.pop('restored').tofile(sim.weightsRecord['file'])  # snapshots before the checkpoint
+
+    sim.resumed = True  # next run continues from restored state
+    if sim.rank == 0:
+        print(('  Resumed from checkpoint at t = %0.1f ms (saved with %d nodes)' % (h.t, info['nhosts'])))
+
+
+def _restoreCheckpointData(target, key, saved, skipVecs, add=False, dropLast=False):
+    current = target[key]
+    if isinstance(current, dict) and isinstance(saved, dict):
+        for k, v in saved.items():
+            if k in current:
+                _restoreCheckpointData(current, k, v, skipVecs, add, dropLast)
+            else:
+                current[k] = v
+    elif hasattr(current, 'as_numpy'):
+        if id(current) not in skipVecs and saved is not None:
+            if dropLast is None:  # time not recorded
+                from neuron import h
+                from .. import sim
+                dropLast = len(saved) > int(round(h.t / sim.cfg.recordStep))
+            current.from_python(np.concatenate((saved[:-1] if dropLast and len(saved) else saved, current.as_numpy())))
+    elif add:
+        target[key] = current + saved
+    else:
+        target[key] = saved
+
+
+def _getStimRandomizer(randKey):
+    from .. import sim
+
+    if randKey[0] == 'pool':
+        pool = getattr(sim.net, 'stimPools', {}).get(randKey[1])
+        poolStim = pool['netStims'].get(randKey[2]) if pool else None
+        return poolStim['hRandom'] if poolStim else None
+    if randKey[1] not in sim.net.gid2lid:
+        return None
+    cell = sim.net.cells[sim.net.gid2lid[randKey[1]]]
+    if randKey[0] == 'cell':
+        return getattr(cell, 'hRandom', None)
+    return cell.stims[randKey[2]].get('hRandom') if randKey[2] < len(cell.stims) else None
+
+
+def _composeStateFile(path, savedNhosts):
+    """
+    Writes the BBSaveState file of this node from the cell blocks of the checkpoint files saved with a different
+    number of nodes, in the order in which the cells of this node are read on restore
+    """
+
+    import os
+    from neuron import h
+    from .. import sim
+
+    orderFile = os.path.join(path, 'order_%d_%d.tmp' % (sim.nhosts, sim.rank))
+    h.BBSaveState().save(orderFile)
+    _, blocks = _readStateBlocks(orderFile)
+    order = list(blocks.keys())
+    os.remove(orderFile)
+
+    savedBlocks = {}
+    for rank in range(savedNhosts):
+        savedHeader, rankBlocks = _readStateBlocks(os.path.join(path, 'state_%d.dat' % (rank)))
+        savedBlocks.update({gid: block for gid, block in rankBlocks.items() if gid in blocks})
+
+    stateFile = os.path.join(path, 'state_%d_of_%d.dat' % (sim.rank, sim.nhosts))
+    with open(stateFile, 'w') as fileObj:
+        fileObj.write('\n'.join(savedHeader + [line for gid in order for line in savedBlocks[gid]]) + '\n')
+    return stateFile
+
+
+def _readStateBlocks(fileName):
+    from collections import OrderedDict
+
+    with open(fileName, 'r') as fileObj:
+        lines = fileObj.read().split('\n')
+    header, blocks, block = [], OrderedDict(), None
+    for line in lines:
+        if line == 'begin cell':
+            block = [line]
+        elif block is not None:
+            block.append(line)
+            if line == 'end cell':
+                blocks[int(block[1])] = block
+                block = None
+        elif not blocks and line:
+            header.append(line)
+    return header, blocks
+
+
 #------------------------------------------------------------------------------
 # Load all data in file
 #------------------------------------------------------------------------------
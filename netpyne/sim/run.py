@@ -93,6 +93,40 @@ def preRun():
                     if not isinstance(stim['hObj'].noiseFromRandom, dict):
                         stim['hObj'].noiseFromRandom(stim['hRandom'])
 
+    # reset randomizers of pooled NetStims (seeded by pool index so independent of post cells and num of nodes)
+    for pool in getattr(sim.net, 'stimPools', {}).values():
+        for poolIndex, poolStim in pool['netStims'].items():
+            utils._init_stim_randomizer(poolStim['hRandom'], 'NetStimPool_'+pool['source'], poolIndex, pool['seed'])
+            poolStim['hRandom'].negexp(1)
+            poolStim['hObj'].noiseFromRandom(poolStim['hRandom'])
+
+    # handler for moving recorded spikes to file or ring buffer
+    if sim.cfg.flushSpikesInterval:
+        def flushSpikesHandler():
+            sim.cvode.event(h.t + float(sim.cfg.flushSpikesInterval), sim.flushSpikes)
+            sim.cvode.event(h.t + float(sim.cfg.flushSpikesInterval), flushSpikesHandler)
+
+        sim.flushSpikesHandler = flushSpikesHandler
+        sim.fih.append(h.FInitializeHandler(0, sim.flushSpikesHandler))
+
+    # handler for processing traces recorded with options (dtype, decimate, envelope, timeWindows, snippets)
+    if getattr(sim, 'tracesProcess', None):
+        def processTracesHandler():
+            sim.cvode.event(h.t + float(sim.cfg.processTracesInterval), sim.processTraces)
+            sim.cvode.event(h.t + float(sim.cfg.processTracesInterval), processTracesHandler)
+
+        sim.processTracesHandler = processTracesHandler
+        sim.fih.append(h.FInitializeHandler(0, sim.processTracesHandler))
+
+    # handler for recording synaptic weights
+    if getattr(sim, 'weightsRecord', None):
+        def recordWeightsHandler():
+            sim.cvode.event(h.t + float(sim.cfg.recordWeightsStep), sim.recordWeights)
+            sim.cvode.event(h.t + float(sim.cfg.recordWeightsStep), recordWeightsHandler)
+
+        sim.recordWeightsHandler = recordWeightsHandler
+        sim.fih.append(h.FInitializeHandler(0, sim.recordWeightsHandler))
+
     # handler for recording LFP
     if sim.cfg.recordLFP:
         def recordLFPHandler():
@@ -100,6 +134,9 @@ def preRun():
             sim.cvode.event(h.t + float(sim.cfg.recordStep), recordLFPHandler)
 
         sim.recordLFPHandler = recordLFPHandler
+        if sim.cfg.createNEURONObj:
+            from .setup import setImembPtrs
+            sim.fih.append(h.FInitializeHandler(0, setImembPtrs))  # point to i_membrane_ once per run (not every step)
         sim.fih.append(h.FInitializeHandler(0, sim.recordLFPHandler))  # initialize imemb
 
 
@@ -135,13 +172,23 @@ def runSim(skipPreRun=False):
     sim.pc.barrier()
     sim.timing('start', 'runTime')
 
-    if not skipPreRun:
-        preRun()
-
-    h.finitialize(float(sim.cfg.hParams['v_init']))
+    if getattr(sim, 'resumed', False):  # continue from state restored by sim.resume()
+        sim.resumed = False
+    else:
+        if not skipPreRun:
+            preRun()
+        h.finitialize(float(sim.cfg.hParams['v_init']))
 
     if sim.rank == 0: print('\nRunning simulation for %s ms...'%sim.cfg.duration)
-    sim.pc.psolve(sim.cfg.duration)
+    progressInterval = sim.cfg.batchResult.get('progressInterval') if isinstance(sim.cfg.batchResult, dict) else None
+    if progressInterval:  # batch optimization job reporting intermediate metrics (see sim.saveBatchProgress)
+        while sim.cfg.duration - h.t > h.dt/2:
+            sim.pc.psolve(min(sim.cfg.duration, h.t+progressInterval))
+            if sim.saveBatchProgress():
+                if sim.rank == 0: print('  Simulation stopped early by batch process (pruned) at t = %0.1f ms' % (h.t))
+                break
+    else:
+        sim.pc.psolve(sim.cfg.duration)
 
     sim.pc.barrier() # Wait for all hosts to get to this point
     sim.timing('stop', 'runTime')
@@ -174,8 +221,11 @@ def runSimWithIntervalFunc(interval, func):
     from .. import sim
     sim.pc.barrier()
     sim.timing('start', 'runTime')
-    preRun()
-    h.finitialize(float(sim.cfg.hParams['v_init']))
+    if getattr(sim, 'resumed', False):  # continue from state restored by sim.resume()
+        sim.resumed = False
+    else:
+        preRun()
+        h.finitialize(float(sim.cfg.hParams['v_init']))
 
     if sim.rank == 0: print('\nRunning with interval func  ...')
 
@@ -183,6 +233,8 @@ def runSimWithIntervalFunc(interval, func):
         sim.pc.psolve(min(sim.cfg.duration, h.t+interval))
         func(h.t) # function to be called at intervals
 
+    sim.stopIntervalSaveAsync()  # wait for data saved with intervalSaveAsync (if any) to be written
+
     sim.pc.barrier() # Wait for all hosts to get to this point
     sim.timing('stop', 'runTime')
     if sim.rank==0:
@@ -190,6 +242,155 @@ def runSimWithIntervalFunc(interval, func):
             (sim.timingData['runTime'], sim.cfg.duration/1000/sim.timingData['runTime'])))
 
 
+#------------------------------------------------------------------------------
+# Run simulation until t0 and continue branches in forked processes
+#------------------------------------------------------------------------------
+def runBranches(branches, t0, maxProcs=None, saveData=False):
+    """
+    Runs the simulation until t0 (shared warm-up) and then continues it until cfg.duration in one forked
+    (copy-on-write) process per branch, so the network is built and the warm-up is simulated only once.
+    Each branch is a dict with the params to pass to the network modify methods, e.g.
+    {'modifyStims': {'conds': {...}, 'cellConds': {...}}, 'modifyConns': [{...}, {...}]}, or a function
+    called without arguments in the child process before continuing. Only available when running on a single node.
+    Returns a dict with the gathered simulation data (allSimData) of each branch.
+
+    Parameters
+    ----------
+    branches : dict or list
+        Branches to run, as a dict with labels as keys or a list (labels are then the list indices)
+        **Default:** *required*
+
+    t0 : float
+        Time (ms) until which the shared simulation is run before branching
+        **Default:** *required*
+
+    maxProcs : int
+        Maximum number of branches running at the same time
+        **Default:** ``None`` uses the number of CPUs
+
+    saveData : bool
+        Whether each branch also saves its data (with the branch label appended to cfg.filename)
+        **Default:** ``False``
+
+
+    """
+
+    import os, pickle, tempfile, traceback, multiprocessing
+    from .. import sim
+
+    if sim.nhosts > 1:
+        print('Error: runBranches can only be used when running on a single node')
+        return None
+    if not hasattr(os, 'fork'):
+        print('Error: runBranches requires os.fork, which is not available in this platform')
+        return None
+
+    if not isinstance(branches, dict):
+        branches = {i: branch for i, branch in enumerate(branches)}
+    maxProcs = maxProcs or multiprocessing.cpu_count() or 1
+
+    sim.timing('start', 'runTime')
+    if getattr(sim, 'resumed', False):  # continue from state restored by sim.resume()
+        sim.resumed = False
+    else:
+        preRun()
+        h.finitialize(float(sim.cfg.hParams['v_init']))
+
+    print('\nRunning simulation until branching time %s ms...' % t0)
+    sim.pc.psolve(t0)
+    sim.stopIntervalSaveAsync()  # make sure data saved with intervalSaveAsync (if any) is written before forking
+    sim.flushWeights()
+
+    print('Running %d branches until %s ms...' % (len(branches), sim.cfg.duration))
+    resultsFolder = tempfile.mkdtemp(prefix='netpyne_branches_')
+    running = {}
+    failed = []
+    for ibranch, (label, branch) in enumerate(branches.items()):
+        while len(running) >= maxProcs:
+            pid, status = os.wait()
+            if status != 0: failed.append(running[pid])
+            running.pop(pid, None)
+
+        resultsFile = os.path.join(resultsFolder, 'branch_%d.pkl' % ibranch)
+        pid = os.fork()
+        if pid == 0:  # child process: apply branch changes, continue simulation and store results
+            exitCode = 1
+            try:
+                _runBranch(label, branch, resultsFile, saveData)
+                exitCode = 0
+            except Exception:
+                traceback.print_exc()
+            finally:
+                os._exit(exitCode)
+        running[pid] = label
+
+    while running:
+        pid, status = os.wait()
+        if status != 0: failed.append(running[pid])
+        running.pop(pid, None)
+
+    branchesData = {}
+    for ibranch, label in enumerate(branches):
+        resultsFile = os.path.join(resultsFolder, 'branch_%d.pkl' % ibranch)
+        if label not in failed and os.path.exists(resultsFile):
+            with open(resultsFile, 'rb') as fileObj:
+                branchesData[label] = pickle.load(fileObj)
+            os.remove(resultsFile)
+        else:
+            print('Error: branch %s failed' % (str(label)))
+    os.rmdir(resultsFolder)
+
+    sim.timing('stop', 'runTime')
+    print('  Done; run time (warm-up + %d branches) = %0.2f s.' % (len(branches), sim.timingData['runTime']))
+
+    return branchesData
+
+
+def _runBranch(label, branch, resultsFile, saveData):
+
+    import os, pickle, shutil
+    from .. import sim
+
+    # outputs of the branch are saved with the branch label appended to the filename
+    sim.cfg.filename = '%s_%s' % (sim.cfg.filename, str(label))
+    sim.cfg.simLabel = '%s_%s' % (sim.cfg.simLabel, str(label)) if sim.cfg.simLabel else str(label)
+    sim.intervalSaveInfo = None
+
+    # copy node files with spikes or weights recorded during the warm-up, since the parent file handles are shared
+    for record, folderSuffix, extraFiles in [(getattr(sim, 'spikesFlush', None), '_spikes', []),
+                                             (getattr(sim, 'weightsRecord', None), '_weights', ['_conns.npy'])]:
+        if not record or not record.get('file'):
+            continue
+        folder = sim.cfg.filename + folderSuffix
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        fileName = os.path.join(folder, os.path.basename(record['fileName']))
+        for suffix in extraFiles:
+            shutil.copyfile(record['fileName'].replace('.bin', suffix), fileName.replace('.bin', suffix))
+        shutil.copyfile(record['fileName'], fileName)
+        record['fileName'] = fileName
+        record['file'] = open(fileName, 'ab')
+
+    if callable(branch):
+        branch()
+    else:
+        for method, params in branch.items():
+            if method not in ['modifyCells', 'modifySynMechs', 'modifyConns', 'modifyStims']:
+                print('Error: branch %s: %s is not a valid network modify method' % (str(label), method))
+                continue
+            for methodParams in (params if isinstance(params, list) else [params]):
+                getattr(sim.net, method)(methodParams)
+
+    sim.pc.psolve(sim.cfg.duration)
+    sim.timing('stop', 'runTime')
+    sim.gatherData()
+    if saveData:
+        sim.saveData()
+
+    with open(resultsFile, 'wb') as fileObj:
+        pickle.dump(sim.allSimData, fileObj)
+
+
 #------------------------------------------------------------------------------
 # Calculate LFP (fucntion called at every time step)
 #------------------------------------------------------------------------------
@@ -203,24 +404,239 @@ def calculateLFP():
 
     from .. import sim
 
-    # Set pointers to i_membrane in each cell (required form LFP calc )
-    for cell in sim.net.compartCells:
-        cell.setImembPtr()
+    # gather i_membrane_ of all segments in node (pointers set in setupRecordLFP and updated via ptr_update_callback)
+    sim.net._lfpImembPtr.gather(sim.net._lfpImembVec)
+    im = sim.net._lfpImembVec.as_numpy()  # in nA
+    tr = sim.net.recXElectrode.transferMatrix  # in MOhm
 
     # compute
-    saveStep = int(np.floor(h.t / sim.cfg.recordStep))
-    for cell in sim.net.compartCells: # compute ecp only from the biophysical cells
-        gid = cell.gid
-        im = cell.getImemb() # in nA
-        tr = sim.net.recXElectrode.getTransferResistance(gid)  # in MOhm
-        ecp = np.dot(tr, im)  # in mV (= R * I = MOhm * nA)
+    saveStep = int(round(h.t / sim.cfg.recordStep))  # round since event times may accumulate floating point error
+    sim.simData['LFP'][saveStep - 1,:] += tr.dot(im.astype(tr.dtype, copy=False))  # sum of all cells, in mV (= R * I = MOhm * nA)
+
+    # contribution of each population or group of cells (stored optionally)
+    if sim.cfg.saveLFPPops:
+        for groupLabel, groupRanges in sim.net._lfpGroupRanges.items():
+            lfpGroup = sim.simData['LFPPops'][groupLabel][saveStep - 1,:]
+            for start, end in groupRanges:
+                lfpGroup += tr[:, start:end].dot(im[start:end])
+
+    # CSD (second spatial derivative along electrodes, with Vaknin correction); linear in LFP so node contributions can be summed
+    if sim.cfg.saveLFPCSD:
+        lfp = sim.simData['LFP'][saveStep - 1,:]
+        sim.simData['LFPCSD'][saveStep - 1,:] = -np.diff(np.concatenate((lfp[:1], lfp, lfp[-1:])), n=2) / sim.net._lfpCSDSpacing**2
+
+    # contribution of individual cells (stored optionally)
+    if sim.cfg.saveLFPCells:
+        for gid, lfpCell in sim.simData['LFPCells'].items():
+            if gid in sim.net.recXElectrode.segRanges:
+                start, end = sim.net.recXElectrode.segRanges[gid]
+                lfpCell[saveStep - 1,:] = tr[:, start:end].dot(im[start:end])
+
+
+#------------------------------------------------------------------------------
+# Move recorded spikes to node file or ring buffer (function called at intervals)
+#------------------------------------------------------------------------------
+def flushSpikes():
+    """
+    Moves the spikes recorded since the last call from the spkt/spkid NEURON vectors to the node append-only
+    binary file (pairs of float64 spike time and gid) or, if cfg.spikesRingBufferSize is set, to a ring buffer
+    that keeps only the most recent spikes. Memory used by spike recording is then bounded during the run.
+    """
+
+    from .. import sim
+
+    spkt = sim.simData['spkt'].as_numpy()
+    numSpikes = len(spkt)
+    if numSpikes == 0 or not getattr(sim, 'spikesFlush', None):
+        return
+
+    spikes = np.column_stack((spkt, sim.simData['spkid'].as_numpy()))
+    if 'buffer' in sim.spikesFlush:
+        buffer = sim.spikesFlush['buffer']
+        spikes = spikes[-len(buffer):]
+        inds = (sim.spikesFlush['numSpikes'] + numSpikes - len(spikes) + np.arange(len(spikes))) % len(buffer)
+        buffer[inds] = spikes
+    elif sim.spikesFlush.get('file'):
+        spikes.tofile(sim.spikesFlush['file'])
+        sim.spikesFlush['file'].flush()
+
+    sim.spikesFlush['numSpikes'] += numSpikes
+    sim.simData['spkt'].resize(0)
+    sim.simData['spkid'].resize(0)
+
+
+#------------------------------------------------------------------------------
+# Process traces recorded with options (function called at intervals)
+#------------------------------------------------------------------------------
+def processTraces(final=False):
+    """
+    Moves the samples recorded since the last call from the NEURON vectors of traces with recording options
+    ('dtype', 'decimate', 'envelope', 'timeWindows' or 'snippets' in cfg.recordTraces) to compact numpy chunks,
+    so memory used by these traces is bounded by the processing interval (cfg.processTracesInterval).
+    If final is True, the chunks are concatenated and stored in sim.simData.
+    """
+
+    from .. import sim
+
+    if not getattr(sim, 'tracesProcess', None):
+        return
+
+    for trace in sim.tracesProcess:
+        _processTrace(trace, final)
+
+    if final:
+        for trace in sim.tracesProcess:
+            params, cellLabel = trace['params'], 'cell_'+str(trace['gid'])
+            dtype = params.get('dtype', 'float64')
+            if 'snippets' in params:
+                snippetLen = len(sim.simData['traceTimes'][trace['key']])
+                data = np.array(trace['chunks'], dtype=dtype).reshape(-1, snippetLen)  # num snippets x snippet samples
+                label = trace['key'] if trace['secLoc'] is None else trace['key']+'_'+trace['secLoc']
+                sim.simData['snippetTimes'][cellLabel][label] = trace['snippetTimes']
+            else:
+                data = np.concatenate(trace['chunks']).astype(dtype) if trace['chunks'] else np.array([], dtype=dtype)
+
+            if trace['secLoc'] is None:
+                sim.simData[trace['key']][cellLabel] = data
+            else:
+                sim.simData[trace['key']][cellLabel][trace['secLoc']] = data
+        sim.tracesProcess = None
+
+
+def _processTrace(trace, final=False):
+    from .. import sim
+
+    params = trace['params']
+    recordStep = sim.cfg.recordStep
+    dtype = params.get('dtype', 'float64')
+
+    vec = trace['vec'].as_numpy()
+    if trace.pop('skipFirst', False):  # sample at time restored by sim.resume() was already processed
+        vec = vec[1:]
+    x = np.concatenate((trace['carry'], vec))  # unprocessed samples
+    trace['vec'].resize(0)
+    start = trace['carryStart']
+    idx = start + np.arange(len(x))  # sample indices since start of simulation
+
+    inWindows = np.ones(len(x), dtype=bool)
+    if params.get('timeWindows'):
+        inWindows[:] = False
+        for t0, t1 in params['timeWindows']:
+            inWindows |= (idx*recordStep >= t0) & (idx*recordStep <= t1)
+
+    if 'snippets' in params:  # segments around upward threshold crossings (eg. spikes)
+        threshold = params['snippets'].get('threshold', sim.net.params.defaultThreshold)
+        window = params['snippets'].get('window', [-2, 5])
+        pre, post = int(round(-window[0]/recordStep)), int(round(window[1]/recordStep))
+        crossings = np.nonzero((x[:-1] < threshold) & (x[1:] >= threshold))[0] + 1
+        crossings = crossings[(idx[crossings] > trace['lastCrossing']) & inWindows[crossings] & (crossings >= pre)]
+        complete = crossings[crossings + post < len(x)]
+        for p in complete:
+            trace['chunks'].append(x[p-pre:p+post+1].astype(dtype))
+            trace['snippetTimes'].append(idx[p]*recordStep)
+        if len(complete):
+            trace['lastCrossing'] = idx[complete[-1]]
+        keep = 0 if final else min(len(x), pre+post+1)  # keep samples needed for crossings at the end of this chunk
+        done = np.arange(len(x)) < len(x) - keep
+
+    elif params.get('envelope'):  # min and max of every block of n samples
+        n = int(params['envelope'])
+        blocks = idx // n
+        done = np.ones(len(x), dtype=bool) if final else blocks < (start + len(x)) // n  # only complete blocks
+        xs, bs = x[done & inWindows], blocks[done & inWindows]
+        if len(xs):
+            blockStarts = np.concatenate(([0], np.nonzero(np.diff(bs))[0] + 1))
+            envelope = np.column_stack((np.minimum.reduceat(xs, blockStarts), np.maximum.reduceat(xs, blockStarts)))
+            trace['chunks'].append(envelope.ravel().astype(dtype))
+
+    else:
+        done = np.ones(len(x), dtype=bool)
+        keep = inWindows
+        if params.get('decimate'):
+            keep = keep & (idx % int(params['decimate']) == 0)
+        trace['chunks'].append(x[keep].astype(dtype))
+
+    trace['carry'] = x[~done]
+    trace['carryStart'] = start + int(np.count_nonzero(done))
+
+
+def _traceHasOptions(params):
+    return any(option in params for option in ['dtype', 'decimate', 'envelope', 'timeWindows', 'snippets'])
+
 
-        if sim.cfg.saveLFPCells:
-            sim.simData['LFPCells'][gid][saveStep - 1,:] = ecp  # contribution of individual cells (stored optionally)
+#------------------------------------------------------------------------------
+# Sample times of traces recorded with options (shared by all cells)
+#------------------------------------------------------------------------------
+def _traceTimes(params, recordStep=None):
+    from .. import sim
+
+    recordStep = recordStep or sim.cfg.recordStep
+    if 'snippets' in params:  # times relative to threshold crossing
+        window = params['snippets'].get('window', [-2, 5])
+        return np.arange(-int(round(-window[0]/recordStep)), int(round(window[1]/recordStep))+1) * recordStep
+
+    idx = np.arange(int(round(sim.cfg.duration/recordStep)) + 1)
+    inWindows = np.ones(len(idx), dtype=bool)
+    if params.get('timeWindows'):
+        inWindows[:] = False
+        for t0, t1 in params['timeWindows']:
+            inWindows |= (idx*recordStep >= t0) & (idx*recordStep <= t1)
+
+    if params.get('envelope'):
+        n = int(params['envelope'])
+        blocks = np.unique(idx[inWindows] // n)
+        return np.repeat(blocks * n * recordStep, 2)  # min and max of each block
+    if params.get('decimate'):
+        inWindows &= (idx % int(params['decimate']) == 0)
+    return idx[inWindows] * recordStep
+
+
+#------------------------------------------------------------------------------
+# Record snapshot of synaptic weights
+#------------------------------------------------------------------------------
+def recordWeights():
+    """
+    Copies the current value of the recorded weights of this node (see cfg.recordWeights) into the next row of the
+    float32 snapshot buffer with a single PtrVector gather, and appends the buffer to the node file when full.
+    """
+
+    from .. import sim
+
+    record = getattr(sim, 'weightsRecord', None)
+    if not record:
+        return
+
+    record['ptrVec'].gather(record['vec'])
+    record['buffer'][record['numBuffered']] = record['vec'].as_numpy()[:len(record['conns'])]
+    record['numBuffered'] += 1
+    record['times'].append(h.t)
+    if record['numBuffered'] == len(record['buffer']):
+        flushWeights()
+
+
+#------------------------------------------------------------------------------
+# Append weight snapshots to node file
+#------------------------------------------------------------------------------
+def flushWeights(final=False):
+    """
+    Appends the weight snapshots in the buffer to the node file (<filename>_weights/node_<rank>.bin). If final,
+    also closes the file and saves the snapshot times (node_<rank>_times.npy); load with sim.loadWeights().
+    """
+
+    from .. import sim
 
-        sim.simData['LFP'][saveStep - 1,:] += ecp  # sum of all cells
+    record = getattr(sim, 'weightsRecord', None)
+    if not record or not record.get('file'):
+        return
 
+    record['buffer'][:record['numBuffered']].tofile(record['file'])
+    record['file'].flush()
+    record['numBuffered'] = 0
 
+    if final:
+        record['file'].close()
+        record['file'] = None
+        np.save(record['fileName'].replace('.bin', '_times.npy'), np.array(record['times']))
 
 
 #------------------------------------------------------------------------------
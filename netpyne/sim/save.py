@@ -23,9 +23,13 @@ import os
 from time import time
 from datetime import datetime
 import pickle as pk
+from neuron import h
 from . import gather
 from . import utils
 
+# rename replacing the destination file atomically (os.rename in Python 2, which also replaces it in POSIX systems)
+_replaceFile = getattr(os, 'replace', os.rename)
+
 
 #------------------------------------------------------------------------------
 # Save JSON (Python 2/3 compatible)
@@ -142,6 +146,10 @@ def saveData(include=None, filename=None):
         if 'simData' in include:
             if 'LFP' in sim.allSimData:
                 sim.allSimData['LFP'] = sim.allSimData['LFP'].tolist()
+            if 'LFPCSD' in sim.allSimData:
+                sim.allSimData['LFPCSD'] = sim.allSimData['LFPCSD'].tolist()
+            if 'LFPPops' in sim.allSimData:
+                sim.allSimData['LFPPops'] = {k: v.tolist() for k,v in sim.allSimData['LFPPops'].items()}
             dataSave['simData'] = sim.allSimData
 
 
@@ -218,6 +226,15 @@ def saveData(include=None, filename=None):
 
                 print('Finished saving!')
 
+            # Save result for batch optimization (after the output files, so these are complete)
+            if sim.cfg.batchResult:
+                saveBatchResult()
+
+            # Save summary of results to the batch results store, with the paths of the output files
+            if sim.cfg.resultsStore:
+                saveResultsStore({ext: filePath+'.'+ext for ext, save in [('pkl', sim.cfg.savePickle), ('json', sim.cfg.saveJson),
+                                  ('mat', sim.cfg.saveMat), ('hdf5', sim.cfg.saveHDF5)] if save})
+
             # Save timing
             if sim.cfg.timing:
                 sim.timing('stop', 'saveTime')
@@ -238,6 +255,136 @@ def saveData(include=None, filename=None):
 
         else:
             print('Nothing to save')
+            if sim.cfg.batchResult:
+                saveBatchResult()
+            if sim.cfg.resultsStore:
+                saveResultsStore()
+
+
+#------------------------------------------------------------------------------
+# Save result of batch optimization job
+#------------------------------------------------------------------------------
+def saveBatchResult():
+    """
+    Saves the gathered simData keys needed by the fitness function of a batch optimization (cfg.batchResult['include'];
+    all if None) to a small pickle file (cfg.batchResult['file']), written to a temporary file and renamed so it is
+    never read partially written. Then notifies the batch process via its Unix datagram socket (cfg.batchResult['socket']),
+    if available. Called by sim.saveData(); job scripts that do not save data can call it directly.
+    """
+
+    from .. import sim
+    import socket
+
+    if sim.rank != 0 or not sim.cfg.batchResult:
+        return
+
+    resultFile = sim.cfg.batchResult['file']
+    include = sim.cfg.batchResult.get('include')
+    simData = {k: v for k, v in sim.allSimData.items() if include is None or k in include}
+
+    with open(resultFile + '.tmp', 'wb') as fileObj:
+        pk.dump({'simData': simData}, fileObj, protocol=pk.HIGHEST_PROTOCOL)
+    _replaceFile(resultFile + '.tmp', resultFile)
+
+    if sim.cfg.batchResult.get('socket') and hasattr(socket, 'AF_UNIX'):
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.sendto(resultFile.encode('utf-8'), sim.cfg.batchResult['socket'])
+            sock.close()
+        except (IOError, OSError):  # batch process not reachable (eg. job running in other machine; socket.error in Python 2); it will find the file
+            pass
+
+
+#------------------------------------------------------------------------------
+# Save intermediate metrics of a batch optimization job
+#------------------------------------------------------------------------------
+def saveBatchProgress():
+    """
+    Saves intermediate metrics of a running batch optimization job (simulated time 't', 'popRates' and 'avgRate' in Hz
+    since the start of the simulation) to cfg.batchResult['progressFile'], written to a temporary file and renamed, so
+    the batch process can decide to stop the job early (prune it). Called by sim.runSim() every
+    cfg.batchResult['progressInterval'] ms; must be called by all ranks. Returns True (in all ranks) if the batch process
+    requested to stop the job (ie. created the file cfg.batchResult['stopFile']).
+
+    Spikes already moved out of memory (eg. cfg.flushSpikesInterval) are not included in the rates.
+    """
+
+    from .. import sim
+    import numpy as np
+
+    pops = list(sim.net.pops.keys())
+    popIndex = np.full(sim.net.lastGid, -1, dtype=int)
+    numCells = np.zeros(len(pops))
+    for ipop, pop in enumerate(sim.net.pops.values()):
+        popIndex[pop.cellGids] = ipop
+        numCells[ipop] = len(pop.cellGids)
+
+    spkid = np.array(sim.simData['spkid'], dtype=int) if 'spkid' in sim.simData else np.array([], dtype=int)
+    spkPops = popIndex[spkid]
+    numSpikes = np.bincount(spkPops[spkPops >= 0], minlength=len(pops)).astype(float)
+
+    stopFile = sim.cfg.batchResult.get('stopFile')
+    stop = 1.0 if sim.rank == 0 and stopFile and os.path.exists(stopFile) else 0.0
+
+    # sum spikes, cells and stop flag over all ranks
+    values = h.Vector(list(numSpikes) + list(numCells) + [stop])
+    if sim.nhosts > 1:
+        sim.pc.allreduce(values, 1)
+    values = np.array(values)
+    numSpikes, numCells, stop = values[:len(pops)], values[len(pops):2*len(pops)], values[-1]
+
+    if sim.rank == 0 and not stop and h.t > 0:
+        tsec = h.t / 1e3
+        progress = {'t': h.t,
+                    'popRates': {pop: float(numSpikes[ipop] / numCells[ipop] / tsec) if numCells[ipop] else 0.0 for ipop, pop in enumerate(pops)},
+                    'avgRate': float(numSpikes.sum() / numCells.sum() / tsec) if numCells.sum() else 0.0}
+        progressFile = sim.cfg.batchResult['progressFile']
+        with open(progressFile + '.tmp', 'wb') as fileObj:
+            pk.dump(progress, fileObj, protocol=pk.HIGHEST_PROTOCOL)
+        _replaceFile(progressFile + '.tmp', progressFile)
+
+    return bool(stop)
+
+
+#------------------------------------------------------------------------------
+# Save summary of batch job to results store
+#------------------------------------------------------------------------------
+def saveResultsStore(files=None):
+    """
+    Adds a summary of the job results to the results store of its batch (SQLite database cfg.resultsStore['file'],
+    see batch/store.py): the values of the batch params (cfg.resultsStore['params']), scalar metrics ('totalSpikes',
+    'avgRate', 'popRates.<pop>', 'runTime', and the simData keys in cfg.resultsStore['include'] with scalar values or
+    dicts of scalars) and the paths of the output files (files dict and cfg.resultsStore['files']). Called by
+    sim.saveData(); job scripts that do not save data can call it directly.
+    """
+
+    from .. import sim
+    from ..batch.store import addResult
+    import numbers
+
+    if sim.rank != 0 or not sim.cfg.resultsStore:
+        return
+
+    metrics = {}
+    include = ['avgRate', 'popRates'] + list(sim.cfg.resultsStore.get('include') or [])
+    if 'spkt' in sim.allSimData:
+        metrics['totalSpikes'] = len(sim.allSimData['spkt'])
+    for key in include:
+        value = sim.allSimData.get(key)
+        if isinstance(value, dict):
+            metrics.update({'%s.%s' % (key, k): v for k, v in value.items() if isinstance(v, numbers.Number)})
+        elif isinstance(value, numbers.Number):
+            metrics[key] = value
+    if 'runTime' in sim.timingData:
+        metrics['runTime'] = sim.timingData['runTime']
+
+    files = dict(sim.cfg.resultsStore.get('files') or {}, **{ext: os.path.abspath(fileName) for ext, fileName in (files or {}).items()})
+
+    try:
+        addResult(sim.cfg.resultsStore['file'], sim.cfg.simLabel or os.path.basename(sim.cfg.filename),
+                  params=sim.cfg.resultsStore.get('params'), metrics=metrics, files=files)
+    except Exception as e:
+        print('Error saving results to %s: %s' % (sim.cfg.resultsStore['file'], e))
 
 
 #------------------------------------------------------------------------------
@@ -352,8 +499,8 @@ def intervalSave(t):
         print('  Gathering only sim data in master...')
         sim.allSimData = Dict()
         for k in list(gather[0]['simData'].keys()):  # initialize all keys of allSimData dict
-            if gatherLFP and k == 'LFP':
-                sim.allSimData[k] = np.zeros((gather[0]['simData']['LFP'].shape))
+            if gatherLFP and k in ['LFP', 'LFPCSD']:
+                sim.allSimData[k] = np.zeros((gather[0]['simData'][k].shape))
             else:
                 sim.allSimData[k] = {}
         for key in singleNodeVecs: # store single node vectors (eg. 't')
@@ -372,8 +519,11 @@ def intervalSave(t):
                                 sim.allSimData[key].update({cell:list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
                     else:
                         sim.allSimData[key] = list(sim.allSimData[key])+list(val) # udpate simData dicts which are Vectors
-                elif gatherLFP and key == 'LFP':
+                elif gatherLFP and key in ['LFP', 'LFPCSD']:
                     sim.allSimData[key] += np.array(val)
+                elif gatherLFP and key == 'LFPPops':  # add contributions of each population/group from each node
+                    for groupLabel, groupLFP in val.items():
+                        sim.allSimData[key][groupLabel] = np.add(sim.allSimData[key].get(groupLabel, 0), groupLFP)
                 elif key not in singleNodeVecs:
                     sim.allSimData[key].update(val)           # update simData dicts which are not Vectors
 
@@ -405,6 +555,224 @@ def intervalSave(t):
             sim.allWeights = []
 
 
+#------------------------------------------------------------------------------
+# Saves data recorded since last interval in each node using a background thread
+#------------------------------------------------------------------------------
+def intervalSaveAsync(t):
+    """
+    Function to save data at intervals without stopping the simulation
+
+    Hands the data recorded in this node since the last call (spikes, stim spikes, traces and ``sim.allWeights`` if
+    ``cfg.saveWeights``) to a background thread that appends it as a chunk to the node file
+    (``<intervalFolder>/node_<rank>.pkl``), and empties the recording vectors. There are no barriers or gathering,
+    so the simulation resumes immediately; rank 0 also writes a small ``index.json`` with the times saved.
+    Use with ``sim.runSimWithIntervalFunc(interval, sim.intervalSaveAsync)`` and load the data with
+    ``sim.gatherIntervalData()``.
+
+    Parameters
+    ----------
+    t : float
+        Current simulation time (ms).
+        **Default:** *required*
+
+    """
+
+    from .. import sim
+    import os, threading, queue
+
+    if not getattr(sim, 'intervalWriter', None):
+        mode = 'ab' if getattr(sim, 'intervalSaveInfo', None) else 'wb'  # append if continuing a run (eg. after sim.resume)
+        if not getattr(sim, 'intervalSaveInfo', None):
+            folder = sim.cfg.intervalFolder if hasattr(sim.cfg, 'intervalFolder') else sim.cfg.filename + '_interval_data'
+            sim.intervalSaveInfo = {'folder': folder, 'times': [], 'files': []}
+        folder = sim.intervalSaveInfo['folder']
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:  # created by another node
+                pass
+        sim.intervalWriter = {'queue': queue.Queue()}
+        sim.intervalWriter['thread'] = threading.Thread(target=_intervalWriter, args=(sim.intervalWriter['queue'],
+                                                        os.path.join(folder, 'node_%d.pkl' % (sim.rank)), mode))
+        sim.intervalWriter['thread'].daemon = True
+        sim.intervalWriter['thread'].start()
+
+    # copy new data and empty recording vectors (except traces processed by sim.processTraces)
+    # samples recorded at the current time are kept for the next chunk, so each chunk covers [previous t, t)
+    processedVecs = set(id(trace['vec']) for trace in (getattr(sim, 'tracesProcess', None) or []))
+    timeVec = sim.simData['t'] if 't' in sim.simData else None
+    keep = 1 if timeVec is not None and timeVec.size() > 0 and abs(timeVec.x[int(timeVec.size())-1] - t) < sim.cfg.recordStep/2.0 else 0
+    chunk = {'t': t, 'rank': sim.rank, 'simData': {}}
+    for key, val in sim.simData.items():
+        if key in ['spkt', 'spkid']:
+            chunk['simData'][key] = _drainVec(val)
+        elif key == 't':
+            data = _drainVec(val, keep)
+            if sim.rank == 0:
+                chunk['simData'][key] = data
+        elif key in ['stims'] + list(sim.cfg.recordTraces.keys()):
+            keepSamples = keep if key != 'stims' else 0
+            chunk['simData'][key] = {}
+            for cellLabel, cellVal in val.items():
+                if isinstance(cellVal, dict):
+                    chunk['simData'][key][cellLabel] = {k: _drainVec(v, keepSamples) for k, v in cellVal.items() if hasattr(v, 'as_numpy') and id(v) not in processedVecs}
+                elif hasattr(cellVal, 'as_numpy') and id(cellVal) not in processedVecs:
+                    chunk['simData'][key][cellLabel] = _drainVec(cellVal, keepSamples)
+
+    if getattr(sim.cfg, 'saveWeights', False) and hasattr(sim, 'allWeights'):
+        chunk['allWeights'] = sim.allWeights
+        sim.allWeights = []
+
+    sim.intervalWriter['queue'].put(chunk)
+
+    if sim.rank == 0:
+        info = sim.intervalSaveInfo
+        info['times'].append(t)
+        info['files'] = sorted(set(info['files'] + ['node_%d.pkl' % (rank) for rank in range(sim.nhosts)]))
+        index = {'times': list(info['times']), 'nhosts': sim.nhosts, 'files': list(info['files'])}
+        sim.intervalWriter['queue'].put(('index', os.path.join(info['folder'], 'index.json'), index))
+
+
+def _drainVec(vec, keep=0):
+    size = int(vec.size())
+    data = vec.as_numpy()[:size-keep].copy()
+    if keep and size > keep:
+        vec.remove(0, size-keep-1)
+    elif not keep:
+        vec.resize(0)
+    return data
+
+
+def _intervalWriter(chunksQueue, fileName, mode='wb'):
+    import pickle, json, os
+
+    with open(fileName, mode) as fileObj:
+        while True:
+            item = chunksQueue.get()
+            if item is None:
+                break
+            elif isinstance(item, tuple) and item[0] == 'index':
+                with open(item[1]+'.tmp', 'w') as indexFile:
+                    json.dump(item[2], indexFile)
+                os.rename(item[1]+'.tmp', item[1])  # atomic replace so the index is never partially written
+            else:
+                pickle.dump(item, fileObj, protocol=2)  # append-only chunks
+                fileObj.flush()
+
+
+#------------------------------------------------------------------------------
+# Wait for background thread to finish saving interval data
+#------------------------------------------------------------------------------
+def stopIntervalSaveAsync():
+    """
+    Function to wait until all the data passed to ``sim.intervalSaveAsync`` has been written to file and stop the
+    background writer thread (called automatically at the end of ``sim.runSimWithIntervalFunc``)
+
+    """
+
+    from .. import sim
+
+    if getattr(sim, 'intervalWriter', None):
+        sim.intervalWriter['queue'].put(None)
+        sim.intervalWriter['thread'].join()
+        sim.intervalWriter = None
+
+
+#------------------------------------------------------------------------------
+# Save state of simulation to continue later
+#------------------------------------------------------------------------------
+def checkpoint(path):
+    """
+    Function to save the state of the simulation at the current time so it can be continued later (eg. in another
+    job) with ``sim.resume(path)``
+
+    The NEURON state of the cells in each node is saved with ``BBSaveState`` (``<path>/state_<rank>.dat``), and the
+    NetPyNE state in ``<path>/netpyne_<rank>.pkl``: data recorded so far (spikes, including flushed spikes, traces,
+    LFP, weight snapshots), NetStim randomizer positions and interval saving bookkeeping. Should be called on all
+    nodes between ``psolve`` calls (eg. from the function passed to ``sim.runSimWithIntervalFunc``).
+
+    Parameters
+    ----------
+    path : str
+        Folder where the checkpoint files are saved.
+        **Default:** *required*
+
+    """
+
+    from .. import sim
+    import json
+    import numpy as np
+
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:  # created by another node
+            pass
+    sim.pc.barrier()
+
+    # NEURON state of cells in this node
+    h.BBSaveState().save(os.path.join(path, 'state_%d.dat' % (sim.rank)))
+
+    # recorded data
+    sim.processTraces()
+    processedVecs = set(id(trace['vec']) for trace in (getattr(sim, 'tracesProcess', None) or []))
+    state = {'t': h.t, 'rank': sim.rank, 'nhosts': sim.nhosts, 'simData': _checkpointData(sim.simData, processedVecs)}
+
+    state['tracesProcess'] = {}
+    for trace in (getattr(sim, 'tracesProcess', None) or []):
+        traceState = {k: v for k, v in trace.items() if k in ['carry', 'carryStart', 'chunks', 'lastCrossing', 'snippetTimes']}
+        traceState['vec'] = trace['vec'].as_numpy().copy()
+        state['tracesProcess'][(trace['key'], trace['gid'], trace['secLoc'])] = traceState
+
+    if getattr(sim, 'spikesFlush', None):
+        sim.flushSpikes()
+        if 'buffer' in sim.spikesFlush:
+            state['spikesFlush'] = {'buffer': sim.spikesFlush['buffer'].copy(), 'numSpikes': sim.spikesFlush['numSpikes']}
+        else:
+            state['spikesFlush'] = {'spikes': np.fromfile(sim.spikesFlush['fileName']).reshape(-1, 2), 'numSpikes': sim.spikesFlush['numSpikes']}
+
+    if getattr(sim, 'weightsRecord', None) and sim.weightsRecord.get('file'):
+        sim.flushWeights()
+        record = sim.weightsRecord
+        state['weightsRecord'] = {'conns': list(record['conns']), 'times': list(record['times']),
+                                  'weights': np.fromfile(record['fileName'], dtype=np.float32).reshape(-1, len(record['conns'])) if record['conns'] else None}
+
+    # stim randomizer positions
+    state['randomizers'] = {}
+    for cell in sim.net.cells:
+        if getattr(cell, 'hRandom', None) is not None:
+            state['randomizers'][('cell', cell.gid)] = cell.hRandom.seq()
+        for istim, stim in enumerate(cell.stims):
+            if 'hRandom' in stim:
+                state['randomizers'][('stim', cell.gid, istim)] = stim['hRandom'].seq()
+    for poolKey, pool in getattr(sim.net, 'stimPools', {}).items():
+        for poolIndex, poolStim in pool['netStims'].items():
+            state['randomizers'][('pool', poolKey, poolIndex)] = poolStim['hRandom'].seq()
+
+    # interval saving bookkeeping
+    if getattr(sim, 'intervalSaveInfo', None):
+        state['intervalSaveInfo'] = dict(sim.intervalSaveInfo)
+    if hasattr(sim, 'allWeights'):
+        state['allWeights'] = list(sim.allWeights)
+
+    with open(os.path.join(path, 'netpyne_%d.pkl' % (sim.rank)), 'wb') as fileObj:
+        pk.dump(state, fileObj, protocol=2)
+
+    sim.pc.barrier()
+    if sim.rank == 0:
+        with open(os.path.join(path, 'checkpoint.json'), 'w') as fileObj:
+            json.dump({'t': h.t, 'nhosts': sim.nhosts}, fileObj)
+        print(('  Saved checkpoint at t = %0.1f ms to %s' % (h.t, path)))
+
+
+def _checkpointData(data, skipVecs):
+    if isinstance(data, dict):
+        return {k: _checkpointData(v, skipVecs) for k, v in data.items()}
+    elif hasattr(data, 'as_numpy'):
+        return data.as_numpy().copy() if id(data) not in skipVecs else None
+    return data
+
+
 #------------------------------------------------------------------------------
 # Save data in each node
 #------------------------------------------------------------------------------
@@ -451,6 +819,11 @@ def saveDataInNodes(filename=None, saveLFP=True, removeTraces=False, dataDir=Non
     if sim.rank == 0:
         print('\nSaving an output file for each node in: %s' % (dataDir))
 
+    # recover spikes moved to node file or ring buffer during the run
+    sim._restoreFlushedSpikes()
+    sim.processTraces(final=True)
+    sim.flushWeights(final=True)  # write remaining weight snapshots to node file
+
     # saving data
     dataSave = {}
 
@@ -465,7 +838,7 @@ def saveDataInNodes(filename=None, saveLFP=True, removeTraces=False, dataDir=Non
     if saveLFP:
         simData = sim.simData
     else:
-        simData = {k: v for k, v in sim.simData.items() if k not in ['LFP']}
+        simData = {k: v for k, v in sim.simData.items() if k not in ['LFP', 'LFPPops', 'LFPCSD']}
 
     for k in list(simData.keys()):  # initialize all keys of allSimData dict
         saveSimData[k] = {}
@@ -477,9 +850,9 @@ def saveDataInNodes(filename=None, saveLFP=True, removeTraces=False, dataDir=Non
                         if isinstance(val2, dict):
                             saveSimData[key].update({cell: {}})
                             for stim, val3 in val2.items():
-                                saveSimData[key][cell].update({stim: list(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
+                                saveSimData[key][cell].update({stim: gather._vecToList(val3)}) # udpate simData dicts which are dicts of dicts of Vectors (eg. ['stim']['cell_1']['backgrounsd']=h.Vector)
                         else:
-                            saveSimData[key].update({cell: list(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
+                            saveSimData[key].update({cell: gather._vecToList(val2)})  # udpate simData dicts which are dicts of Vectors (eg. ['v']['cell_1']=h.Vector)
                 else:
                     saveSimData[key] = list(saveSimData[key]) + list(val) # udpate simData dicts which are Vectors
             elif key in singleNodeVecs:
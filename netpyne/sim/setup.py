@@ -309,24 +309,149 @@ def setupRecordLFP():
     saveSteps = int(np.ceil(sim.cfg.duration/sim.cfg.recordStep))
     sim.simData['LFP'] = np.zeros((saveSteps, nsites))
     if sim.cfg.saveLFPCells:
-        for c in sim.net.cells:
+        # True = all cells in this node; otherwise list of cells/pops with same format as recordCells
+        lfpCells = sim.net.cells if sim.cfg.saveLFPCells == True else utils.getCellsList(sim.cfg.saveLFPCells)
+        for c in lfpCells:
             sim.simData['LFPCells'][c.gid] = np.zeros((saveSteps, nsites))
 
+    lfpGroupGids = {}
+    if sim.cfg.saveLFPPops:
+        # True = all pops; list of pop labels; or dict with group label and list of cells/pops (same format as recordCells)
+        if isinstance(sim.cfg.saveLFPPops, dict):
+            lfpGroups = sim.cfg.saveLFPPops
+        elif sim.cfg.saveLFPPops == True:
+            lfpGroups = {popLabel: [popLabel] for popLabel in sim.net.pops}
+        else:
+            lfpGroups = {popLabel: [popLabel] for popLabel in sim.cfg.saveLFPPops}
+        for groupLabel, include in lfpGroups.items():
+            sim.simData['LFPPops'][groupLabel] = np.zeros((saveSteps, nsites))  # memory scales with num of groups instead of cells
+            lfpGroupGids[groupLabel] = [c.gid for c in utils.getCellsList(include)]
+
+    if sim.cfg.saveLFPCSD:
+        if nsites < 2:
+            print('Error: saveLFPCSD requires at least 2 LFP electrodes (equally spaced along depth)')
+            sim.cfg.saveLFPCSD = False
+        else:
+            sim.simData['LFPCSD'] = np.zeros((saveSteps, nsites))
+            sim.net._lfpCSDSpacing = abs(sim.cfg.recordLFP[1][1] - sim.cfg.recordLFP[0][1]) / 1000.0  # electrode spacing in mm
+
     if not sim.net.params.defineCellShapes: sim.net.defineCellShapes()  # convert cell shapes (if not previously done already)
     sim.net.calcSegCoords()  # calculate segment coords for each cell
     sim.net.recXElectrode = RecXElectrode(sim)  # create exctracellular recording electrode
 
     if sim.cfg.createNEURONObj:
-        for cell in sim.net.compartCells:
-            nseg = cell._segCoords['p0'].shape[1]
-            sim.net.recXElectrode.calcTransferResistance(cell.gid, cell._segCoords)  # transfer resistance for each cell
-            cell.imembPtr = h.PtrVector(nseg)  # pointer vector
-            cell.imembPtr.ptr_update_callback(cell.setImembPtr)   # used for gathering an array of  i_membrane values from the pointer vector
-            cell.imembVec = h.Vector(nseg)
-
         sim.cvode.use_fast_imem(True)   # make i_membrane_ a range variable
         sim.cfg.use_fast_imem = True
 
+        # concatenate segments of all cells in this node so each LFP step requires a single gather and matrix-vector product
+        dtype = np.float32 if sim.cfg.LFPFloat32 else np.float64
+        sim.net.recXElectrode.calcTransferMatrix([cell.gid for cell in sim.net.compartCells],
+                                                 [cell._segCoords for cell in sim.net.compartCells],
+                                                 dtype=dtype, cutoff=sim.cfg.LFPDistanceCutoff, cacheDir=sim.cfg.LFPCacheDir)
+        nseg = sim.net.recXElectrode.transferMatrix.shape[1]
+
+        # ranges of transfer matrix columns for each pop/group (contiguous cells merged; pop cells are usually contiguous)
+        sim.net._lfpGroupRanges = {}
+        segRanges = sim.net.recXElectrode.segRanges
+        for groupLabel, gids in lfpGroupGids.items():
+            groupRanges = []
+            for start, end in sorted(segRanges[gid] for gid in gids if gid in segRanges):
+                if groupRanges and groupRanges[-1][1] == start:
+                    groupRanges[-1][1] = end
+                else:
+                    groupRanges.append([start, end])
+            sim.net._lfpGroupRanges[groupLabel] = groupRanges
+
+        sim.net._lfpImembPtr = h.PtrVector(nseg)  # pointer vector with i_membrane_ of all segments in node
+        sim.net._lfpImembPtr.ptr_update_callback(setImembPtrs)  # reset pointers if NEURON reallocates memory
+        sim.net._lfpImembVec = h.Vector(nseg)
+        setImembPtrs()
+
+
+#------------------------------------------------------------------------------
+# Set node PtrVector to point to i_membrane_ of all segments (used for LFP)
+#------------------------------------------------------------------------------
+def setImembPtrs():
+    """
+    Sets the node-level PtrVector used for LFP calculation to point to the i_membrane_ of each segment of the
+    compartmental cells in this node, in the same order as the columns of the node transfer resistance matrix.
+    """
+
+    from .. import sim
+
+    for cell in sim.net.compartCells:
+        cell.setImembPtr(sim.net._lfpImembPtr, sim.net.recXElectrode.segRanges[cell.gid][0])
+
+
+#------------------------------------------------------------------------------
+# Setup synaptic weights recording
+#------------------------------------------------------------------------------
+def setupRecordWeights():
+    """
+    Sets up the recording of synaptic weights (or a variable of the plasticity mechanism) of the connections
+    selected by cfg.recordWeights: a node-level PtrVector points to the values of all selected connections, which are
+    sampled every cfg.recordWeightsStep ms into a preallocated float32 buffer of cfg.recordWeightsBufferSize
+    snapshots, appended to <filename>_weights/node_<rank>.bin (one row per snapshot, one column per connection)
+    when full. The connections of each column (postGid, index in cell conns, preGid) are saved in
+    node_<rank>_conns.npy.
+    """
+
+    from .. import sim
+
+    params = sim.cfg.recordWeights if isinstance(sim.cfg.recordWeights, dict) else {}
+    var = params.get('var', 'weight')
+    plastOnly = params.get('plastOnly', True)
+    synMechs = params.get('synMech')
+    if synMechs is not None and not isinstance(synMechs, list):
+        synMechs = [synMechs]
+
+    conns = []  # (postGid, conn index, preGid)
+    for cell in utils.getCellsList(params.get('cells', ['all'])):
+        for iconn, conn in enumerate(cell.conns):
+            if 'hObj' not in conn or (plastOnly and not conn.get('plast')) or (synMechs and conn.get('synMech') not in synMechs):
+                continue
+            if var != 'weight' and not (conn.get('hPlast') and hasattr(conn['hPlast'], var)):
+                continue
+            preGid = conn.get('preGid')
+            conns.append((cell.gid, iconn, preGid if isinstance(preGid, int) else -1))
+
+    weightsFolder = sim.cfg.filename + '_weights'
+    if not os.path.exists(weightsFolder):
+        try:
+            os.makedirs(weightsFolder)
+        except OSError:  # created by another node
+            pass
+    np.save(os.path.join(weightsFolder, 'node_%d_conns.npy' % (sim.rank)), np.array(conns, dtype=np.int64).reshape(-1, 3))
+
+    numConns = len(conns)
+    sim.weightsRecord = {'var': var, 'conns': conns, 'numBuffered': 0, 'times': [],
+                         'ptrVec': h.PtrVector(max(numConns, 1)), 'vec': h.Vector(max(numConns, 1)),
+                         'buffer': np.zeros((int(sim.cfg.recordWeightsBufferSize), numConns), dtype=np.float32),
+                         'fileName': os.path.join(weightsFolder, 'node_%d.bin' % (sim.rank))}
+    sim.weightsRecord['file'] = open(sim.weightsRecord['fileName'], 'wb')
+    sim.weightsRecord['ptrVec'].ptr_update_callback(setWeightsPtrs)  # reset pointers if NEURON reallocates memory
+    setWeightsPtrs()
+
+    print(('  Recording %s of %i connections on node %i' % (var, numConns, sim.rank)))
+
+
+#------------------------------------------------------------------------------
+# Set pointers to recorded weights
+#------------------------------------------------------------------------------
+def setWeightsPtrs():
+    """
+    Sets the node-level PtrVector used to record weights to point to the NetCon weight (or plasticity mechanism
+    variable) of each recorded connection, in the same order as the columns of the node weights file.
+    """
+
+    from .. import sim
+
+    var = sim.weightsRecord['var']
+    ptrVec = sim.weightsRecord['ptrVec']
+    for i, (gid, iconn, preGid) in enumerate(sim.weightsRecord['conns']):
+        conn = sim.net.cells[sim.net.gid2lid[gid]].conns[iconn]
+        ptrVec.pset(i, conn['hObj']._ref_weight[0] if var == 'weight' else getattr(conn['hPlast'], '_ref_'+var))
+
 
 #------------------------------------------------------------------------------
 # Setup Recording
@@ -341,6 +466,8 @@ def setupRecording():
 
     sim.timing('start', 'setrecordTime')
 
+    sim.intervalSaveInfo = None  # files and times saved with intervalSaveAsync
+
     # spike recording
     sim.simData.update({name:h.Vector(1e4).resize(0) for name in ['spkt','spkid']})  # initialize
     if sim.cfg.recordCellsSpikes == -1:
@@ -350,6 +477,21 @@ def setupRecording():
         for gid in recordGidsSpikes:
             sim.pc.spike_record(float(gid), sim.simData['spkt'], sim.simData['spkid']) # -1 means to record from all cells on this node
 
+    # periodically move spikes from NEURON vectors to a node file or ring buffer so memory does not grow during the run
+    if sim.cfg.flushSpikesInterval:
+        sim.spikesFlush = {'numSpikes': 0}
+        if sim.cfg.spikesRingBufferSize:
+            sim.spikesFlush['buffer'] = np.zeros((int(sim.cfg.spikesRingBufferSize), 2))
+        else:
+            spikesFolder = sim.cfg.filename + '_spikes'
+            if not os.path.exists(spikesFolder):
+                try:
+                    os.makedirs(spikesFolder)
+                except OSError:  # created by another node
+                    pass
+            sim.spikesFlush['fileName'] = os.path.join(spikesFolder, 'node_%d.bin' % (sim.rank))
+            sim.spikesFlush['file'] = open(sim.spikesFlush['fileName'], 'wb')
+
     # stim spike recording
     if 'plotRaster' in sim.cfg.analysis:
         if isinstance(sim.cfg.analysis['plotRaster'],dict) and 'include' in sim.cfg.analysis['plotRaster']:
@@ -398,6 +540,9 @@ def setupRecording():
         cellsRecord = utils.getCellsList(sim.cfg.recordCells)+cellsPlot
 
         for key in list(sim.cfg.recordTraces.keys()): sim.simData[key] = Dict()  # create dict to store traces
+
+        # traces with recording options are processed at intervals during the run (see sim.processTraces)
+        sim.tracesProcess = []
         for cell in cellsRecord:
             cell.recordTraces()  # call recordTraces function for each cell
 
@@ -429,6 +574,10 @@ def setupRecording():
     if sim.cfg.recordLFP:
         setupRecordLFP()
 
+    # set weights recording
+    if sim.cfg.recordWeights:
+        setupRecordWeights()
+
 
     sim.timing('stop', 'setrecordTime')
 
@@ -571,9 +571,9 @@ def replaceNoneObj(obj):
         for key,val in obj.items():
             if isinstance(val, (list, dict, Dict, ODict)):
                 replaceNoneObj(val)
-            if val == None:
+            if val is None:
                 obj[key] = []
-            elif val == {}:
+            elif isinstance(val, (dict, Dict, ODict)) and len(val) == 0:
                 obj[key] = [] # also replace empty dicts with empty list
     return obj
 
@@ -872,9 +872,11 @@ def clearAll():
         del sim.net.allCells
         del sim.allSimData
 
-        import matplotlib
-        matplotlib.pyplot.clf()
-        matplotlib.pyplot.close('all')
+        import sys
+        if 'matplotlib.pyplot' in sys.modules:  # close figures (only if pyplot was imported, eg. by analysis)
+            import matplotlib.pyplot as plt
+            plt.clf()
+            plt.close('all')
 
     del sim.net
 
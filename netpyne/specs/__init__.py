@@ -10,6 +10,6 @@ from __future__ import absolute_import
 
 from future import standard_library
 standard_library.install_aliases()
-from .dicts import Dict, ODict
+from .dicts import Dict, ODict, TraceMatrix
 from .netParams import NetParams, CellParams
 from .simConfig import SimConfig
@@ -1,7 +1,7 @@
 """
-Module containing Dict and ODict classes
+Module containing Dict, ODict and TraceMatrix classes
 
-These classes reproduce normal Dict and ODict behavior, but add support for object-like dot notation (e.g. cell.secs.soma.geom)
+Dict and ODict classes reproduce normal Dict and ODict behavior, but add support for object-like dot notation (e.g. cell.secs.soma.geom)
 
 """
 
@@ -16,6 +16,7 @@ from builtins import super
 from future import standard_library
 standard_library.install_aliases()
 from collections import OrderedDict
+import numpy as np
 
 # ----------------------------------------------------------------------------
 # Dict class (allows dot notation for dicts)
@@ -278,3 +279,42 @@ class ODict(OrderedDict):
 
     def __setstate__ (self, d):
         self = self.fromOrderedDict(d)
+
+
+# ----------------------------------------------------------------------------
+# TraceMatrix class (traces of all cells stored as 2D array)
+# ----------------------------------------------------------------------------
+
+class TraceMatrix(dict):
+    """
+    Traces of one recorded variable stored as a 2D numpy array (cells x samples) in ``data``, with the cell gid of
+    each row in ``gids`` and the time vector shared by all cells in ``t``.
+
+    Items keyed by 'cell_<gid>' are read-only views of the rows, so code using the dict format (e.g.
+    sim.allSimData['V_soma']['cell_0']) keeps working without copying the data.
+    """
+
+    def __init__(self, data, gids, t=None):
+        super().__init__()
+        self.data = np.asarray(data)
+        self.gids = np.asarray(gids, dtype=int)
+        self.t = None if t is None else np.asarray(t)
+        self.gidIndex = {int(gid): i for i, gid in enumerate(self.gids)}
+        for i, gid in enumerate(self.gids):
+            row = self.data[i]
+            row.flags.writeable = False
+            dict.__setitem__(self, 'cell_'+str(int(gid)), row)
+
+    def row(self, gid):
+        return self.data[self.gidIndex[gid]]
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError('TraceMatrix cell items are read-only views; modify the TraceMatrix.data array instead')
+
+    __setitem__ = __delitem__ = update = pop = popitem = clear = setdefault = _readOnly
+
+    def __reduce__(self):
+        return (TraceMatrix, (self.data, self.gids, self.t))
+
+    def __repr__(self):
+        return 'TraceMatrix(%d cells x %d samples)' % (self.data.shape[0], self.data.shape[1] if self.data.ndim > 1 else 0)
@@ -392,12 +392,12 @@ class NetParams(object):
     #     return True
 
 
-    def importCellParams(self, label, fileName, cellName, conds={}, cellArgs=None, importSynMechs=False, somaAtOrigin=True, cellInstance=False):
+    def importCellParams(self, label, fileName, cellName, conds={}, cellArgs=None, importSynMechs=False, somaAtOrigin=True, cellInstance=False, cacheDir=None):
         if cellArgs is None: cellArgs = {}
         if not label:
             label = int(self._labelid)
             self._labelid += 1
-        secs, secLists, synMechs, globs = conversion.importCell(fileName, cellName, cellArgs, cellInstance)
+        secs, secLists, synMechs, globs = conversion.importCell(fileName, cellName, cellArgs, cellInstance, cacheDir)
         cellRule = {'conds': conds, 'secs': secs, 'secLists': secLists, 'globals': globs}
 
         # adjust cell 3d points so that soma is at location 0,0,0
@@ -46,6 +46,7 @@ class SimConfig(object):
         self.cvode_atol = 0.001  # absolute error tolerance
         self.seeds = Dict({'conn': 1, 'stim': 1, 'loc': 1}) # Seeds for randomizers (connectivity, input stimulation and cell locations)
         self.rand123GlobalIndex = None  # Sets the global index used by all instances of the Random123 instances of Random
+        self.bulkVecStimTrains = False  # generate interval-based VecStim spike trains per pop at once using counter-based Random123 streams (no max num of spikes)
         self.createNEURONObj = True  #  create runnable network in NEURON when instantiating netpyne network metadata
         self.createPyStruct = True  # create Python structure (simulator-independent) when instantiating network
         self.addSynMechs = True  # whether to add synaptich mechanisms or not
@@ -71,11 +72,23 @@ class SimConfig(object):
         # Recording
         self.recordCells = []  # what cells to record traces from (eg. 'all', 5, or 'PYR')
         self.recordTraces = {}  # Dict of traces to record
+        self.traceMatrix = False  # store the gathered traces of each variable as a TraceMatrix (cells x samples numpy array) instead of a dict of cell traces
+        self.processTracesInterval = 100  # Interval (ms) to process traces recorded with options (dtype, decimate, envelope, timeWindows, snippets)
         self.recordCellsSpikes = -1  # cells to record spike times from (-1 to record from all)
         self.recordStim = False  # record spikes of cell stims
+        self.flushSpikesInterval = None  # Interval (ms) to move recorded spikes from memory to a per-node append-only binary file (bounded memory)
+        self.spikesRingBufferSize = None  # If set, flushed spikes are kept in a ring buffer with the last N spikes of each node instead of a file
         self.recordLFP = []  # list of 3D locations to record LFP from
         self.recordDipoles = False # record dipoles
-        self.saveLFPCells = False  # Store LFP generate individually by each cell
+        self.saveLFPCells = False  # Store LFP generate individually by each cell (True for all cells or list of cells, same format as recordCells)
+        self.saveLFPPops = False  # Store LFP generated by each population (True for all pops, list of pops, or dict of group label: list of cells)
+        self.saveLFPCSD = False  # Compute current source density (CSD) from the LFP during the simulation (equally spaced electrodes along depth)
+        self.LFPFloat32 = False  # Use single precision (float32) transfer resistance matrix to compute the LFP
+        self.LFPDistanceCutoff = None  # Max distance (um) between a segment and an electrode site to include its contribution (sparse transfer matrix)
+        self.LFPCacheDir = None  # Folder to cache transfer resistance matrices (keyed by electrode and segment coords hash)
+        self.recordWeights = False  # Record synaptic weights during the simulation (True for plastic conns, or dict with 'cells', 'synMech', 'plastOnly' and 'var' (NetCon 'weight' or plasticity mech variable))
+        self.recordWeightsStep = 100  # Interval (ms) between snapshots of recorded weights
+        self.recordWeightsBufferSize = 100  # Number of weight snapshots kept in memory (float32) before appending them to the per-node file
         self.recordStep = 0.1 # Step size in ms to save data (eg. V traces, LFP, etc)
         self.recordTime = True  # record time step of recording
 
@@ -93,6 +106,8 @@ class SimConfig(object):
         self.saveHDF5 = False # save to HDF5 file
         self.saveDat = False # save traces to .dat file(s)
         self.backupCfgFile = [] # copy cfg file, list with [sourceFile,destFolder] (eg. ['cfg.py', 'backupcfg/'])
+        self.batchResult = None  # set by batch optimizations: dict with 'file' where the job saves the simData keys in 'include' needed by the fitness function, 'socket' to notify completion, and optionally 'progressInterval', 'progressFile' and 'stopFile' to report intermediate metrics and stop early (see sim.saveBatchProgress)
+        self.resultsStore = None  # set by batches: dict with 'file' (SQLite results store of the batch) and 'params' (values of the batch params of the job), where the job adds a summary of its results (see sim.saveResultsStore)
 
         # error checking
         self.checkErrors = False # whether to validate the input parameters (will be turned off if num processors > 1)
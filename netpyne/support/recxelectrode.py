@@ -41,6 +41,8 @@ from __future__ import absolute_import
 from builtins import range
 from future import standard_library
 standard_library.install_aliases()
+import os
+import hashlib
 import numpy as np
 import math
 
@@ -66,13 +68,91 @@ class RecXElectrode(object):
 
         self.nsites = self.pos.shape[1]
         self.transferResistances = {}   # V_e = transfer_resistance*Im
+        self.transferMatrix = None  # transfer resistances of all cells concatenated (nsites x total segments)
+        self.segRanges = {}  # range of columns of transferMatrix for each cell gid
+        self.sigma = 0.3  # mS/mm
 
     def getTransferResistance(self, gid):
+        if gid in self.segRanges:
+            start, end = self.segRanges[gid]
+            return self.transferMatrix[:, start:end]
         return self.transferResistances[gid]
 
-    def calcTransferResistance(self, gid, seg_coords):
-        """Precompute mapping from segment to electrode locations"""
-        sigma = 0.3  # mS/mm
+    def calcTransferMatrix(self, gids, segCoordsList, dtype=np.float64, cutoff=None, cacheDir=None, maxValuesPerBatch=int(1e7)):
+        """Precompute mapping from the segments of all cells (concatenated in order of gids) to electrode locations.
+
+        Segments are processed in batches of up to maxValuesPerBatch (sites x segments) values. If cutoff (um) is
+        provided, segments further than cutoff from a site do not contribute to it and the matrix is stored as a
+        sparse CSR matrix. If cacheDir is provided, the matrix is saved to (and reloaded from) a file keyed by a hash
+        of the electrode layout, options and segment coordinates.
+        """
+
+        self.segRanges = {}
+        start = 0
+        for gid, segCoords in zip(gids, segCoordsList):
+            nseg = segCoords['p0'].shape[1]
+            self.segRanges[gid] = (start, start+nseg)
+            start += nseg
+        totalSegs = start
+
+        cacheFile = None
+        if cacheDir:
+            md5 = hashlib.md5()
+            md5.update(str((self.sigma, cutoff, np.dtype(dtype).str)).encode())
+            md5.update(np.ascontiguousarray(self.pos, dtype=np.float64).tobytes())
+            for segCoords in segCoordsList:
+                md5.update(np.ascontiguousarray(segCoords['p0'], dtype=np.float64).tobytes())
+                md5.update(np.ascontiguousarray(segCoords['p1'], dtype=np.float64).tobytes())
+            cacheFile = os.path.join(cacheDir, 'transferMatrix_%s.npz' % (md5.hexdigest()))
+            if os.path.exists(cacheFile):
+                try:
+                    if cutoff:
+                        from scipy import sparse
+                        self.transferMatrix = sparse.load_npz(cacheFile)
+                    else:
+                        self.transferMatrix = np.load(cacheFile)['transferMatrix']
+                    return self.transferMatrix
+                except Exception as e:
+                    print('  Could not load cached transfer matrix from %s (%s); calculating it again' % (cacheFile, e))
+
+        batchSegs = max(1, int(maxValuesPerBatch // max(1, self.nsites)))
+        p0 = np.hstack([segCoords['p0'] for segCoords in segCoordsList]) if segCoordsList else np.zeros((3, 0))
+        p1 = np.hstack([segCoords['p1'] for segCoords in segCoordsList]) if segCoordsList else np.zeros((3, 0))
+
+        if cutoff:
+            from scipy import sparse
+            blocks = []
+            for iseg in range(0, totalSegs, batchSegs):
+                tr = self._transferResistance(p0[:, iseg:iseg+batchSegs], p1[:, iseg:iseg+batchSegs], cutoff)
+                blocks.append(sparse.csr_matrix(tr.astype(dtype, copy=False)))
+            self.transferMatrix = sparse.hstack(blocks, format='csr') if blocks else sparse.csr_matrix((self.nsites, 0), dtype=dtype)
+        else:
+            self.transferMatrix = np.zeros((self.nsites, totalSegs), dtype=dtype)
+            for iseg in range(0, totalSegs, batchSegs):
+                self.transferMatrix[:, iseg:iseg+batchSegs] = self._transferResistance(p0[:, iseg:iseg+batchSegs], p1[:, iseg:iseg+batchSegs])
+
+        # save to cache (written to a temporary file and renamed, since other nodes or jobs may use the same cache)
+        if cacheFile:
+            try:
+                if not os.path.exists(cacheDir):
+                    try:
+                        os.makedirs(cacheDir)
+                    except OSError:
+                        pass  # created by another node
+                tmpFile = '%s.%d.tmp' % (cacheFile, os.getpid())
+                with open(tmpFile, 'wb') as fileObj:  # file object, so numpy does not add the .npz extension
+                    if cutoff:
+                        sparse.save_npz(fileObj, self.transferMatrix)
+                    else:
+                        np.savez(fileObj, transferMatrix=self.transferMatrix)
+                getattr(os, 'replace', os.rename)(tmpFile, cacheFile)  # os.rename in Python 2 (also replaces it in POSIX systems)
+            except Exception as e:
+                print('  Could not save transfer matrix to cache %s (%s)' % (cacheFile, e))
+
+        return self.transferMatrix
+
+    def _transferResistance(self, p0, p1, cutoff=None):
+        """Line source transfer resistance (sites x segments, in MOhm) from segments with ends p0, p1 (3 x segments) to all electrode sites"""
 
         # Value used in NEURON extracellular recording example ("extracellular_stim_and_rec")
         # rho = 35.4  # ohm cm, squid axon cytoplasm = 2.8249e-2 S/cm = 0.028 S/cm = 0.0028 S/mm = 2.8 mS/mm
@@ -80,32 +160,33 @@ class RecXElectrode(object):
                     # equivalent sigma value (~3) is 10x larger than Allen (0.3)
                     # if use same sigma value, results are consistent
 
-        r05 = (seg_coords['p0'] + seg_coords['p1'])/2
-        dl = seg_coords['p1'] - seg_coords['p0']
+        r05 = (p0 + p1)/2
+        dl = p1 - p0
+
+        rel_05 = self.pos[:, :, np.newaxis] - r05[:, np.newaxis, :]  # distance between electrode sites and segment centers (xyz x sites x segments)
+        r2 = np.einsum('ijk,ijk->jk', rel_05, rel_05)  # square distance (sites x segments)
 
-        nseg = r05.shape[1]
+        rlldl = np.einsum('ijk,ik->jk', rel_05, dl)  # dot product with segment axis (sites x segments)
+        dlmag = np.linalg.norm(dl, axis=0)  # length of each segment
+        rll = abs(rlldl/dlmag)   # component of r parallel to the segment axis it must be always positive
+        rT2 = r2 - rll**2  # square of perpendicular component
+        up = rll + dlmag/2
+        low = rll - dlmag/2
+        num = up + np.sqrt(up**2 + rT2)
+        den = low + np.sqrt(low**2 + rT2)
+        tr = np.log(num/den)/dlmag  # units of (1/um) use with imemb_ (total seg current)
 
-        tr = np.zeros((self.nsites,nseg))
-        # tr_NEURON = np.zeros((self.nsites,nseg))  # used to compare with NEURON extracellular example
+        # Consistent with NEURON extracellular recording example
+        # r = np.sqrt(rel_05[0,:]**2 + rel_05[1,:]**2 + rel_05[2,:]**2)
+        # tr_NEURON[j, :] = (rho / 4 / math.pi)*(1/r)*0.01
 
-        for j in range(self.nsites):   # calculate mapping for each site on the electrode
-            rel = np.expand_dims(self.pos[:, j], axis=1)   # coordinates of a j-th site on the electrode
-            rel_05 = rel - r05  # distance between electrode and segment centers
-            r2 = np.einsum('ij,ij->j', rel_05, rel_05)    # compute dot product column-wise, the resulting array has as many columns as original
+        tr *= 1/(4*math.pi*self.sigma)  # units: 1/um / (mS/mm) = mm/um / mS = 1e3 * kOhm = MOhm
 
-            rlldl = np.einsum('ij,ij->j', rel_05, dl)    # compute dot product column-wise, the resulting array has as many columns as original
-            dlmag = np.linalg.norm(dl, axis=0)  # length of each segment
-            rll = abs(rlldl/dlmag)   # component of r parallel to the segment axis it must be always positive
-            rT2 = r2 - rll**2  # square of perpendicular component
-            up = rll + dlmag/2
-            low = rll - dlmag/2
-            num = up + np.sqrt(up**2 + rT2)
-            den = low + np.sqrt(low**2 + rT2)
-            tr[j, :] = np.log(num/den)/dlmag  # units of (1/um) use with imemb_ (total seg current)
+        if cutoff:
+            tr[r2 > cutoff**2] = 0.0  # ignore segments beyond cutoff distance from each site
 
-            # Consistent with NEURON extracellular recording example
-            # r = np.sqrt(rel_05[0,:]**2 + rel_05[1,:]**2 + rel_05[2,:]**2)
-            # tr_NEURON[j, :] = (rho / 4 / math.pi)*(1/r)*0.01
+        return tr
 
-        tr *= 1/(4*math.pi*sigma)  # units: 1/um / (mS/mm) = mm/um / mS = 1e3 * kOhm = MOhm
-        self.transferResistances[gid] = tr
+    def calcTransferResistance(self, gid, seg_coords):
+        """Precompute mapping from segment to electrode locations"""
+        self.transferResistances[gid] = self._transferResistance(seg_coords['p0'], seg_coords['p1'])
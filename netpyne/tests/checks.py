@@ -120,3 +120,34 @@ def checkOutput(modelName, verbose=False):
                     raise
 
         return True
+
+
+def checkImportTime(budget=1.0, modules=['netpyne', 'netpyne.sim', 'netpyne.specs'], heavyModules=['matplotlib', 'scipy', 'pandas', 'bokeh']):
+    """
+    Checks that importing the modules needed to run simulations takes less than budget seconds (measured in a new
+    Python process, excluding the interpreter startup and the import of NEURON) and does not import heavyModules
+    (optional dependencies only needed for plotting and analysis, imported on first use)
+    """
+
+    import sys, json, subprocess
+
+    if sys.version_info < (3, 7):
+        print('Import time not checked: subpackages are only imported on first use in Python >= 3.7')
+        return
+
+    code = ('import sys, json, time; import neuron; t = time.time(); ' + '; '.join(['import ' + m for m in modules]) +
+            '; print(json.dumps([time.time() - t, [m for m in %s if m in sys.modules]]))' % (json.dumps(heavyModules)))
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    importTime, imported = json.loads(output.strip().splitlines()[-1])
+
+    print('Import time of %s: %.2f s (budget: %.2f s)' % (', '.join(modules), importTime, budget))
+    try:
+        assert not imported
+    except:
+        print('\nMismatch: importing %s also imports %s' % (', '.join(modules), ', '.join(imported)))
+        raise
+    try:
+        assert importTime <= budget
+    except:
+        print('\nMismatch: import time is %.2f s but budget is %.2f s' % (importTime, budget))
+        raise